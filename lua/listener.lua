@@ -56,7 +56,9 @@ local create_table_sql = [[
         leg varchar(10) DEFAULT 'aleg',
         starting_date timestamp with time zone,
         status smallint,
-        created_date timestamp with time zone NOT NULL
+        created_date timestamp with time zone NOT NULL,
+        claimed_date timestamp with time zone,
+        requeue_count smallint NOT NULL DEFAULT 0
         );
     CREATE INDEX call_event_idx_status ON call_event (status);
     ]]
@@ -154,7 +154,8 @@ class CampaignSerializer(serializers.HyperlinkedModelSerializer):
             'phonebook', 'startingdate', 'expirationdate', 'aleg_gateway',
             'user', 'status', 'content_type', 'object_id', 'extra_data',
             'dnc', 'voicemail', 'amd_behavior', 'voicemail_audiofile',
-            'frequency', 'callmaxduration', 'maxretry', 'intervalretry',
+            'frequency', 'dialing_mode', 'max_abandon_rate',
+            'callmaxduration', 'maxretry', 'intervalretry',
             'calltimeout', 'daily_start_time', 'daily_stop_time',
             'monday', 'tuesday', 'wednesday', 'thursday', 'friday',
             'saturday', 'sunday', 'completion_maxretry', 'sms_gateway',
@@ -35,6 +35,7 @@ from apirest.view_survey import SurveyViewSet
 from apirest.view_section_template import SectionTemplateViewSet
 from apirest.view_branching_template import BranchingTemplateViewSet
 from apirest.view_survey_aggregate_result import SurveyAggregateResultViewSet
+from apirest.view_survey_result import SurveyResultViewSet
 from apirest.view_subscriber_per_campaign import SubscriberPerCampaignList
 # from apirest.view_queue import QueueViewSet
 # from apirest.view_tier import TierViewSet
@@ -103,6 +104,10 @@ urlpatterns = patterns('',
                        url(r'^rest-api/surveyaggregate/(?P<survey_id>[0-9]+)/$',
                            SurveyAggregateResultViewSet.as_view(), name="survey_aggregate_result"),
 
+                       url(r'^rest-api/surveyresult/$', SurveyResultViewSet.as_view(), name="survey_result"),
+                       url(r'^rest-api/surveyresult/(?P<survey_id>[0-9]+)/$',
+                           SurveyResultViewSet.as_view(), name="survey_result"),
+
                        url(r'^rest-api/bulkcontact/$', BulkContactViewSet.as_view(), name="bulk_contact"),
 
                        # subscriber rest api
@@ -18,8 +18,6 @@ from rest_framework.views import APIView
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from dialer_contact.models import Phonebook, Contact
 from dialer_contact.constants import CONTACT_STATUS
-from dialer_campaign.models import Campaign, Subscriber
-from dialer_campaign.constants import SUBSCRIBER_STATUS
 
 import logging
 logger = logging.getLogger('newfies.filelog')
@@ -74,43 +72,8 @@ class SubscriberViewSet(APIView):
             status=CONTACT_STATUS.ACTIVE,  # default active
             phonebook=obj_phonebook)
 
-        # Insert the contact to the subscriber also for
-        # each campaign using this phonebook
-        campaign_obj = Campaign.objects.filter(
-            phonebook=obj_phonebook,
-            user=request.user)
-
-        for c_campaign in campaign_obj:
-            imported_phonebook = []
-            if c_campaign.imported_phonebook:
-                # for example:- c_campaign.imported_phonebook = 1,2,3
-                # So convert imported_phonebook string into int list
-                imported_phonebook = map(int,
-                                         c_campaign.imported_phonebook.split(','))
-
-            phonebook_list = c_campaign.phonebook \
-                .values_list('id', flat=True) \
-                .all()
-            phonebook_list = map(int, phonebook_list)
-
-            common_phonebook_list = []
-            if phonebook_list:
-                common_phonebook_list = list(set(imported_phonebook) & set(phonebook_list))
-                if common_phonebook_list:
-                    contact_list = Contact.objects \
-                        .filter(phonebook__in=common_phonebook_list,
-                                status=CONTACT_STATUS.ACTIVE)
-                    for con_obj in contact_list:
-                        try:
-                            Subscriber.objects.create(
-                                contact=con_obj,
-                                duplicate_contact=con_obj.contact,
-                                status=SUBSCRIBER_STATUS.PENDING,  # PENDING
-                                campaign=c_campaign)
-                        except:
-                            error_msg = "Duplicate Subscriber"
-                            logger.error(error_msg)
-                            pass
+        # The contact is added to the subscribers of each campaign using
+        # this phonebook by the phonebook sync (post_save_add_contact)
 
         logger.debug('Subscriber POST API : result ok 200')
         return Response({'status': 'Contact created'})
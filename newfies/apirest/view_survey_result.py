@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from rest_framework.views import APIView
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.response import Response
+from survey.models import Survey
+from survey.pivot import SurveyResultPivot
+from dialer_cdr.models import VoIPCall
+import logging
+logger = logging.getLogger('newfies.filelog')
+
+
+class SurveyResultViewSet(APIView):
+
+    """
+    List the survey results per call, one row per call with the answer
+    to each question of the survey, paginated with ``page``
+
+    **Read**:
+
+        CURL Usage::
+
+            curl -u username:password -H 'Accept: application/json' http://localhost:8000/rest-api/surveyresult/%survey_id%/?page=1
+    """
+    authentication = (BasicAuthentication, SessionAuthentication)
+
+    def get(self, request, survey_id=0, format=None):
+        """GET method of survey result API"""
+        error = {}
+        if survey_id == 0:
+            error_msg = "Please enter Survey ID."
+            error['error'] = error_msg
+            logger.error(error_msg)
+            return Response(error)
+
+        survey_kwargs = {'id': survey_id}
+        if not request.user.is_superuser:
+            survey_kwargs['user'] = request.user
+        try:
+            survey = Survey.objects.get(**survey_kwargs)
+        except Survey.DoesNotExist:
+            error_msg = "Survey ID is not valid!"
+            error['error'] = error_msg
+            logger.error(error_msg)
+            return Response(error)
+        if survey.campaign_id is None:
+            error_msg = "Survey is not attached to a campaign!"
+            error['error'] = error_msg
+            logger.error(error_msg)
+            return Response(error)
+
+        # The calls of a survey are the calls of its campaign
+        voipcall_list = VoIPCall.objects.filter(callrequest__campaign_id=survey.campaign_id).order_by('id')\
+            .values('id', 'callrequest_id', 'starting_date', 'phone_number', 'duration', 'disposition')
+        paginator = Paginator(voipcall_list, settings.REST_FRAMEWORK['PAGINATE_BY'])
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+
+        # Answers of the calls of the page, in one query
+        pivot = SurveyResultPivot(survey.id)
+        question_list = pivot.get_questions()
+        call_list = list(page.object_list)
+        answer_dict = pivot.get_answers([call['callrequest_id'] for call in call_list if call['callrequest_id']])
+        for call in call_list:
+            call['result'] = dict(zip(question_list, answer_dict.get(call['callrequest_id'], [])))
+
+        return Response({
+            'count': paginator.count,
+            'page': page.number,
+            'num_pages': paginator.num_pages,
+            'questions': question_list,
+            'results': call_list,
+        })
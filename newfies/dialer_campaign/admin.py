@@ -48,7 +48,8 @@ class CampaignAdmin(GenericAdminModelAdmin):
         }),
         (_('Advanced options'), {
             'classes': ('collapse', ),
-            'fields': ('frequency', 'callmaxduration', 'maxretry',
+            'fields': ('frequency', 'dialing_mode', 'max_abandon_rate',
+                       'callmaxduration', 'maxretry',
                        'intervalretry', 'calltimeout', 'imported_phonebook',
                        'daily_start_time', 'daily_stop_time',
                        'monday', 'tuesday', 'wednesday',
@@ -62,7 +63,7 @@ class CampaignAdmin(GenericAdminModelAdmin):
                     'startingdate', 'expirationdate', 'frequency',
                     'callmaxduration', 'maxretry', 'aleg_gateway', 'sms_gateway',
                     'status', 'update_campaign_status', 'totalcontact',
-                    'completed', 'subscriber_detail', 'progress_bar')
+                    'completed', 'subscriber_detail', 'progress_bar', 'import_progress')
 
     list_display_links = ('id', 'name', )
     # list_filter doesn't display correctly too many elements in list_display
@@ -0,0 +1,120 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from datetime import datetime
+from django.utils.timezone import utc
+import time
+
+
+def is_running_now(campaign, tday=None, today=None):
+    """
+    Return True if a started campaign is running, same rules as
+    build_kwargs_runnning_campaign: between the starting and expiration
+    date, the daily start and stop time, on an enabled weekday
+    """
+    if tday is None:
+        tday = datetime.utcnow().replace(tzinfo=utc)
+    if today is None:
+        today = datetime.now()
+    now_time = today.time().replace(microsecond=0)
+    return campaign.startingdate <= tday <= campaign.expirationdate \
+        and campaign.daily_start_time <= now_time <= campaign.daily_stop_time \
+        and getattr(campaign, tday.strftime("%A").lower()) == 1
+
+
+class CampaignConfigCache(object):
+
+    """
+    Per worker cache of the started campaigns with their configuration
+    (user, dialer setting, gateway...), the running campaigns are selected
+    in Python at each heartbeat without query
+
+    The cache is versioned: the version kept in the shared cache is
+    incremented on save of a campaign, each worker reloads its campaigns
+    when the version changed or after CAMPAIGN_CONFIG_TIMEOUT seconds.
+    Counters updated with queryset.update, like totalcontact, can be stale,
+    the instances are not meant to be saved.
+
+    **Attributes**:
+
+        * ``model`` - Campaign model
+        * ``status_start`` - Status of the started campaigns
+        * ``related`` - Relations loaded with select_related
+
+    **Usage**:
+
+        campaign_config = CampaignConfigCache(Campaign, CAMPAIGN_STATUS.START, ('user', 'aleg_gateway'))
+        for campaign in campaign_config.get_running_campaign():
+            ...
+    """
+
+    def __init__(self, model, status_start, related=()):
+        self.model = model
+        self.status_start = status_start
+        self.related = related
+        self.version_key = 'campaign_config_version_%s' % model._meta.db_table
+        self.version = None
+        self.loaded = 0
+        self.campaigns = {}
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, 1, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self, *args, **kwargs):
+        """Increment the version, can be connected to the model signals"""
+        cache.add(self.version_key, 1, None)
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            # Key evicted between add and incr
+            pass
+        # Don't wait for the next heartbeat in the process which saved
+        self.version = None
+
+    def refresh(self):
+        version = self.get_version()
+        if version is not None and version == self.version and \
+                time.time() - self.loaded < settings.CAMPAIGN_CONFIG_TIMEOUT:
+            return
+        tday = datetime.utcnow().replace(tzinfo=utc)
+        list_campaign = self.model.objects.select_related(*self.related)\
+            .filter(status=self.status_start, expirationdate__gte=tday).order_by('id')
+        self.campaigns = dict((campaign.id, campaign) for campaign in list_campaign)
+        self.version = version
+        self.loaded = time.time()
+
+    def get_running_campaign(self):
+        """Return the list of the running campaigns"""
+        self.refresh()
+        tday = datetime.utcnow().replace(tzinfo=utc)
+        today = datetime.now()
+        return [self.campaigns[campaign_id] for campaign_id in sorted(self.campaigns)
+                if is_running_now(self.campaigns[campaign_id], tday, today)]
+
+    def get(self, campaign_id):
+        """
+        Return the campaign with its configuration, the campaigns which are
+        not started are read from the database
+        """
+        self.refresh()
+        campaign = self.campaigns.get(int(campaign_id))
+        if campaign is None:
+            campaign = self.model.objects.select_related(*self.related).get(id=campaign_id)
+        return campaign
@@ -75,3 +75,9 @@ class AMD_BEHAVIOR(Choice):
     ALWAYS = 1, _('ALWAYS PLAY MESSAGE')
     HUMAN_ONLY = 2, _('PLAY MESSAGE TO HUMAN ONLY')
     VOICEMAIL_ONLY = 3, _('LEAVE MESSAGE TO VOICEMAIL ONLY')
+
+
+class DIALING_MODE(Choice):
+    FIXED = 1, _('FIXED')
+    PROGRESSIVE = 2, _('PROGRESSIVE')
+    PREDICTIVE = 3, _('PREDICTIVE')
@@ -0,0 +1,61 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from dialer_campaign.models import Campaign, Subscriber
+from dialer_campaign.function_def import get_subscriber_status
+from mod_utils.exporter import Exporter
+
+
+class SubscriberExporter(Exporter):
+
+    """
+    Export the subscribers of the subscriber list, the kwargs are the
+    filters of the list (``request.session['subscriber_list_kwargs']``)
+    """
+    headers = ('contact', 'updated_date', 'count_attempt', 'completion_count_attempt',
+               'status', 'disposition', 'collected_data', )  # 'agent',
+    fields = ('contact__contact', 'updated_date', 'count_attempt', 'completion_count_attempt',
+              'status', 'campaign_id', 'disposition', 'collected_data')
+
+    def __init__(self, user, kwargs):
+        super(SubscriberExporter, self).__init__(user, kwargs)
+        # Dispositions of the lead_disposition of each campaign exported
+        self.campaign_disposition = {}
+
+    def get_queryset(self):
+        if self.user.is_superuser:
+            subscriber_list = Subscriber.objects.all()
+        else:
+            subscriber_list = Subscriber.objects.filter(campaign__user=self.user)
+        return subscriber_list.filter(**self.kwargs)
+
+    def get_disposition(self, campaign_id, disposition):
+        """Same as get_subscriber_disposition with one query per campaign"""
+        if campaign_id not in self.campaign_disposition:
+            lead_disposition = Campaign.objects.filter(pk=campaign_id).values_list('lead_disposition', flat=True)
+            if lead_disposition:
+                dsp_list = [i.strip() for i in (lead_disposition[0] or '').split(',')]
+            else:
+                dsp_list = []
+            self.campaign_disposition[campaign_id] = dsp_list
+        dsp_list = self.campaign_disposition[campaign_id]
+        if disposition and 0 < disposition <= len(dsp_list):
+            return dsp_list[disposition - 1]
+        return '-'
+
+    def format_row(self, row):
+        (contact, updated_date, count_attempt, completion_count_attempt,
+         status, campaign_id, disposition, collected_data) = row
+        return (contact, updated_date, count_attempt, completion_count_attempt,
+                get_subscriber_status(status), self.get_disposition(campaign_id, disposition), collected_data)
@@ -142,6 +142,8 @@ class CampaignForm(ModelForm):
                         Div(Fieldset(_('Dialer Settings')), css_class='col-md-12'),
                         Div('aleg_gateway', css_class=css_class),
                         Div('frequency', css_class=css_class),
+                        Div('dialing_mode', css_class=css_class),
+                        Div('max_abandon_rate', css_class=css_class),
                         Div('callmaxduration', css_class=css_class),
                         Div('maxretry', css_class=css_class),
                         Div('intervalretry', css_class=css_class),
@@ -348,7 +350,8 @@ class CampaignAdminForm(ModelForm):
         fields = ['campaign_code', 'name', 'description', 'user', 'status',
                   'callerid', 'caller_name', 'startingdate', 'expirationdate',
                   'aleg_gateway', 'sms_gateway', 'content_type', 'object_id', 'extra_data',
-                  'phonebook', 'frequency', 'callmaxduration', 'maxretry',
+                  'phonebook', 'frequency', 'dialing_mode', 'max_abandon_rate',
+                  'callmaxduration', 'maxretry',
                   'intervalretry', 'calltimeout', 'daily_start_time',
                   'daily_stop_time', 'monday', 'tuesday', 'wednesday',
                   'thursday', 'friday', 'saturday', 'sunday',
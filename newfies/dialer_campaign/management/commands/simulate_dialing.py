@@ -0,0 +1,76 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.management.base import BaseCommand
+from optparse import make_option
+from dialer_campaign.constants import DIALING_MODE
+from dialer_campaign.predictive import DialingSimulator
+
+
+class Command(BaseCommand):
+    args = 'agent, answer_rate, handle_time, ring_time, max_abandon_rate, duration'
+    help = "Simulate the dialing modes offline for a team of agents\n" \
+           "--------------------------------------------------------\n" \
+           "python manage.py simulate_dialing --agent=10 --answer_rate=0.25 --handle_time=120 --max_abandon_rate=3"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--agent', default='10', dest='agent',
+                    help="number of agents"),
+        make_option('--answer_rate', default='0.25', dest='answer_rate',
+                    help="ratio of calls answered"),
+        make_option('--handle_time', default='120', dest='handle_time',
+                    help="average seconds an agent is busy per call"),
+        make_option('--ring_time', default='20', dest='ring_time',
+                    help="seconds before a call is answered or not"),
+        make_option('--frequency', default='0', dest='frequency',
+                    help="calls per minute, ceiling of the progressive and predictive modes"),
+        make_option('--max_abandon_rate', default='3', dest='max_abandon_rate',
+                    help="maximum percentage of answered calls without agent"),
+        make_option('--duration', default='3600', dest='duration',
+                    help="seconds to simulate"),
+        make_option('--seed', default=None, dest='seed',
+                    help="random seed"),
+    )
+
+    def handle(self, *args, **options):
+        """Run the simulation for each dialing mode and print the statistics"""
+        try:
+            agent = int(options.get('agent'))
+            answer_rate = float(options.get('answer_rate'))
+            handle_time = int(options.get('handle_time'))
+            ring_time = int(options.get('ring_time'))
+            frequency = int(options.get('frequency'))
+            max_abandon_rate = float(options.get('max_abandon_rate')) / 100
+            duration = int(options.get('duration'))
+        except ValueError:
+            print "Wrong parameter"
+            return False
+
+        for dialing_mode, name in DIALING_MODE:
+            if dialing_mode == DIALING_MODE.FIXED and not frequency:
+                continue
+            simulator = DialingSimulator(
+                dialing_mode, agent=agent, answer_rate=answer_rate, handle_time=handle_time,
+                ring_time=ring_time, frequency=frequency, max_abandon_rate=max_abandon_rate,
+                seed=options.get('seed'))
+            result = simulator.run(duration)
+            print "%(mode)s : placed=%(placed)d answered=%(answered)d abandoned=%(abandoned)d " \
+                "abandon_rate=%(abandon_rate).2f%% agent_occupancy=%(agent_occupancy).2f%%" % {
+                    'mode': name,
+                    'placed': result['placed'],
+                    'answered': result['answered'],
+                    'abandoned': result['abandoned'],
+                    'abandon_rate': result['abandon_rate'] * 100,
+                    'agent_occupancy': result['agent_occupancy'] * 100,
+                }
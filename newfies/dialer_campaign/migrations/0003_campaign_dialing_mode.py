@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_campaign', '0002_campaign_stoppeddate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='dialing_mode',
+            field=models.IntegerField(default=1, help_text='progressive and predictive modes dial according to the available agents', verbose_name='dialing mode', choices=[(1, 'FIXED'), (2, 'PROGRESSIVE'), (3, 'PREDICTIVE')]),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='max_abandon_rate',
+            field=models.IntegerField(default=3, help_text='maximum percentage of answered calls without agent in predictive mode', null=True, verbose_name='max abandon rate', blank=True),
+            preserve_default=True,
+        ),
+    ]
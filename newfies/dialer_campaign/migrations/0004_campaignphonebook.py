@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_contact', '0001_initial'),
+        ('dialer_campaign', '0003_campaign_dialing_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampaignPhonebook',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('last_contact_id', models.IntegerField(default=0, verbose_name='last contact imported')),
+                ('updated_date', models.DateTimeField(auto_now=True)),
+                ('campaign', models.ForeignKey(to='dialer_campaign.Campaign')),
+                ('phonebook', models.ForeignKey(to='dialer_contact.Phonebook')),
+            ],
+            options={
+                'db_table': 'dialer_campaign_phonebook',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='campaignphonebook',
+            unique_together=set([('campaign', 'phonebook')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_campaign', '0004_campaignphonebook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaignphonebook',
+            name='count_read',
+            field=models.IntegerField(default=0, verbose_name='contacts read'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='campaignphonebook',
+            name='total_contact',
+            field=models.IntegerField(default=0, verbose_name='total contact'),
+            preserve_default=True,
+        ),
+    ]
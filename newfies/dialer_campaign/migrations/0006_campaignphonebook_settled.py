@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_campaign', '0005_campaignphonebook_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaignphonebook',
+            name='settled_contact_id',
+            field=models.IntegerField(default=0, verbose_name='last contact settled'),
+            preserve_default=True,
+        ),
+    ]
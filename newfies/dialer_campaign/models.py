@@ -13,32 +13,36 @@
 #
 
 from django.db import models
+from django.db.models import Max
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ugettext
 from django.utils.timezone import now
 from django.core.urlresolvers import reverse
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
-from django.db import transaction
+from django.db import transaction, connection
+from django.conf import settings
 
 from django_lets_go.intermediate_model_base_class import Model
 from django_lets_go.common_functions import get_unique_code, percentage
 from audiofield.models import AudioFile
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.utils.timezone import utc
 from dateutil.relativedelta import relativedelta
 import jsonfield
 import logging
-import re
 
-from .constants import SUBSCRIBER_STATUS, CAMPAIGN_STATUS, AMD_BEHAVIOR
+from .constants import SUBSCRIBER_STATUS, CAMPAIGN_STATUS, AMD_BEHAVIOR, DIALING_MODE
 from dialer_contact.constants import CONTACT_STATUS
 from dialer_contact.models import Phonebook, Contact
 from dialer_gateway.models import Gateway
 from sms.models import Gateway as SMS_Gateway
-from dnc.models import DNC
+from dnc.models import DNC, DNCContact
+from dialer_settings.models import DialerSetting
+from dialer_settings.matcher import get_contact_authorization
+from dialer_campaign.config import CampaignConfigCache
 # from agent.models import Agent
 
 logger = logging.getLogger('newfies.filelog')
@@ -76,7 +80,10 @@ class CampaignManager(models.Manager):
 
     def get_running_campaign(self):
         """Return all the active campaigns which will be running based on
-        the expiry date, the daily start/stop time and days of the week"""
+        the expiry date, the daily start/stop time and days of the week
+
+        The dialer tasks use campaign_config.get_running_campaign instead,
+        which doesn't query the database at each heartbeat"""
 
         kwargs = build_kwargs_runnning_campaign()
         return Campaign.objects.filter(**kwargs)
@@ -96,29 +103,7 @@ def common_contact_authorization(dialersetting, str_contact):
     Common Function to check contact no is authorized or not.
     For this we will check the dialer settings : whitelist and blacklist
     """
-    whitelist = dialersetting.whitelist
-    blacklist = dialersetting.blacklist
-
-    if whitelist == '*':
-        whitelist = ''
-    if blacklist == '*':
-        blacklist = ''
-
-    if whitelist and len(whitelist) > 0:
-        try:
-            if re.search(whitelist, str_contact):
-                return True
-        except ValueError:
-            logger.error('Error to identify the whitelist')
-
-    if blacklist and len(blacklist) > 0:
-        try:
-            if re.search(blacklist, str_contact):
-                return False
-        except ValueError:
-            logger.error('Error to identify the blacklist')
-
-    return True
+    return get_contact_authorization(dialersetting).is_authorized(str_contact)
 
 
 def set_campaign_code():
@@ -147,6 +132,9 @@ class Campaign(Model):
         * ``week_day_setting`` (monday, tuesday, wednesday, thursday, friday, \
         saturday, sunday)
         * ``frequency`` - Frequency, speed of the campaign. number of calls/min
+        * ``dialing_mode`` - Fixed frequency, progressive or predictive dialing
+        * ``max_abandon_rate`` - Maximum percentage of answered calls abandoned \
+            for lack of agent in predictive mode
         * ``callmaxduration`` - Max call duration allowed
         * ``maxretry`` - Max retry allowed per user
         * ``intervalretry`` - Time to wait between retries in seconds
@@ -215,6 +203,11 @@ class Campaign(Model):
     # Campaign Settings
     frequency = models.IntegerField(default='10', blank=True, null=True, verbose_name=_('frequency'),
                                     help_text=_("calls per minute"))
+    dialing_mode = models.IntegerField(choices=list(DIALING_MODE), default=DIALING_MODE.FIXED,
+                                       verbose_name=_("dialing mode"),
+                                       help_text=_("progressive and predictive modes dial according to the available agents"))
+    max_abandon_rate = models.IntegerField(default=3, blank=True, null=True, verbose_name=_('max abandon rate'),
+                                           help_text=_("maximum percentage of answered calls without agent in predictive mode"))
     callmaxduration = models.IntegerField(default='1800', blank=True, null=True, verbose_name=_('max call duration'),
                                           help_text=_("maximum call duration in seconds"))
     # max retry on failure - Note that the answered call not completed are counted
@@ -422,26 +415,131 @@ class Campaign(Model):
     subscriber_detail.allow_tags = True
     subscriber_detail.short_description = _('subscriber')
 
+    def import_progress(self):
+        """Percentage of the contacts of the phonebooks imported, the large
+        phonebooks are imported by chunk while the campaign is dialing"""
+        count_read = total_contact = 0
+        for (item_read, item_total) in CampaignPhonebook.objects.filter(campaign_id=self.id)\
+                .values_list('count_read', 'total_contact'):
+            count_read += item_read
+            total_contact += max(item_read, item_total)
+        if not total_contact:
+            return 0
+        return count_read * 100 / total_contact
+    import_progress.short_description = _('import progress')
+
     # OPTIMIZATION - GOOD
     @transaction.atomic
-    def get_pending_subscriber_update(self, limit, status):
-        """Get all the pending subscribers from the campaign"""
-        # TODO: Improve this part with a PL/SQL
+    def get_pending_subscriber_update(self, limit, status, exclude_dnc=False):
+        """
+        Get all the pending subscribers from the campaign
+
+        The subscribers are claimed: their status is updated and the list of
+        subscribers is returned with their count. On PostgreSQL the claim is a
+        single statement and the rows locked by another worker are skipped,
+        only id, contact_id & duplicate_contact of the subscribers are loaded.
+
+        With exclude_dnc, the subscribers in the DNC list of the campaign are
+        not claimed, those met before the last claimed subscriber are flagged
+        NOT_AUTHORIZED
+        """
+        if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+            if exclude_dnc and self.dnc_id:
+                return self.get_pending_subscriber_update_dnc(limit, status)
+            return self.claim_pending_subscriber(limit, status)
 
         # We cannot use select_related here as it's not compliant with locking the rows
         list_subscriber = Subscriber.objects.select_for_update()\
-            .filter(campaign=self.id, status=SUBSCRIBER_STATUS.PENDING)\
-            .all()[:limit]
+            .filter(campaign=self.id, status=SUBSCRIBER_STATUS.PENDING)
+        if exclude_dnc and self.dnc_id:
+            list_dnc_contact = DNCContact.objects.filter(dnc_id=self.dnc_id).values('phone_number')
+            list_subscriber = list_subscriber.exclude(duplicate_contact__in=list_dnc_contact)
+        # Evaluate the rows locked, the queryset would select other rows once updated
+        list_subscriber = list(list_subscriber.order_by('id')[:limit])
         if not list_subscriber:
+            if exclude_dnc and self.dnc_id:
+                Subscriber.objects\
+                    .filter(campaign=self.id, status=SUBSCRIBER_STATUS.PENDING, duplicate_contact__in=list_dnc_contact)\
+                    .update(status=SUBSCRIBER_STATUS.NOT_AUTHORIZED)
             return (False, 0)
-        id_list_sb = []
-        count = 0
-        for elem_subscriber in list_subscriber:
-            count = count + 1
-            id_list_sb.append(elem_subscriber.id)
+        id_list_sb = [elem_subscriber.id for elem_subscriber in list_subscriber]
         #Update in bulk
         Subscriber.objects.filter(id__in=id_list_sb).update(status=status)
-        return (list_subscriber, count)
+        for elem_subscriber in list_subscriber:
+            elem_subscriber.status = status
+        if exclude_dnc and self.dnc_id:
+            Subscriber.objects\
+                .filter(campaign=self.id, status=SUBSCRIBER_STATUS.PENDING, id__lt=id_list_sb[-1],
+                        duplicate_contact__in=list_dnc_contact)\
+                .update(status=SUBSCRIBER_STATUS.NOT_AUTHORIZED)
+        return (list_subscriber, len(list_subscriber))
+
+    def claim_pending_subscriber(self, limit, status):
+        """
+        Claim the pending subscribers of the campaign in a single statement
+        (PostgreSQL 9.5+), the pending rows locked by a concurrent claim are
+        skipped instead of waiting for the other transaction
+        """
+        sql_statement = """
+            UPDATE dialer_subscriber SET status = %(status)s, updated_date = %(now)s
+            WHERE id IN (
+                SELECT id FROM dialer_subscriber
+                WHERE campaign_id = %(campaign_id)s AND status = %(pending)s
+                ORDER BY id LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED)
+            RETURNING id, contact_id, duplicate_contact"""
+        list_subscriber = list(Subscriber.objects.raw(sql_statement, {
+            'campaign_id': self.id,
+            'pending': SUBSCRIBER_STATUS.PENDING,
+            'status': status,
+            'limit': limit,
+            'now': datetime.utcnow().replace(tzinfo=utc),
+        }))
+        if not list_subscriber:
+            return (False, 0)
+        list_subscriber.sort(key=lambda elem_subscriber: elem_subscriber.id)
+        return (list_subscriber, len(list_subscriber))
+
+    def get_pending_subscriber_update_dnc(self, limit, status):
+        """
+        Claim the pending subscribers which are not in the DNC list of the
+        campaign in a single statement (PostgreSQL 9.5+), the anti-join uses
+        the index (dnc_id, phone_number) of dnc_contact
+        """
+        sql_statement = """
+            WITH dialable AS (
+                SELECT s.id FROM dialer_subscriber s
+                WHERE s.campaign_id = %(campaign_id)s AND s.status = %(pending)s
+                AND NOT EXISTS (SELECT 1 FROM dnc_contact c
+                                WHERE c.dnc_id = %(dnc_id)s AND c.phone_number = s.duplicate_contact)
+                ORDER BY s.id LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ), excluded AS (
+                UPDATE dialer_subscriber SET status = %(not_authorized)s, updated_date = %(now)s
+                WHERE id IN (
+                    SELECT s.id FROM dialer_subscriber s
+                    WHERE s.campaign_id = %(campaign_id)s AND s.status = %(pending)s
+                    AND s.id < COALESCE((SELECT MAX(id) FROM dialable), 2147483647)
+                    AND EXISTS (SELECT 1 FROM dnc_contact c
+                                WHERE c.dnc_id = %(dnc_id)s AND c.phone_number = s.duplicate_contact)
+                    FOR UPDATE SKIP LOCKED)
+            )
+            UPDATE dialer_subscriber SET status = %(status)s, updated_date = %(now)s
+            WHERE id IN (SELECT id FROM dialable)
+            RETURNING id, contact_id, duplicate_contact"""
+        list_subscriber = list(Subscriber.objects.raw(sql_statement, {
+            'campaign_id': self.id,
+            'dnc_id': self.dnc_id,
+            'pending': SUBSCRIBER_STATUS.PENDING,
+            'not_authorized': SUBSCRIBER_STATUS.NOT_AUTHORIZED,
+            'status': status,
+            'limit': limit,
+            'now': datetime.utcnow().replace(tzinfo=utc),
+        }))
+        if not list_subscriber:
+            return (False, 0)
+        list_subscriber.sort(key=lambda elem_subscriber: elem_subscriber.id)
+        return (list_subscriber, len(list_subscriber))
 
 
 class Subscriber(Model):
@@ -532,6 +630,167 @@ class Subscriber(Model):
     """
 
 
+class CampaignPhonebook(models.Model):
+
+    """High-water mark of the import of a phonebook into the subscribers of
+    a campaign, the contacts are imported by chunk in the order of their id
+
+    **Attributes**:
+
+        * ``last_contact_id`` - ID of the last contact imported
+        * ``settled_contact_id`` - ID up to which all the contacts were committed
+        * ``count_read`` - Contacts of the phonebook read so far
+        * ``total_contact`` - Contacts of the phonebook when the import started
+
+    **Relationships**:
+
+        * ``campaign`` - Foreign key relationship to the Campaign model.
+        * ``phonebook`` - Foreign key relationship to the Phonebook model.
+
+    **Name of DB table**: dialer_campaign_phonebook
+    """
+    campaign = models.ForeignKey(Campaign)
+    phonebook = models.ForeignKey(Phonebook)
+    last_contact_id = models.IntegerField(default=0, verbose_name=_("last contact imported"))
+    settled_contact_id = models.IntegerField(default=0, verbose_name=_("last contact settled"))
+    count_read = models.IntegerField(default=0, verbose_name=_("contacts read"))
+    total_contact = models.IntegerField(default=0, verbose_name=_("total contact"))
+    updated_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = u'dialer_campaign_phonebook'
+        unique_together = ['campaign', 'phonebook']
+
+    def __unicode__(self):
+        return u"%s - %s" % (self.campaign_id, self.phonebook_id)
+
+    def import_chunk(self, limit, rescan=False):
+        """
+        Import the active contacts of the next chunk of limit contacts of the
+        phonebook, return (contacts read, subscribers created)
+
+        The chunk is the range of contact ids after the high-water mark, on
+        PostgreSQL the subscribers already created are skipped by the unique
+        constraint (contact, campaign) instead of locking the table. The chunk is
+        committed with the high-water mark and the totalcontact of the
+        campaign, so the campaign can dial it while the next chunks import.
+
+        The ids are allocated before the contacts are committed, a contact
+        committed after a higher id was imported is below the mark. With
+        rescan, the contacts created less than SUBSCRIBER_SPOOL_RESCAN_DELAY
+        seconds ago between the settled mark and the high-water mark are
+        scanned again to import them. The settled mark then moves up to the
+        last contact created before that delay, the transactions of the
+        contacts below it are committed. A subscriber deleted on purpose is
+        only created again while its contact is that recent.
+        """
+        now = datetime.utcnow().replace(tzinfo=utc)
+        settled_date = now - timedelta(seconds=settings.SUBSCRIBER_SPOOL_RESCAN_DELAY)
+        # Without rescan the range of contacts below the mark is empty
+        rescan_contact_id = self.settled_contact_id if rescan else self.last_contact_id
+        with transaction.atomic():
+            if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+                (max_contact_id, count_read, count_inserted) = \
+                    self.insert_chunk_subscriber(limit, rescan_contact_id, settled_date, now)
+            else:
+                (max_contact_id, count_read, count_inserted) = \
+                    self.create_chunk_subscriber(limit, rescan_contact_id, settled_date)
+            settled_contact_id = None
+            if rescan:
+                settled_contact_id = Contact.objects.filter(
+                    phonebook_id=self.phonebook_id, id__gt=self.settled_contact_id,
+                    id__lte=max_contact_id or self.last_contact_id,
+                    created_date__lt=settled_date).aggregate(Max('id'))['id__max']
+            if count_read or settled_contact_id:
+                if count_read:
+                    self.last_contact_id = max_contact_id
+                    self.count_read += count_read
+                    if count_read < limit:
+                        # Up to date, the new contacts are counted from now on
+                        self.total_contact = self.count_read
+                if settled_contact_id:
+                    self.settled_contact_id = settled_contact_id
+                self.save()
+            if count_inserted:
+                cursor = connection.cursor()
+                cursor.execute("UPDATE dialer_campaign SET totalcontact = COALESCE(totalcontact, 0) + %s "
+                               "WHERE id = %s", [count_inserted, self.campaign_id])
+        return (count_read, count_inserted)
+
+    def insert_chunk_subscriber(self, limit, rescan_contact_id, settled_date, now):
+        """
+        Insert the subscribers of the chunk in one statement on PostgreSQL,
+        return (last contact id, contacts read, subscribers created)
+        """
+        sql_statement = """
+            WITH chunk AS (
+                SELECT id, contact, status FROM dialer_contact
+                WHERE phonebook_id = %(phonebook_id)s AND id > %(last_contact_id)s
+                ORDER BY id LIMIT %(limit)s
+            ), rescan AS (
+                SELECT id, contact, status FROM dialer_contact
+                WHERE phonebook_id = %(phonebook_id)s
+                AND id > %(rescan_contact_id)s AND id <= %(last_contact_id)s
+                AND created_date >= %(settled_date)s
+            ), inserted AS (
+                INSERT INTO dialer_subscriber
+                (contact_id, campaign_id, duplicate_contact, status, created_date, updated_date)
+                SELECT c.id, %(campaign_id)s, c.contact, %(pending)s, %(now)s, %(now)s
+                FROM (SELECT * FROM chunk UNION ALL SELECT * FROM rescan) c
+                WHERE c.status = %(active)s
+                ON CONFLICT (contact_id, campaign_id) DO NOTHING
+                RETURNING 1
+            )
+            SELECT (SELECT MAX(id) FROM chunk), (SELECT COUNT(*) FROM chunk), (SELECT COUNT(*) FROM inserted)"""
+        cursor = connection.cursor()
+        cursor.execute(sql_statement, {
+            'campaign_id': self.campaign_id,
+            'phonebook_id': self.phonebook_id,
+            'last_contact_id': self.last_contact_id,
+            'rescan_contact_id': rescan_contact_id,
+            'settled_date': settled_date,
+            'limit': limit,
+            'pending': SUBSCRIBER_STATUS.PENDING,
+            'active': CONTACT_STATUS.ACTIVE,
+            'now': now,
+        })
+        return cursor.fetchone()
+
+    def create_chunk_subscriber(self, limit, rescan_contact_id, settled_date):
+        """
+        Create the subscribers of the chunk with the ORM on the other
+        databases, return (last contact id, contacts read, subscribers created)
+
+        The subscribers already created are read by range of contact id,
+        the collect of the campaign is locked so they can't be created
+        meanwhile
+        """
+        list_contact = Contact.objects.filter(phonebook_id=self.phonebook_id)\
+            .values_list('id', 'contact', 'status')
+        chunk = list(list_contact.filter(id__gt=self.last_contact_id).order_by('id')[:limit])
+        rescan = list(list_contact.filter(id__gt=rescan_contact_id, id__lte=self.last_contact_id,
+                                          created_date__gte=settled_date))
+        if not chunk and not rescan:
+            return (None, 0, 0)
+        max_contact_id = chunk[-1][0] if chunk else None
+        list_existing = set(Subscriber.objects.filter(
+            campaign_id=self.campaign_id, contact_id__gt=rescan_contact_id,
+            contact_id__lte=max_contact_id or self.last_contact_id).values_list('contact_id', flat=True))
+        list_subscriber = [
+            Subscriber(contact_id=contact_id, campaign_id=self.campaign_id, duplicate_contact=contact,
+                       status=SUBSCRIBER_STATUS.PENDING)
+            for (contact_id, contact, status) in chunk + rescan
+            if status == CONTACT_STATUS.ACTIVE and contact_id not in list_existing]
+        Subscriber.objects.bulk_create(list_subscriber)
+        return (max_contact_id, len(chunk), len(list_subscriber))
+
+    def get_progress(self):
+        """Percentage of the contacts of the phonebook read"""
+        if not self.count_read:
+            return 0
+        return self.count_read * 100 / max(self.total_contact, self.count_read)
+
+
 # Note : This will cause the running campaign to add the new contacts to the subscribers list
 def post_save_add_contact(sender, **kwargs):
     """A ``post_save`` signal is sent by the Contact model instance whenever
@@ -539,31 +798,30 @@ def post_save_add_contact(sender, **kwargs):
 
     **Logic Description**:
 
-        * When new contact is added into ``Contact`` model, active the
-          campaign list will be checked with the contact status.
-        * If the active campaign list count is more than one & the contact
-          is active, the contact will be added into ``Subscriber``
-          model.
+        * When a new active contact is added into ``Contact`` model, a sync
+          of the subscribers of its phonebook is scheduled.
+        * The contacts created in the meantime are coalesced, the sync
+          imports them into the running campaigns by chunk.
     """
     obj = kwargs['instance']
-    active_campaign_list = Campaign.objects.filter(phonebook__contact__id=obj.id,
-                                                   status=CAMPAIGN_STATUS.START)
-    # created instance = True + active contact + active_campaign
-    if kwargs['created'] and obj.status == CONTACT_STATUS.ACTIVE \
-            and active_campaign_list.count() >= 1:
-        for elem_campaign in active_campaign_list:
-            try:
-                Subscriber.objects.create(
-                    contact=obj,
-                    duplicate_contact=obj.contact,
-                    status=SUBSCRIBER_STATUS.PENDING,
-                    campaign=elem_campaign)
-            except:
-                pass
+    if kwargs['created'] and obj.status == CONTACT_STATUS.ACTIVE:
+        from dialer_contact.tasks import schedule_phonebook_sync
+        schedule_phonebook_sync(obj.phonebook_id)
 
 post_save.connect(post_save_add_contact, sender=Contact)
 
 
+# Started campaigns with the configuration used by the dialer, cached per worker
+campaign_config = CampaignConfigCache(
+    Campaign, CAMPAIGN_STATUS.START, ('user__userprofile__dialersetting', 'aleg_gateway', 'content_type'))
+
+post_save.connect(campaign_config.invalidate, sender=Campaign)
+post_delete.connect(campaign_config.invalidate, sender=Campaign)
+post_save.connect(campaign_config.invalidate, sender=Gateway)
+post_save.connect(campaign_config.invalidate, sender=DialerSetting)
+# The UserProfile signal is connected in user_profile.models
+
+
 # def post_update_campaign_status(sender, **kwargs):
 #     """A ``post_save`` signal is sent by the Campaign model instance whenever
 #     it is going to save.
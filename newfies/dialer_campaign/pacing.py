@@ -0,0 +1,227 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg, Count
+from celery.utils.log import get_task_logger
+from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_cdr.constants import CALLREQUEST_STATUS, CALL_DISPOSITION
+from datetime import datetime, timedelta
+from django.utils.timezone import utc
+import time
+
+logger = get_task_logger(__name__)
+
+# Keep the pacing state of a campaign one day after its last tick
+PACING_TIMEOUT = 60 * 60 * 24
+
+
+def pacing_key(campaign_id):
+    return 'campaign_pacing_%d' % int(campaign_id)
+
+
+def get_campaign_frequency(obj_campaign):
+    """
+    Return the calls per minute allowed for the campaign, the campaign
+    frequency is bounded by the max_frequency of the user's dialer setting
+    """
+    frequency = obj_campaign.frequency or 0
+    try:
+        max_frequency = obj_campaign.user.userprofile.dialersetting.max_frequency
+    except AttributeError:
+        max_frequency = None
+    if max_frequency:
+        frequency = min(frequency, max_frequency)
+    return max(frequency, 0)
+
+
+class CampaignPacer(object):
+
+    """
+    Pace the calls of a campaign with a token bucket
+
+    Tokens are added continuously at the rate of the campaign, a tick can
+    only spool the tokens accumulated since the previous tick, the fraction
+    of call left is carried over the next tick. The rate is multiplied by
+    a speed factor in [PACING_MIN_FACTOR, 1] computed by a PI controller
+    which slows down the campaign when the calls spooled are not originated
+    in time or when there are more live channels than expected.
+
+    **Attributes**:
+
+        * ``campaign_id`` - Campaign ID
+        * ``frequency`` - Calls per minute
+        * ``interval`` - Seconds between two ticks of the campaign
+        * ``state`` - Dictionary tokens, timestamp, integral & factor
+    """
+
+    def __init__(self, campaign_id, frequency, interval, state=None):
+        self.campaign_id = campaign_id
+        self.frequency = frequency
+        self.interval = float(interval)
+        self.state = state or {}
+        self.kp = settings.PACING_KP
+        self.ki = settings.PACING_KI
+        self.min_factor = settings.PACING_MIN_FACTOR
+        # Statistics of the last calls, set by get_campaign_pacing
+        self.answer_rate = None
+        self.avg_duration = None
+
+    @classmethod
+    def load(cls, campaign_id, frequency, interval):
+        """Create the pacer of a campaign from the state kept in the cache"""
+        return cls(campaign_id, frequency, interval, cache.get(pacing_key(campaign_id)))
+
+    def save(self):
+        cache.set(pacing_key(self.campaign_id), self.state, PACING_TIMEOUT)
+
+    @property
+    def factor(self):
+        return self.state.get('factor', 1.0)
+
+    @property
+    def rate(self):
+        """Calls per second once throttled"""
+        return self.frequency * self.factor / 60.0
+
+    def get_error(self, backlog, inflight, expected_channels):
+        """
+        Return the load error of the campaign, positive when the campaign
+        is overloaded, negative when it could go faster
+
+        **Attributes**:
+
+            * ``backlog`` - Calls spooled but still not originated
+            * ``inflight`` - Live channels of the campaign
+            * ``expected_channels`` - Live channels expected at the campaign rate
+        """
+        tick_calls = max(self.frequency * self.interval / 60.0, 1.0)
+        error = float(backlog) / tick_calls
+        if expected_channels:
+            error = max(error, float(inflight) / expected_channels - 1)
+        elif not backlog:
+            error = -1.0
+        return error
+
+    def update(self, error, now=None):
+        """
+        Update the speed factor with the PI controller, then refill the
+        bucket since the previous tick, return the number of calls which
+        can be spooled
+        """
+        if now is None:
+            now = time.time()
+        dt = now - self.state.get('timestamp', now - self.interval)
+        dt = max(dt, 0)
+
+        # Anti-windup, the integral only keeps the memory of the overload
+        integral = self.state.get('integral', 0.0) + error * dt / self.interval
+        integral = min(max(integral, 0.0), 1.0 / self.ki if self.ki else 0.0)
+        factor = 1.0 - self.kp * error - self.ki * integral
+        factor = min(max(factor, self.min_factor), 1.0)
+        self.state['integral'] = integral
+        self.state['factor'] = factor
+
+        # The bucket holds at most the calls of one tick, plus the fraction
+        # of call carried over from the previous tick
+        capacity = self.rate * self.interval + 1
+        tokens = self.state.get('tokens', 0.0) + self.rate * dt
+        self.state['tokens'] = min(tokens, capacity)
+        self.state['timestamp'] = now
+        return int(self.state['tokens'])
+
+    def consume(self, no_call):
+        """Remove the calls spooled from the bucket"""
+        self.state['tokens'] = max(self.state.get('tokens', 0.0) - no_call, 0.0)
+
+    def get_time_to_wait(self, no_call):
+        """Seconds between two calls to spread them evenly at the campaign rate"""
+        if not no_call or not self.rate:
+            return 0
+        return min(1.0 / self.rate, self.interval / no_call)
+
+
+def get_call_stats(campaign_id, window=None):
+    """
+    Return (answer_rate, avg_duration) of the calls of the campaign
+    terminated during the last window seconds, (None, None) without call
+    """
+    if window is None:
+        window = settings.PACING_STATS_WINDOW
+    start = datetime.utcnow().replace(tzinfo=utc) - timedelta(seconds=window)
+    list_voipcall = VoIPCall.objects.filter(callrequest__campaign_id=campaign_id, starting_date__gte=start)
+    no_call = list_voipcall.count()
+    if not no_call:
+        return (None, None)
+    answered = list_voipcall.filter(disposition=CALL_DISPOSITION.ANSWER)\
+        .aggregate(Count('id'), Avg('duration'))
+    return (float(answered['id__count']) / no_call, answered['duration__avg'] or 0)
+
+
+def get_live_callrequest(obj_campaign, now=None):
+    """
+    Return the callrequests of the campaign in progress, a call is not live
+    anymore after the dial timeout and the max duration of the campaign, the
+    older callrequests still calling lost their hangup and are not counted
+    """
+    if now is None:
+        now = datetime.utcnow().replace(tzinfo=utc)
+    max_call_time = (obj_campaign.calltimeout or 0) + (obj_campaign.callmaxduration or 0) + \
+        settings.ORIGINATE_BATCH_DURATION
+    # updated_date is the time of the originate of the call
+    return Callrequest.objects.filter(
+        campaign_id=obj_campaign.id, status=CALLREQUEST_STATUS.CALLING,
+        updated_date__gte=now - timedelta(seconds=max_call_time))
+
+
+def get_campaign_pacing(obj_campaign, interval):
+    """
+    Return (pacer, no_call) for a tick of the campaign, the calls spooled
+    have to be consumed with pacer.consume then the pacer saved
+
+    The feedback of the pacer is measured on the callrequests of the
+    campaign: the calls spooled more than a tick ago but still pending,
+    the calls in progress, and the answer rate & duration of the last calls.
+    The calls pending PACING_BACKLOG_TICKS ticks after they were due are
+    stale and not part of the backlog.
+    """
+    frequency = get_campaign_frequency(obj_campaign)
+    pacer = CampaignPacer.load(obj_campaign.id, frequency, interval)
+
+    now = datetime.utcnow().replace(tzinfo=utc)
+    late = now - timedelta(seconds=interval + settings.ORIGINATE_BATCH_DURATION)
+    stale = late - timedelta(seconds=interval * settings.PACING_BACKLOG_TICKS)
+    # Retries are scheduled later on purpose, they are not part of the backlog
+    backlog = Callrequest.objects.filter(
+        campaign_id=obj_campaign.id, status=CALLREQUEST_STATUS.PENDING,
+        parent_callrequest__isnull=True, call_time__lt=late, call_time__gte=stale).count()
+    inflight = get_live_callrequest(obj_campaign, now).count()
+
+    # Little's law, a call holds a channel during the answered call
+    # or until the ring timeout when it's not answered
+    expected_channels = None
+    (answer_rate, avg_duration) = get_call_stats(obj_campaign.id)
+    (pacer.answer_rate, pacer.avg_duration) = (answer_rate, avg_duration)
+    if answer_rate is not None:
+        holding_time = answer_rate * avg_duration + (1 - answer_rate) * (obj_campaign.calltimeout or 0)
+        expected_channels = max(frequency / 60.0 * holding_time * settings.PACING_CHANNEL_MARGIN, 1.0)
+
+    error = pacer.get_error(backlog, inflight, expected_channels)
+    no_call = pacer.update(error)
+    logger.info("Pacing campaign_id=%d freq=%d factor=%.2f backlog=%d inflight=%d "
+                "expected_channels=%s answer_rate=%s calls=%d" %
+                (obj_campaign.id, frequency, pacer.factor, backlog, inflight,
+                 expected_channels, answer_rate, no_call))
+    return (pacer, no_call)
@@ -0,0 +1,200 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.db.models import Avg
+from dialer_campaign.constants import DIALING_MODE
+from dialer_campaign.pacing import get_live_callrequest
+from agent.models import AgentProfile
+from agent.constants import AGENT_STATUS
+from callcenter.models import CallAgent
+import random
+
+# Upper bound of the calls placed per free agent in predictive mode
+MAX_CALLS_PER_AGENT = 10
+
+
+def expected_abandon_rate(no_call, answer_rate, no_agent):
+    """
+    Return the expected ratio of answered calls which find no free agent
+    when no_call calls are placed for no_agent agents
+
+    The number of answered calls X follows a binomial law B(no_call, answer_rate),
+    the ratio returned is E[max(0, X - no_agent)] / E[X]
+    """
+    if no_call <= no_agent or answer_rate <= 0:
+        return 0.0
+    if answer_rate >= 1:
+        return float(no_call - no_agent) / no_call
+    # Iterate on the probability mass function P(X = k)
+    ratio = answer_rate / (1 - answer_rate)
+    pmf = (1 - answer_rate) ** no_call
+    abandoned = 0.0
+    for k in range(no_call + 1):
+        if k > no_agent:
+            abandoned += (k - no_agent) * pmf
+        pmf = pmf * (no_call - k) / (k + 1) * ratio
+    return abandoned / (no_call * answer_rate)
+
+
+def get_dialing_volume(dialing_mode, idle_agent, busy_agent, ringing, answer_rate,
+                       handle_time, interval, max_abandon_rate):
+    """
+    Return the number of calls to place during the next tick, None when the
+    campaign dials at its fixed frequency
+
+    **Attributes**:
+
+        * ``dialing_mode`` - DIALING_MODE of the campaign
+        * ``idle_agent`` - Agents logged in and not on a call
+        * ``busy_agent`` - Agents on a call
+        * ``ringing`` - Calls in progress not yet connected to an agent
+        * ``answer_rate`` - Ratio of the calls answered, None without statistics
+        * ``handle_time`` - Average seconds an agent is busy per answered call
+        * ``interval`` - Seconds between two ticks
+        * ``max_abandon_rate`` - Ceiling of the ratio of answered calls without agent
+
+    Progressive mode places one call per idle agent. Predictive mode also
+    counts the agents expected to hang up during the tick, then overdials
+    as long as the expected abandonment stays under the ceiling.
+    """
+    if dialing_mode == DIALING_MODE.PROGRESSIVE:
+        return max(idle_agent - ringing, 0)
+    if dialing_mode != DIALING_MODE.PREDICTIVE:
+        return None
+
+    if not answer_rate:
+        # No statistics yet, start progressive
+        return max(idle_agent - ringing, 0)
+
+    free_agent = float(idle_agent)
+    if handle_time:
+        free_agent += busy_agent * min(float(interval) / handle_time, 1.0)
+    free_agent = int(free_agent)
+    if not free_agent:
+        return 0
+
+    # The ringing calls will be answered with the same rate
+    no_call = max(free_agent, ringing)
+    max_call = free_agent * MAX_CALLS_PER_AGENT + ringing
+    while no_call < max_call and \
+            expected_abandon_rate(no_call + 1, answer_rate, free_agent) <= max_abandon_rate:
+        no_call += 1
+    return max(no_call - ringing, 0)
+
+
+def get_agent_state(obj_campaign):
+    """
+    Return (idle_agent, busy_agent, ringing, wrap_up_time) for the agents of
+    the manager of the campaign, an agent is busy while a CallAgent exists
+    """
+    list_agent = AgentProfile.objects.filter(
+        manager_id=obj_campaign.user_id,
+        status__in=[AGENT_STATUS.AVAILABLE, AGENT_STATUS.ON_DEMAND])
+    logged_agent = list_agent.count()
+    wrap_up_time = list_agent.aggregate(Avg('wrap_up_time'))['wrap_up_time__avg'] or 0
+    busy_agent = CallAgent.objects.filter(agent__in=list_agent).values('agent_id').distinct().count()
+    # The callrequests still calling after their hangup was lost are not counted
+    list_live_callrequest = get_live_callrequest(obj_campaign)
+    calling = list_live_callrequest.count()
+    bridged = CallAgent.objects.filter(callrequest__in=list_live_callrequest).count()
+    return (max(logged_agent - busy_agent, 0), busy_agent, max(calling - bridged, 0), wrap_up_time)
+
+
+def get_campaign_dialing_volume(obj_campaign, interval, answer_rate, avg_duration):
+    """
+    Return the number of calls to place during the next tick of the campaign
+    according to its dialing mode, None in fixed mode
+    """
+    if obj_campaign.dialing_mode not in (DIALING_MODE.PROGRESSIVE, DIALING_MODE.PREDICTIVE):
+        return None
+    (idle_agent, busy_agent, ringing, wrap_up_time) = get_agent_state(obj_campaign)
+    handle_time = None
+    if avg_duration:
+        handle_time = avg_duration + wrap_up_time
+    max_abandon_rate = (obj_campaign.max_abandon_rate or 0) / 100.0
+    return get_dialing_volume(obj_campaign.dialing_mode, idle_agent, busy_agent, ringing,
+                              answer_rate, handle_time, interval, max_abandon_rate)
+
+
+class DialingSimulator(object):
+
+    """
+    Offline simulation of a campaign dialing for a team of agents, used to
+    tune the dialing modes without FreeSWITCH
+
+    The simulation runs second by second: calls ring during ring_time, are
+    answered with answer_rate, an answered call without idle agent is
+    abandoned, else the agent is busy during an exponential handle time.
+
+    **Usage**:
+
+        simulator = DialingSimulator(DIALING_MODE.PREDICTIVE, agent=10)
+        result = simulator.run(3600)
+    """
+
+    def __init__(self, dialing_mode, agent=10, answer_rate=0.25, handle_time=120,
+                 ring_time=20, interval=10, frequency=0, max_abandon_rate=0.03, seed=None):
+        self.dialing_mode = dialing_mode
+        self.agent = agent
+        self.answer_rate = answer_rate
+        self.handle_time = handle_time
+        self.ring_time = ring_time
+        self.interval = interval
+        self.frequency = frequency
+        self.max_abandon_rate = max_abandon_rate
+        self.random = random.Random(seed)
+
+    def run(self, duration):
+        """Simulate duration seconds, return a dictionary of statistics"""
+        busy_until = []
+        ringing = []
+        scheduled = []
+        placed = answered = abandoned = busy_seconds = 0
+        for now in range(duration):
+            if now % self.interval == 0:
+                busy_agent = len([t for t in busy_until if t > now])
+                no_call = get_dialing_volume(
+                    self.dialing_mode, self.agent - busy_agent, busy_agent,
+                    len(ringing) + len(scheduled), self.answer_rate,
+                    self.handle_time, self.interval, self.max_abandon_rate)
+                if no_call is None or self.frequency:
+                    limit = int(self.frequency * self.interval / 60.0)
+                    no_call = limit if no_call is None else min(no_call, limit)
+                # Spread the calls of the tick
+                scheduled.extend(now + i * self.interval / max(no_call, 1) for i in range(no_call))
+
+            for start in [t for t in scheduled if t <= now]:
+                scheduled.remove(start)
+                placed += 1
+                ringing.append(now + self.ring_time)
+
+            for end in [t for t in ringing if t <= now]:
+                ringing.remove(end)
+                if self.random.random() >= self.answer_rate:
+                    continue
+                answered += 1
+                busy_until = [t for t in busy_until if t > now]
+                if len(busy_until) >= self.agent:
+                    abandoned += 1
+                else:
+                    busy_until.append(now + self.random.expovariate(1.0 / self.handle_time))
+            busy_seconds += len([t for t in busy_until if t > now])
+
+        return {
+            'placed': placed,
+            'answered': answered,
+            'abandoned': abandoned,
+            'abandon_rate': float(abandoned) / answered if answered else 0.0,
+            'agent_occupancy': float(busy_seconds) / (duration * self.agent) if self.agent else 0.0,
+        }
@@ -0,0 +1,104 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from uuid import uuid1
+
+SKIPPED_TICK_KEY = 'campaign_tick_skipped'
+
+
+def campaign_lock_key(campaign_id, name='tick'):
+    return 'campaign_%s_lock_%d' % (name, int(campaign_id))
+
+
+class CampaignLock(object):
+
+    """
+    Lock of the tick of a campaign, the ticks of different campaigns run in
+    parallel while two ticks of the same campaign never overlap. Other
+    tasks of a campaign use their own lock name.
+
+    The lock is a cache key added atomically, it expires after
+    CAMPAIGN_LOCK_EXPIRE seconds if the worker dies during the tick.
+
+    **Usage**:
+
+        lock = CampaignLock(campaign_id)
+        if lock.acquire():
+            try:
+                ...
+            finally:
+                lock.release()
+    """
+
+    def __init__(self, campaign_id, name='tick'):
+        self.key = campaign_lock_key(campaign_id, name)
+        self.token = str(uuid1())
+
+    def acquire(self):
+        return cache.add(self.key, self.token, settings.CAMPAIGN_LOCK_EXPIRE)
+
+    def release(self):
+        # Don't release a lock expired then acquired by another tick
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+def is_campaign_locked(campaign_id):
+    return cache.get(campaign_lock_key(campaign_id)) is not None
+
+
+def incr_skipped_tick():
+    cache.add(SKIPPED_TICK_KEY, 0, None)
+    try:
+        return cache.incr(SKIPPED_TICK_KEY)
+    except ValueError:
+        # Key evicted between add and incr
+        return 0
+
+
+def pop_skipped_tick():
+    """Return the number of campaign ticks skipped since the last call"""
+    skipped = cache.get(SKIPPED_TICK_KEY) or 0
+    if skipped:
+        try:
+            cache.decr(SKIPPED_TICK_KEY, skipped)
+        except ValueError:
+            pass
+    return skipped
+
+
+def interleave_campaign_by_user(list_campaign):
+    """
+    Return the campaigns ordered round-robin by user, the first campaign of
+    each user is dispatched before the second campaign of any user, so a
+    user with many campaigns doesn't delay the campaigns of the other users
+    """
+    list_user_campaign = {}
+    list_user = []
+    for campaign in list_campaign:
+        if campaign.user_id not in list_user_campaign:
+            list_user_campaign[campaign.user_id] = []
+            list_user.append(campaign.user_id)
+        list_user_campaign[campaign.user_id].append(campaign)
+
+    result = []
+    rank = 0
+    while len(result) < len(list_campaign):
+        for user_id in list_user:
+            if rank < len(list_user_campaign[user_id]):
+                result.append(list_user_campaign[user_id][rank])
+        rank += 1
+    return result
@@ -17,20 +17,24 @@ from django.conf import settings
 from celery.task import PeriodicTask
 from celery.task import Task
 from celery.utils.log import get_task_logger
-from dialer_campaign.models import Campaign
-from dialer_campaign.constants import SUBSCRIBER_STATUS, CAMPAIGN_STATUS
+from dialer_campaign.models import Campaign, Subscriber, campaign_config
+from dialer_campaign.constants import SUBSCRIBER_STATUS, CAMPAIGN_STATUS, DIALING_MODE
+from dialer_campaign.pacing import get_campaign_pacing, get_call_stats
+from dialer_campaign.predictive import get_campaign_dialing_volume
+from dialer_campaign.scheduler import CampaignLock, is_campaign_locked, incr_skipped_tick, \
+    pop_skipped_tick, interleave_campaign_by_user
 from dialer_cdr.constants import CALLREQUEST_STATUS, CALLREQUEST_TYPE
 from dialer_cdr.models import Callrequest
-from dialer_cdr.tasks import init_callrequest
+from dialer_cdr.tasks import init_callrequest, init_callrequest_batch
 from dialer_contact.tasks import collect_subscriber
-from dnc.models import DNCContact
+from dnc.index import get_dnc_index
+from dialer_settings.matcher import get_contact_authorization
 from survey.models import Survey_template
 from django_lets_go.only_one_task import only_one
 from datetime import datetime, timedelta
 from django.utils.timezone import utc
 from math import floor
 from common_functions import debug_query
-from uuid import uuid1
 # from celery.task.http import HttpDispatchTask
 # from common_functions import isint
 
@@ -62,7 +66,7 @@ class campaign_spool_contact(PeriodicTask):
     def run(self, **kwargs):
         logger.info("TASK :: campaign_spool_contact")
 
-        for campaign in Campaign.objects.get_running_campaign():
+        for campaign in campaign_config.get_running_campaign():
             logger.debug("=> Spool Contact : Campaign name %s (id:%s)" % (campaign.name, str(campaign.id)))
             # Start collecting the contacts for this campaign
             collect_subscriber.delay(campaign.id)
@@ -71,44 +75,58 @@ class campaign_spool_contact(PeriodicTask):
 # OPTIMIZATION - FINE
 class pending_call_processing(Task):
 
-    @only_one(ikey="check_pendingcall", timeout=LOCK_EXPIRE)
-    def run(self, campaign_id):
+    def run(self, campaign_id, **kwargs):
         """
         This task retrieves the next outbound call to be made for a given
         campaign, and will create a new callrequest and schedule a task to
         process those calls
 
+        The campaign is locked during its tick, the ticks of the other
+        campaigns run in parallel
+
         **Attributes**:
 
             * ``campaign_id`` - Campaign ID
         """
+        lock = CampaignLock(campaign_id)
+        if not lock.acquire():
+            incr_skipped_tick()
+            logger.warning("Tick of campaign_id=%d skipped, previous tick still running" % campaign_id)
+            return False
+        try:
+            return self.spool_campaign(campaign_id)
+        finally:
+            lock.release()
+
+    def spool_campaign(self, campaign_id):
+        """Spool the calls of a tick of the campaign"""
         logger = self.get_logger()
         logger.info("TASK :: pending_call_processing = %d" % campaign_id)
 
         debug_query(0)
 
+        # The configuration of the campaign is cached between the heartbeats
         try:
-            obj_campaign = Campaign.objects\
-                .select_related('user__userprofile__dialersetting', 'aleg_gateway', 'content_type')\
-                .get(id=campaign_id)
-        except:
+            obj_campaign = campaign_config.get(campaign_id)
+        except Campaign.DoesNotExist:
             logger.error("Can't find this campaign")
             return False
 
         # Ensure the content_type become "survey" when campagin starts
         if not obj_campaign.has_been_started:
-            # change has_been_started flag
-            obj_campaign.has_been_started = True
-            obj_campaign.save()
+            # change has_been_started flag, the cached instance is not saved
+            Campaign.objects.filter(id=obj_campaign.id).update(has_been_started=True)
+            campaign_config.invalidate()
 
             if obj_campaign.content_type.model == 'survey_template':
                 # Copy survey
                 survey_template = Survey_template.objects.get(user=obj_campaign.user, pk=obj_campaign.object_id)
                 survey_template.copy_survey_template(obj_campaign.id)
             collect_subscriber.delay(obj_campaign.id)
+            # Reload the campaign linked to its survey
+            obj_campaign = campaign_config.get(campaign_id)
 
-        # TODO : Control the Speed
-        # if there is many task pending we should slow down
+        # The speed is controlled by the pacer of the campaign
         frequency = obj_campaign.frequency  # default 10 calls per minutes
 
         debug_query(1)
@@ -136,45 +154,73 @@ class pending_call_processing(Task):
 
         # Get the subscriber of this campaign
         # get_pending_subscriber get Max 1000 records
-        if settings.HEARTBEAT_MIN == 1:  # 1 task per minute
+        pacer = None
+        if settings.CAMPAIGN_PACING:
+            # Token bucket with a feedback on the backlog and live channels
+            (pacer, callfrequency) = get_campaign_pacing(obj_campaign, 60.0 / settings.HEARTBEAT_MIN)
+        elif settings.HEARTBEAT_MIN == 1:  # 1 task per minute
             callfrequency = frequency  # task run only once per minute, so we can assign frequency
         else:
             callfrequency = int(frequency / settings.HEARTBEAT_MIN) + 1  # 1000 per minutes
             # callfrequency = int(frequency) + 1  # 1000 per minutes
 
-        (list_subscriber, no_subscriber) = obj_campaign\
-            .get_pending_subscriber_update(callfrequency, SUBSCRIBER_STATUS.IN_PROCESS)
+        if obj_campaign.dialing_mode != DIALING_MODE.FIXED:
+            # Progressive / Predictive, the frequency is a ceiling
+            if pacer:
+                (answer_rate, avg_duration) = (pacer.answer_rate, pacer.avg_duration)
+            else:
+                (answer_rate, avg_duration) = get_call_stats(obj_campaign.id)
+            no_call = get_campaign_dialing_volume(
+                obj_campaign, 60.0 / settings.HEARTBEAT_MIN, answer_rate, avg_duration)
+            logger.info("Dialing mode %d campaign_id=%d answer_rate=%s calls=%d" %
+                        (obj_campaign.dialing_mode, campaign_id, answer_rate, no_call))
+            callfrequency = min(callfrequency, no_call)
+
+        if callfrequency > 0:
+            (list_subscriber, no_subscriber) = obj_campaign\
+                .get_pending_subscriber_update(callfrequency, SUBSCRIBER_STATUS.IN_PROCESS,
+                                               exclude_dnc=settings.DNC_EXCLUDE_ON_CLAIM)
+        else:
+            (list_subscriber, no_subscriber) = ([], 0)
         logger.info("##subscriber=%d campaign_id=%d callfreq=%d freq=%d" %
                     (no_subscriber, campaign_id, callfrequency, frequency))
         debug_query(3)
 
+        if pacer:
+            pacer.consume(no_subscriber)
+            pacer.save()
+
         if no_subscriber == 0:
             return False
 
-        list_cr = []
+        # Filter the whole tick against the DNC index of the worker,
+        # unless the DNC contacts have been excluded by the claim
+        dnc_numbers = set()
+        if obj_campaign.dnc_id and not settings.DNC_EXCLUDE_ON_CLAIM:
+            dnc_numbers = get_dnc_index(obj_campaign.dnc_id)\
+                .filter([elem_camp_subscriber.duplicate_contact for elem_camp_subscriber in list_subscriber])
+
+        # Check the whole tick against the whitelist & blacklist, the matcher
+        # of the dialer setting is compiled once per worker
+        list_authorized = get_contact_authorization(obj_campaign.user.userprofile.dialersetting)\
+            .authorize_batch([elem_camp_subscriber.duplicate_contact for elem_camp_subscriber in list_subscriber])
+
         bulk_record = []
-        # this is used to tag and retrieve the id that are inserted
-        bulk_uuid = str(uuid1())
-        for elem_camp_subscriber in list_subscriber:
+        list_not_authorized_id = []
+        for (elem_camp_subscriber, authorized) in zip(list_subscriber, list_authorized):
             phone_number = elem_camp_subscriber.duplicate_contact
             debug_query(4)
 
             # Verify that the contact is authorized
-            if not obj_campaign.is_authorized_contact(obj_campaign.user.userprofile.dialersetting, phone_number):
+            if not authorized:
                 logger.error("Error : Contact not authorized")
-                elem_camp_subscriber.status = SUBSCRIBER_STATUS.NOT_AUTHORIZED
-                elem_camp_subscriber.save()
+                list_not_authorized_id.append(elem_camp_subscriber.id)
                 continue
             # Verify that the contact is not in the DNC list
-            if obj_campaign.dnc:
-                res_dnc = DNCContact.objects.filter(dnc_id=obj_campaign.dnc_id, phone_number=phone_number)
-                if res_dnc:
-                    logger.error("Contact (%s) in DNC list" % phone_number)
-                    elem_camp_subscriber.status = SUBSCRIBER_STATUS.NOT_AUTHORIZED
-                    elem_camp_subscriber.save()
-                    continue
-                else:
-                    logger.debug("Contact (%s) not in DNC list" % phone_number)
+            if phone_number in dnc_numbers:
+                logger.error("Contact (%s) in DNC list" % phone_number)
+                list_not_authorized_id.append(elem_camp_subscriber.id)
+                continue
 
             debug_query(5)
 
@@ -195,23 +241,42 @@ class pending_call_processing(Task):
                     extra_data=obj_campaign.extra_data,
                     timelimit=obj_campaign.callmaxduration,
                     subscriber=elem_camp_subscriber,
-                    request_uuid=bulk_uuid
                 )
             )
             debug_query(6)
 
-        # Create Callrequests in Bulk
+        if list_not_authorized_id:
+            Subscriber.objects.filter(id__in=list_not_authorized_id)\
+                .update(status=SUBSCRIBER_STATUS.NOT_AUTHORIZED,
+                        updated_date=datetime.utcnow().replace(tzinfo=utc))
+
+        # Create Callrequests in Bulk, their ids are returned by the insert
         logger.info("Bulk Create CallRequest => %d" % (len(bulk_record)))
-        Callrequest.objects.bulk_create(bulk_record)
+        list_cr = Callrequest.objects.bulk_create_returning(bulk_record)
 
         # Set time to wait for balanced dispatching of calls
-        time_to_wait = (60.0 / settings.HEARTBEAT_MIN) / no_subscriber
+        if pacer:
+            time_to_wait = pacer.get_time_to_wait(no_subscriber)
+        else:
+            time_to_wait = (60.0 / settings.HEARTBEAT_MIN) / no_subscriber
         count = 0
         loopnow = datetime.utcnow()
         loopnow + timedelta(seconds=1.55)
 
-        # Retrienve the one we just created
-        list_cr = Callrequest.objects.filter(request_uuid=bulk_uuid).all()
+        if settings.ORIGINATE_BATCH_DURATION > 0:
+            # Originate the calls by batch through a single ESL connection,
+            # a batch holds the calls to spool during ORIGINATE_BATCH_DURATION
+            batch_size = max(1, int(settings.ORIGINATE_BATCH_DURATION / time_to_wait))
+            list_cr_id = [cr.id for cr in list_cr]
+            for i in range(0, len(list_cr_id), batch_size):
+                eta_delta = loopnow + timedelta(seconds=((i + 1) * time_to_wait))
+                logger.info("Init CallRequest batch of %d (cmpg:%d:eta_delta:%s)" %
+                            (len(list_cr_id[i:i + batch_size]), campaign_id, eta_delta))
+                init_callrequest_batch.apply_async(
+                    args=[list_cr_id[i:i + batch_size], obj_campaign.id, obj_campaign.callmaxduration, time_to_wait],
+                    eta=eta_delta)
+            list_cr = []
+
         for cr in list_cr:
             # Loop on Subscriber and start the initcall's task
             count = count + 1
@@ -234,7 +299,7 @@ class pending_call_processing(Task):
             second_towait = second_towait + settings.DELAY_OUTBOUND
 
             # Shell_plus
-            # from dialer_cdr.tasks import init_callrequest
+            # from dialer_cdr.tasks import init_callrequest, init_callrequest_batch
             # from datetime import datetime
             # new_callrequest_id = 112
             # obj_campaign_id = 3
@@ -258,7 +323,8 @@ class campaign_running(PeriodicTask):
 
     """
     run_every = timedelta(seconds=int(60 / settings.HEARTBEAT_MIN))
-    # NOTE : until we implement a PID Controller :
+    # The calls are paced per campaign by dialer_campaign.pacing, a token
+    # bucket throttled by a PI controller :
     # http://en.wikipedia.org/wiki/PID_controller
 
     # The campaign have to run every minutes in order to control the number
@@ -268,10 +334,20 @@ class campaign_running(PeriodicTask):
     def run(self, **kwargs):
         logger.debug("TASK :: campaign_running")
 
-        for campaign in Campaign.objects.get_running_campaign():
+        skipped = 0
+        # Round-robin on the users, then a task per campaign
+        for campaign in interleave_campaign_by_user(campaign_config.get_running_campaign()):
+            if is_campaign_locked(campaign.id):
+                # The previous tick of the campaign is still running
+                skipped += 1
+                continue
             logger.info("=> Campaign name %s (id:%s)" % (campaign.name, campaign.id))
             keytask = 'check_campaign_pendingcall-%d' % (campaign.id)
             pending_call_processing().delay(campaign.id, keytask=keytask)
+
+        skipped += pop_skipped_tick()
+        if skipped:
+            logger.warning("Campaign ticks skipped on lock contention: %d" % skipped)
         return True
 
 
@@ -296,4 +372,6 @@ class campaign_expire_check(PeriodicTask):
 
         # Update in bulk
         Campaign.objects.filter(id__in=campaign_id_list).update(status=CAMPAIGN_STATUS.END)
+        if campaign_id_list:
+            campaign_config.invalidate()
         return True
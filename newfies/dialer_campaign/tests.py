@@ -16,7 +16,8 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
 from django.test import TestCase
-from dialer_campaign.models import Campaign, Subscriber, common_contact_authorization
+from dialer_campaign.models import Campaign, Subscriber, common_contact_authorization, campaign_config
+from dialer_contact.models import Contact
 from dialer_campaign.forms import CampaignForm
 from dialer_campaign.views import campaign_list, campaign_add,\
     campaign_change, campaign_del, notify_admin,\
@@ -25,8 +26,16 @@ from dialer_campaign.views import campaign_list, campaign_add,\
 from dialer_campaign.tasks import campaign_running, pending_call_processing,\
     collect_subscriber, campaign_expire_check
 from dialer_campaign.templatetags.dialer_campaign_tags import get_campaign_status_url
+from dialer_campaign.pacing import CampaignPacer, get_live_callrequest
+from dialer_cdr.models import Callrequest
+from dialer_cdr.constants import CALLREQUEST_STATUS
+from datetime import datetime, timedelta
+from django.utils.timezone import utc
+from dialer_campaign.scheduler import CampaignLock, is_campaign_locked, pop_skipped_tick, \
+    interleave_campaign_by_user
+from dialer_campaign.predictive import DialingSimulator, get_dialing_volume, expected_abandon_rate
 from dialer_settings.models import DialerSetting
-from dialer_campaign.constants import SUBSCRIBER_STATUS
+from dialer_campaign.constants import SUBSCRIBER_STATUS, DIALING_MODE
 from django_lets_go.utils import BaseAuthenticatedClient
 
 
@@ -298,6 +307,26 @@ class DialerCampaignCeleryTaskTestCase(TestCase):
         result = collect_subscriber.delay(1)
         self.assertEqual(result.successful(), True)
 
+    def test_campaign_lock(self):
+        """A tick is skipped while the previous tick of the campaign runs"""
+        lock = CampaignLock(1)
+        self.assertTrue(lock.acquire())
+        self.assertTrue(is_campaign_locked(1))
+        self.assertFalse(CampaignLock(1).acquire())
+        other_lock = CampaignLock(2)
+        self.assertTrue(other_lock.acquire())
+        pop_skipped_tick()
+        self.assertEqual(pending_call_processing().run(1), False)
+        self.assertEqual(pop_skipped_tick(), 1)
+        lock.release()
+        self.assertFalse(is_campaign_locked(1))
+        other_lock.release()
+
+    def test_interleave_campaign_by_user(self):
+        list_campaign = [Campaign(id=i, user_id=user_id) for (i, user_id) in enumerate([1, 1, 1, 2, 3, 3])]
+        self.assertEqual([campaign.id for campaign in interleave_campaign_by_user(list_campaign)],
+                         [0, 3, 4, 1, 5, 2])
+
     def test_campaign_expire_check(self):
         """Test that the ``campaign_expire_check``
         periodic task runs with no errors, and returns the correct result."""
@@ -305,6 +334,60 @@ class DialerCampaignCeleryTaskTestCase(TestCase):
         self.assertEqual(result.successful(), True)
 
 
+class CampaignPacerTestCase(TestCase):
+
+    """Test the token bucket pacing the campaigns"""
+
+    def test_pacer_rate(self):
+        """10 calls per minute with a tick every 10 seconds"""
+        pacer = CampaignPacer(1, 10, 10)
+        no_call = 0
+        for tick in range(60):
+            calls = pacer.update(pacer.get_error(0, 0, None), now=tick * 10)
+            pacer.consume(calls)
+            no_call += calls
+        self.assertTrue(99 <= no_call <= 100)
+        self.assertEqual(pacer.factor, 1.0)
+        self.assertEqual(pacer.get_time_to_wait(2), 5.0)
+
+    def test_pacer_throttle(self):
+        """The speed is reduced while the calls are not originated in time"""
+        pacer = CampaignPacer(1, 60, 10)
+        pacer.update(pacer.get_error(20, 0, None), now=0)
+        self.assertEqual(pacer.factor, pacer.min_factor)
+        # Too many live channels
+        pacer = CampaignPacer(1, 60, 10)
+        pacer.update(pacer.get_error(0, 30, 20), now=0)
+        self.assertTrue(pacer.factor < 1.0)
+        # Recovery
+        for tick in range(1, 10):
+            pacer.update(pacer.get_error(0, 0, 20), now=tick * 10)
+        self.assertEqual(pacer.factor, 1.0)
+
+
+class DialingModeTestCase(TestCase):
+
+    """Test the progressive & predictive dialing modes"""
+
+    def test_get_dialing_volume(self):
+        """Test the calls placed per tick"""
+        self.assertEqual(get_dialing_volume(DIALING_MODE.FIXED, 5, 5, 0, 0.25, 120, 10, 0.03), None)
+        self.assertEqual(get_dialing_volume(DIALING_MODE.PROGRESSIVE, 5, 5, 2, 0.25, 120, 10, 0.03), 3)
+        # Predictive overdials without statistics only once known
+        self.assertEqual(get_dialing_volume(DIALING_MODE.PREDICTIVE, 5, 5, 0, None, None, 10, 0.03), 5)
+        self.assertTrue(get_dialing_volume(DIALING_MODE.PREDICTIVE, 5, 5, 0, 0.25, 120, 10, 0.03) > 5)
+        self.assertEqual(expected_abandon_rate(5, 0.25, 5), 0.0)
+        self.assertTrue(expected_abandon_rate(40, 0.25, 5) > 0.03)
+
+    def test_simulator(self):
+        """The predictive mode keeps the agents busier under the abandonment ceiling"""
+        progressive = DialingSimulator(DIALING_MODE.PROGRESSIVE, agent=10, seed=1).run(3600)
+        predictive = DialingSimulator(DIALING_MODE.PREDICTIVE, agent=10, seed=1).run(3600)
+        self.assertEqual(progressive['abandoned'], 0)
+        self.assertTrue(predictive['agent_occupancy'] > progressive['agent_occupancy'])
+        self.assertTrue(predictive['abandon_rate'] <= 0.03)
+
+
 class DialerCampaignModel(TestCase):
 
     """Test Campaign, Subscriber models"""
@@ -352,6 +435,65 @@ class DialerCampaignModel(TestCase):
 
         call_command("create_subscriber", "123456|3")
 
+    def test_get_pending_subscriber_update_dnc(self):
+        """Subscribers in the DNC list of the campaign are not claimed"""
+        self.campaign.dnc_id = 1
+        self.campaign.save()
+        self.subscriber.duplicate_contact = '123456789'
+        self.subscriber.save()
+        contact = Contact.objects.create(contact='650123456', phonebook_id=1)
+        subscriber = Subscriber.objects.create(contact=contact, campaign=self.campaign,
+                                               duplicate_contact='650123456', status=SUBSCRIBER_STATUS.PENDING)
+
+        (list_subscriber, count) = self.campaign.get_pending_subscriber_update(
+            10, SUBSCRIBER_STATUS.IN_PROCESS, exclude_dnc=True)
+        self.assertEqual(count, 1)
+        self.assertEqual(list_subscriber[0].id, subscriber.id)
+        self.assertEqual(Subscriber.objects.get(pk=subscriber.id).status, SUBSCRIBER_STATUS.IN_PROCESS)
+        self.assertEqual(Subscriber.objects.get(pk=self.subscriber.id).status, SUBSCRIBER_STATUS.NOT_AUTHORIZED)
+
+    def test_get_pending_subscriber_update(self):
+        """Claimed subscribers are updated and not claimed again"""
+        Subscriber.objects.filter(campaign=self.campaign).update(status=SUBSCRIBER_STATUS.PENDING)
+        count_pending = Subscriber.objects.filter(campaign=self.campaign, status=SUBSCRIBER_STATUS.PENDING).count()
+        (list_subscriber, count) = self.campaign.get_pending_subscriber_update(10, SUBSCRIBER_STATUS.IN_PROCESS)
+        self.assertEqual(count, count_pending)
+        self.assertEqual(list_subscriber[0].duplicate_contact,
+                         Subscriber.objects.get(pk=list_subscriber[0].id).duplicate_contact)
+        self.assertEqual(Subscriber.objects.get(pk=list_subscriber[0].id).status, SUBSCRIBER_STATUS.IN_PROCESS)
+        self.assertEqual(self.campaign.get_pending_subscriber_update(10, SUBSCRIBER_STATUS.IN_PROCESS), (False, 0))
+
+    def test_campaign_config(self):
+        """The cached running campaigns match the running campaign query"""
+        self.assertEqual([campaign.id for campaign in campaign_config.get_running_campaign()],
+                         sorted(Campaign.objects.get_running_campaign().values_list('id', flat=True)))
+        version = campaign_config.get_version()
+        self.campaign.frequency = 25
+        self.campaign.save()
+        self.assertTrue(campaign_config.get_version() > version)
+        self.assertEqual(campaign_config.get(self.campaign.id).frequency, 25)
+
+        # The dialer setting of the campaigns is read through the user profile
+        version = campaign_config.get_version()
+        self.user.userprofile.save()
+        self.assertTrue(campaign_config.get_version() > version)
+
+    def test_get_live_callrequest(self):
+        """The callrequests calling for longer than a call can last are not live"""
+        campaign = Campaign.objects.get(pk=self.campaign.id)
+        callrequest = Callrequest(
+            status=CALLREQUEST_STATUS.CALLING, user=self.user, phone_number='123456',
+            campaign=campaign, aleg_gateway_id=1,
+            content_type_id=self.content_type_id, object_id=1)
+        callrequest.save()
+        self.assertEqual(get_live_callrequest(campaign).count(), 1)
+
+        # The hangup of the call was lost
+        old = datetime.utcnow().replace(tzinfo=utc) - \
+            timedelta(seconds=campaign.calltimeout + campaign.callmaxduration + 3600)
+        Callrequest.objects.filter(pk=callrequest.id).update(updated_date=old)
+        self.assertEqual(get_live_callrequest(campaign).count(), 0)
+
     def test_campaign_form(self):
         self.assertEqual(self.campaign.name, "sample_campaign")
 
@@ -26,22 +26,22 @@ from django.utils.timezone import utc
 
 from datetime import datetime
 import re
-import tablib
 from frontend_notification.views import frontend_send_notification
 from django_lets_go.common_functions import ceil_strdate, getvar, get_pagination_vars, unset_session_var
 
-from .models import Campaign, Subscriber
+from .models import Campaign, Subscriber, campaign_config
 from .forms import CampaignForm, DuplicateCampaignForm, \
     SubscriberSearchForm, CampaignSearchForm
 from .constants import CAMPAIGN_STATUS, CAMPAIGN_COLUMN_NAME, \
     SUBSCRIBER_COLUMN_NAME
 from .function_def import check_dialer_setting, dialer_setting_limit, \
-    user_dialer_setting, get_subscriber_status, get_subscriber_disposition
+    user_dialer_setting
 from .tasks import collect_subscriber
+from .exporter import SubscriberExporter
 from dialer_contact.models import Phonebook
 from survey.models import Survey_template
 from user_profile.constants import NOTIFICATION_NAME
-from mod_utils.helper import Export_choice
+from mod_utils.exporter import export_response
 
 redirect_url_to_campaign_list = '/campaign/'
 
@@ -296,6 +296,7 @@ def campaign_del(request, object_id):
             if campaign_list:
                 if stop_campaign:
                     campaign_list.update(status=CAMPAIGN_STATUS.END)
+                    campaign_config.invalidate()
                     request.session["msg"] = _('%(count)s campaign(s) have been stopped.') % \
                         {'count': campaign_list.count()}
                 else:
@@ -581,51 +582,11 @@ def subscriber_export(request):
     **Exported fields**: ['contact', 'updated_date', 'count_attempt',
                           'completion_count_attempt', 'status', 'disposition',
                           'collected_data', 'agent']
+
+    CSV and JSON are streamed, XLS is written in the background
     """
     format_type = request.GET['format']
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(content_type='text/%s' % format_type)
-
-    # force download.
-    response['Content-Disposition'] = 'attachment;filename=export.%s' % format_type
-
-    if request.session.get('subscriber_list_kwargs'):
-        kwargs = request.session['subscriber_list_kwargs']
-        if request.user.is_superuser:
-            subscriber_list = Subscriber.objects.all()
-        else:
-            subscriber_list = Subscriber.objects.filter(campaign__user=request.user)
-
-        if kwargs:
-            subscriber_list = subscriber_list.filter(**kwargs)
-
-        headers = ('contact', 'updated_date', 'count_attempt', 'completion_count_attempt',
-                   'status', 'disposition', 'collected_data', )  # 'agent',
-
-        list_val = []
-        for i in subscriber_list:
-            updated_date = i.updated_date
-            if format_type == Export_choice.JSON or Export_choice.XLS:
-                updated_date = str(i.updated_date)
-
-            list_val.append((
-                i.contact.contact,
-                updated_date,
-                i.count_attempt,
-                i.completion_count_attempt,
-                get_subscriber_status(i.status),
-                get_subscriber_disposition(i.campaign_id, i.disposition),
-                i.collected_data,
-                # i.agent,
-            ))
-
-        data = tablib.Dataset(*list_val, headers=headers)
-
-        if format_type == Export_choice.XLS:
-            response.write(data.xls)
-        elif format_type == Export_choice.CSV:
-            response.write(data.csv)
-        elif format_type == Export_choice.JSON:
-            response.write(data.json)
-
-    return response
+    if not request.session.get('subscriber_list_kwargs'):
+        return HttpResponse(content_type='text/%s' % format_type)
+    kwargs = request.session['subscriber_list_kwargs']
+    return export_response(request, SubscriberExporter(request.user, kwargs), format_type)
@@ -23,8 +23,7 @@ from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import ungettext
-from django.db.models import Sum, Avg, Count
-from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_cdr.models import Callrequest, VoIPCall, VoIPCallRollup
 from dialer_cdr.forms import AdminVoipSearchForm
 from dialer_cdr.function_def import voipcall_record_common_fun, voipcall_search_admin_form_fun
 from django_lets_go.common_functions import getvar
@@ -224,13 +223,8 @@ class VoIPCallAdmin(admin.ModelAdmin):
                 kwargs['starting_date__gte'] = datetime(tday.year, tday.month, tday.day,
                                                         0, 0, 0, 0).replace(tzinfo=utc)
 
-        select_data = {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
-        # Get Total Records from VoIPCall Report table for Daily Call Report
-        total_data = VoIPCall.objects.extra(select=select_data).values('starting_date').filter(**kwargs)\
-            .annotate(Count('starting_date'))\
-            .annotate(Sum('duration'))\
-            .annotate(Avg('duration'))\
-            .order_by('-starting_date')
+        # Get Total Records from the daily CDR rollups for Daily Call Report
+        total_data = VoIPCallRollup.objects.daily_data(kwargs)
 
         # Following code will count total voip calls, duration
         if total_data:
@@ -40,6 +40,18 @@ class CALLREQUEST_TYPE(Choice):
     RETRY_DONE = 3, _('RETRY DONE')
 
 
+class CALLEVENT_STATUS(Choice):
+
+    """
+    Store the Call Event Status (call_event table filled by listener.lua)
+    """
+    PENDING = 1, _("pending")
+    PROCESSED = 2, _("processed")
+    IN_PROCESS = 3, _("in process")
+    IGNORED = 4, _("ignored")
+    FAILED = 5, _("failed")
+
+
 class LEG_TYPE(Choice):
 
     """
@@ -62,6 +74,16 @@ class CALL_DISPOSITION(Choice):
     FAILED = 'FAILED', _('FAILED')  # Added to catch all
 
 
+class ROLLUP_PERIOD(Choice):
+
+    """
+    Store the period of the CDR rollups
+    """
+    MINUTE = 1, _('minute')
+    HOUR = 2, _('hour')
+    DAY = 3, _('day')
+
+
 # Column Name for the CDR Report
 CDR_REPORT_COLUMN_NAME = {
     'date': _('start date'),
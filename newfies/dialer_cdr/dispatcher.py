@@ -0,0 +1,201 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from celery.utils.log import get_task_logger
+from dialer_cdr.models import Callrequest
+from dialer_cdr.constants import CALLREQUEST_STATUS
+from datetime import datetime, timedelta
+from django.utils.timezone import utc
+
+logger = get_task_logger(__name__)
+
+# Keep the node of a callrequest until its hangup is received
+CALLREQUEST_NODE_TIMEOUT = 60 * 60 * 6
+
+
+def get_dialer_nodes():
+    """
+    Return the list of FreeSWITCH nodes, each node is a dictionary with
+    name, hostname, port, secret, weight, max_channels & pool_size
+
+    When FREESWITCH_NODES is not configured, the single node ESL_HOSTNAME is used
+    """
+    list_node = []
+    if settings.FREESWITCH_NODES:
+        config_nodes = settings.FREESWITCH_NODES
+    else:
+        config_nodes = [{'hostname': settings.ESL_HOSTNAME}]
+    for config in config_nodes:
+        node = {
+            'hostname': config['hostname'],
+            'port': str(config.get('port', settings.ESL_PORT)),
+            'secret': config.get('secret', settings.ESL_SECRET),
+            'weight': config.get('weight', 1) or 1,
+            'max_channels': config.get('max_channels', 0),
+            'pool_size': config.get('pool_size', None),
+        }
+        node['name'] = config.get('name', '%s:%s' % (node['hostname'], node['port']))
+        list_node.append(node)
+    return list_node
+
+
+def node_channels_key(node_name):
+    return 'dialer_node_channels_%s' % node_name
+
+
+def node_down_key(node_name):
+    return 'dialer_node_down_%s' % node_name
+
+
+def callrequest_node_key(callrequest_id):
+    return 'dialer_node_callrequest_%d' % int(callrequest_id)
+
+
+def get_node_channels(list_node):
+    """Return a dictionary with the amount of calls in flight per node"""
+    keys = [node_channels_key(node['name']) for node in list_node]
+    values = cache.get_many(keys)
+    return dict((node['name'], max(int(values.get(node_channels_key(node['name']), 0)), 0))
+                for node in list_node)
+
+
+def select_dialer_node(list_node=None):
+    """
+    Return the least loaded healthy node, the load of a node is the number of
+    calls in flight divided by its weight, nodes which reached max_channels
+    or flagged down are skipped. Return None if no node is available.
+    """
+    if list_node is None:
+        list_node = get_dialer_nodes()
+    channels = get_node_channels(list_node)
+    down = cache.get_many([node_down_key(node['name']) for node in list_node])
+
+    selected = None
+    selected_load = None
+    for node in list_node:
+        if down.get(node_down_key(node['name'])):
+            continue
+        inflight = channels[node['name']]
+        if node['max_channels'] and inflight >= node['max_channels']:
+            continue
+        load = float(inflight) / node['weight']
+        if selected is None or load < selected_load:
+            selected = node
+            selected_load = load
+    return selected
+
+
+def incr_node_channels(node_name, delta=1):
+    key = node_channels_key(node_name)
+    cache.add(key, 0, None)
+    try:
+        if delta > 0:
+            return cache.incr(key, delta)
+        return cache.decr(key, -delta)
+    except ValueError:
+        # Key evicted between add and incr
+        return 0
+
+
+def reserve_node_channel(node):
+    """
+    Count a call in flight on the node unless it reached max_channels, the
+    check and the increment are atomic through cache.incr so two workers
+    can't both take the last channel of the node
+    """
+    count = incr_node_channels(node['name'], 1)
+    if node['max_channels'] and count > node['max_channels']:
+        incr_node_channels(node['name'], -1)
+        return False
+    return True
+
+
+def reserve_dialer_node(list_node=None):
+    """
+    Select the least loaded node and reserve a channel on it, the node is
+    selected again without the nodes which reached max_channels meanwhile.
+    Return None if no node is available.
+    """
+    if list_node is None:
+        list_node = get_dialer_nodes()
+    list_node = list(list_node)
+    while list_node:
+        node = select_dialer_node(list_node)
+        if node is None:
+            return None
+        if reserve_node_channel(node):
+            return node
+        list_node.remove(node)
+    return None
+
+
+def cancel_dialer_node(node):
+    """Give back the channel reserved on the node for a call which wasn't originated"""
+    incr_node_channels(node['name'], -1)
+
+
+def acquire_dialer_node(node, callrequest_id):
+    """Keep the channel reserved on the node by the call in flight until its hangup"""
+    cache.set(callrequest_node_key(callrequest_id), node['name'], CALLREQUEST_NODE_TIMEOUT)
+
+
+def release_dialer_node(list_callrequest_id):
+    """Release the nodes used by the callrequests which have been hangup"""
+    keys = [callrequest_node_key(callrequest_id) for callrequest_id in set(list_callrequest_id)]
+    if not keys:
+        return
+    nodes = cache.get_many(keys)
+    for key, node_name in nodes.items():
+        cache.delete(key)
+        incr_node_channels(node_name, -1)
+
+
+def reconcile_node_channels(list_node=None):
+    """
+    Rebuild the count of calls in flight per node from the callrequests still
+    calling, the counters drift when a hangup is lost (worker crash, event
+    never matched, per-call key evicted) and a node would end up skipped.
+
+    A call is not in flight anymore after its dial timeout and time limit,
+    the older callrequests still calling lost their hangup and are not counted.
+    Return a dictionary with the amount of calls in flight per node.
+    """
+    if list_node is None:
+        list_node = get_dialer_nodes()
+    now = datetime.utcnow().replace(tzinfo=utc)
+    list_live_id = []
+    for (callrequest_id, updated_date, timeout, timelimit) in Callrequest.objects.filter(
+            status=CALLREQUEST_STATUS.CALLING,
+            updated_date__gte=now - timedelta(seconds=CALLREQUEST_NODE_TIMEOUT))\
+            .values_list('id', 'updated_date', 'timeout', 'timelimit'):
+        if updated_date + timedelta(seconds=(timeout or 0) + (timelimit or 0)) >= now:
+            list_live_id.append(callrequest_id)
+
+    channels = dict((node['name'], 0) for node in list_node)
+    nodes = cache.get_many([callrequest_node_key(callrequest_id) for callrequest_id in list_live_id])
+    for node_name in nodes.values():
+        if node_name in channels:
+            channels[node_name] += 1
+    cache.set_many(dict((node_channels_key(node_name), count) for (node_name, count) in channels.items()), None)
+    return channels
+
+
+def set_node_down(node, delay=None):
+    """Exclude a node from the selection for a delay in seconds"""
+    if delay is None:
+        delay = settings.FREESWITCH_NODE_DOWN_DELAY
+    logger.error("Dialer node %s flagged down for %d seconds" % (node['name'], delay))
+    cache.set(node_down_key(node['name']), True, delay)
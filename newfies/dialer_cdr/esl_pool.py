@@ -0,0 +1,168 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from celery.utils.log import get_task_logger
+from contextlib import contextmanager
+import threading
+import time
+import os
+try:
+    import ESL as ESL
+except ImportError:
+    ESL = None
+
+logger = get_task_logger(__name__)
+
+
+class ESLPoolError(Exception):
+
+    """Raised when no healthy ESL connection can be provided"""
+    pass
+
+
+class ESLConnectionPool(object):
+
+    """
+    Pool of persistent ESL connections to a FreeSWITCH event socket
+
+    Connections are kept open between calls, checked before being lent
+    and reopened when broken. When the connection to FreeSWITCH fails,
+    the reconnection is delayed with an exponential backoff.
+
+    **Attributes**:
+
+        * ``hostname``, ``port``, ``secret`` - FreeSWITCH event socket
+        * ``size`` - Maximum number of connections opened by the pool
+        * ``connection_factory`` - Callable opening a connection, default ESL.ESLconnection
+        * ``retry_delay`` - Seconds to wait after the first failed connection
+        * ``max_retry_delay`` - Maximum seconds to wait between two connection attempts
+    """
+
+    def __init__(self, hostname, port, secret, size=2, connection_factory=None,
+                 retry_delay=1, max_retry_delay=30):
+        self.hostname = hostname
+        self.port = str(port)
+        self.secret = secret
+        self.size = size
+        if connection_factory is None and ESL:
+            connection_factory = ESL.ESLconnection
+        self.connection_factory = connection_factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lock = threading.Lock()
+        self.idle = []
+        self.count = 0
+        self.failure = 0
+        self.next_attempt = 0
+
+    def is_healthy(self):
+        """Return False while the pool is waiting to reconnect after a failure"""
+        return time.time() >= self.next_attempt
+
+    def connect(self):
+        """Open a new connection, apply the backoff on failure"""
+        if not self.is_healthy():
+            raise ESLPoolError("ESL %s:%s in backoff" % (self.hostname, self.port))
+        conn = None
+        try:
+            conn = self.connection_factory(self.hostname, self.port, self.secret)
+        except Exception as e:
+            logger.error("ESL connection error %s:%s (%s)" % (self.hostname, self.port, e))
+        if not conn or not conn.connected():
+            self.failure += 1
+            delay = min(self.retry_delay * (2 ** (self.failure - 1)), self.max_retry_delay)
+            self.next_attempt = time.time() + delay
+            logger.error("Cannot connect to ESL %s:%s, retry in %d seconds" % (self.hostname, self.port, delay))
+            raise ESLPoolError("Cannot connect to ESL %s:%s" % (self.hostname, self.port))
+        self.failure = 0
+        self.next_attempt = 0
+        return conn
+
+    def borrow(self):
+        """Lend a connected ESL connection"""
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if conn.connected():
+                    return conn
+                # Health check failed, drop the connection
+                logger.warning("Drop broken ESL connection %s:%s" % (self.hostname, self.port))
+                self.count -= 1
+            if self.count >= self.size:
+                raise ESLPoolError("ESL pool %s:%s exhausted" % (self.hostname, self.port))
+            conn = self.connect()
+            self.count += 1
+            return conn
+
+    def release(self, conn, broken=False):
+        """Give back a connection to the pool, broken connections are closed"""
+        with self.lock:
+            if broken or not conn.connected():
+                self.count -= 1
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+            else:
+                self.idle.append(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager lending a connection
+
+        Usage::
+
+            with pool.connection() as conn:
+                conn.api("bgapi", dial_command)
+        """
+        conn = self.borrow()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Disconnect all the idle connections"""
+        with self.lock:
+            for conn in self.idle:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+            self.count -= len(self.idle)
+            self.idle = []
+
+
+# Pools are per worker process, the sockets can't be shared with forked processes
+_esl_pools = {}
+_esl_pools_pid = None
+
+
+def get_esl_pool(hostname, port, secret, size=None):
+    """Return the ESL pool of a FreeSWITCH host, the pool is created on first use"""
+    global _esl_pools, _esl_pools_pid
+    if _esl_pools_pid != os.getpid():
+        _esl_pools = {}
+        _esl_pools_pid = os.getpid()
+    key = (hostname, str(port))
+    if key not in _esl_pools:
+        if size is None:
+            size = settings.ESL_POOL_SIZE_PER_HOST.get(hostname, settings.ESL_POOL_SIZE)
+        _esl_pools[key] = ESLConnectionPool(hostname, port, secret, size=size)
+    return _esl_pools[key]
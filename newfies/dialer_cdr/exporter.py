@@ -0,0 +1,43 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from dialer_cdr.models import VoIPCall
+from mod_utils.exporter import Exporter
+
+
+class VoIPCallExporter(Exporter):
+
+    """
+    Export the VoIP calls of the CDR report, the kwargs are the filters
+    of the report (``request.session['voipcall_record_kwargs']``)
+    """
+    fields = ('user__username', 'callid', 'callerid', 'phone_number', 'starting_date', 'duration', 'billsec',
+              'disposition', 'hangup_cause', 'hangup_cause_q850', 'used_gateway__name', 'amd_status')
+
+    def get_queryset(self):
+        return VoIPCall.objects.filter(**self.kwargs)
+
+    def get_headers(self):
+        amd_status = 'amd_status' if settings.AMD else ''
+        return ['user', 'callid', 'callerid', 'phone_number', 'starting_date', 'duration', 'billsec',
+                'disposition', 'hangup_cause', 'hangup_cause_q850', 'used_gateway', amd_status]
+
+    def format_row(self, row):
+        row = list(row)
+        # used_gateway is null for the calls which didn't reach a gateway
+        row[10] = row[10] or ''
+        if not settings.AMD:
+            row[11] = ''
+        return row
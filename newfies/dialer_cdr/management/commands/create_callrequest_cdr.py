@@ -17,7 +17,7 @@ from optparse import make_option
 from django.utils.translation import gettext_lazy as _
 from django.contrib.contenttypes.models import ContentType
 from dialer_campaign.models import Campaign
-from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_cdr.models import Callrequest, VoIPCall, VoIPCallRollup
 # from survey.models import Section
 from random import choice
 from uuid import uuid1
@@ -154,6 +154,7 @@ def create_callrequest(campaign_id, amount, day_delta):
 
         if i % 100 == 0:
             VoIPCall.objects.bulk_create(list_vc)
+            VoIPCallRollup.objects.add_voipcall(list_vc)
             list_vc = []
 
         """
@@ -192,5 +193,6 @@ def create_callrequest(campaign_id, amount, day_delta):
     # create the last one
     if list_vc:
         VoIPCall.objects.bulk_create(list_vc)
+        VoIPCallRollup.objects.add_voipcall(list_vc)
 
     print _("Callrequests and CDRs created : %(count)s" % {'count': amount})
@@ -0,0 +1,167 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection, DatabaseError
+from optparse import make_option
+from dialer_cdr.tasks import claim_callevent, requeue_callevent, \
+    process_callevent, process_callevent_batch
+from dialer_cdr.utils import cdr_buffer
+import logging
+import select
+import time
+
+logger = logging.getLogger('newfies.filelog')
+
+CHANNEL_NAME = 'call_event'
+
+# Seconds to wait before connecting again when the connection is lost
+RECONNECT_DELAY = 5
+
+# call_event is created by listener.lua, create it the same way if the
+# listener hasn't run yet so the trigger can be installed
+SQL_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS call_event (
+    id serial NOT NULL PRIMARY KEY,
+    event_name varchar(200) NOT NULL,
+    body varchar(200) NOT NULL,
+    job_uuid varchar(200),
+    call_uuid varchar(200) NOT NULL,
+    used_gateway_id integer,
+    callrequest_id integer,
+    alarm_request_id integer,
+    callerid varchar(200),
+    phonenumber varchar(200),
+    duration integer DEFAULT 0,
+    billsec integer DEFAULT 0,
+    hangup_cause varchar(40),
+    hangup_cause_q850 varchar(10),
+    amd_status varchar(40),
+    leg varchar(10) DEFAULT 'aleg',
+    starting_date timestamp with time zone,
+    status smallint,
+    created_date timestamp with time zone NOT NULL,
+    claimed_date timestamp with time zone,
+    requeue_count smallint NOT NULL DEFAULT 0
+    );
+CREATE INDEX IF NOT EXISTS call_event_idx_status ON call_event (status);
+"""
+
+# The trigger notify once per INSERT statement, listener.lua inserts
+# the call_event in bulk
+SQL_INSTALL_TRIGGER = """
+CREATE OR REPLACE FUNCTION call_event_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('%(channel)s', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS call_event_notify_trigger ON call_event;
+CREATE TRIGGER call_event_notify_trigger AFTER INSERT ON call_event
+    FOR EACH STATEMENT EXECUTE PROCEDURE call_event_notify();
+"""
+
+
+class Command(BaseCommand):
+    args = 'timeout, limit'
+    help = "Listen the call_event notifications and process the events as soon as they are inserted\n" \
+           "The periodic task task_pending_callevent stays as fallback\n" \
+           "---------------------------------------------------------------------------------------\n" \
+           "python manage.py listen_callevent --timeout=15 --limit=1000"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--timeout', default=None, dest='timeout',
+                    help="seconds to wait for a notification before polling the table"),
+        make_option('--limit', default=None, dest='limit',
+                    help="maximum of call_event claimed per statement"),
+    )
+
+    def handle(self, *args, **options):
+        """
+        Install the notify trigger on call_event, then LISTEN on the channel
+        and process the call_event when notified or when the timeout is reached
+
+        An error while processing the call_event is logged and the loop goes
+        on, when the connection is lost the command connects and listens again
+        """
+        timeout = 15  # default
+        if options.get('timeout'):
+            try:
+                timeout = int(options.get('timeout'))
+            except ValueError:
+                timeout = 15
+
+        limit = 1000  # default
+        if options.get('limit'):
+            try:
+                limit = int(options.get('limit'))
+            except ValueError:
+                limit = 1000
+
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql_psycopg2':
+            print "Database not supported (%s)" % settings.DATABASES['default']['ENGINE']
+            return False
+
+        pg_connection = None
+        try:
+            while True:
+                try:
+                    if pg_connection is None:
+                        pg_connection = self.listen()
+                        print "Listening on channel %s" % CHANNEL_NAME
+                        # Process what has been inserted before we started to listen
+                        self.process_pending(limit)
+                    if select.select([pg_connection], [], [], timeout) == ([], [], []):
+                        # Timeout, requeue the events lost by dead workers and poll
+                        requeue_callevent()
+                    else:
+                        pg_connection.poll()
+                        # Several notifications are handled by a single drain
+                        del pg_connection.notifies[:]
+                    self.process_pending(limit)
+                except (DatabaseError, connection.Database.Error, select.error) as e:
+                    logger.error("listen_callevent: connection lost, reconnect in %d seconds: %s" %
+                                 (RECONNECT_DELAY, e))
+                    pg_connection = None
+                    time.sleep(RECONNECT_DELAY)
+                except Exception as e:
+                    # The claimed call_event are requeued by requeue_callevent
+                    logger.exception("listen_callevent: error processing the call_event: %s" % e)
+        except KeyboardInterrupt:
+            print "Stopped"
+        finally:
+            cdr_buffer.flush()
+
+    def listen(self):
+        """Open a new connection, install the notify trigger and LISTEN on the channel"""
+        connection.close()
+        cursor = connection.cursor()
+        cursor.execute(SQL_CREATE_TABLE)
+        cursor.execute(SQL_INSTALL_TRIGGER % {'channel': CHANNEL_NAME})
+        cursor.execute("LISTEN %s;" % CHANNEL_NAME)
+        return connection.connection
+
+    def process_pending(self, limit):
+        """Claim and process the pending call_event until the table is drained"""
+        while True:
+            row = claim_callevent(limit)
+            if settings.CALLEVENT_BATCH_SIZE > 0:
+                for i in range(0, len(row), settings.CALLEVENT_BATCH_SIZE):
+                    process_callevent_batch(row[i:i + settings.CALLEVENT_BATCH_SIZE])
+            else:
+                for record in row:
+                    process_callevent(record)
+            if len(row) < limit:
+                return
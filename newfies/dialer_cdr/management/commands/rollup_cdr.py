@@ -0,0 +1,70 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Min
+from optparse import make_option
+from dialer_cdr.models import VoIPCall, VoIPCallRollup
+from datetime import datetime, timedelta
+from django.utils.timezone import utc
+
+
+class Command(BaseCommand):
+    args = 'from_date, to_date'
+    help = "Rebuild the CDR rollups (minute/hour/day) from the CDRs, day by day\n" \
+           "By default the rollups are rebuilt from the first CDR until today\n" \
+           "---------------------------------------------------------------------\n" \
+           "python manage.py rollup_cdr --from_date=2015-01-01 --to_date=2015-01-31"
+
+    option_list = BaseCommand.option_list + (
+        make_option('--from_date', default=None, dest='from_date',
+                    help="first day to rebuild, format YYYY-MM-DD"),
+        make_option('--to_date', default=None, dest='to_date',
+                    help="last day to rebuild, format YYYY-MM-DD"),
+    )
+
+    def handle(self, *args, **options):
+        """
+        Each day is rebuilt in its own transaction, the rollups of the day
+        are deleted then aggregated again from the CDRs
+        """
+        tday = datetime.utcnow().replace(tzinfo=utc)
+        if options.get('from_date'):
+            try:
+                from_date = datetime.strptime(options.get('from_date'), '%Y-%m-%d').replace(tzinfo=utc)
+            except ValueError:
+                print "Wrong format for from_date (%s)" % options.get('from_date')
+                return False
+        else:
+            from_date = VoIPCall.objects.aggregate(Min('starting_date'))['starting_date__min']
+            if from_date is None:
+                print "No CDR to aggregate"
+                return False
+
+        if options.get('to_date'):
+            try:
+                to_date = datetime.strptime(options.get('to_date'), '%Y-%m-%d').replace(tzinfo=utc)
+            except ValueError:
+                print "Wrong format for to_date (%s)" % options.get('to_date')
+                return False
+        else:
+            to_date = tday
+
+        day = datetime(from_date.year, from_date.month, from_date.day).replace(tzinfo=utc)
+        while day <= to_date:
+            with transaction.atomic():
+                VoIPCallRollup.objects.backfill(day, day + timedelta(days=1))
+            print "CDR rollups rebuilt for %s" % day.strftime('%Y-%m-%d')
+            day += timedelta(days=1)
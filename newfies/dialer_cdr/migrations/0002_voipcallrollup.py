@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('dialer_cdr', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoIPCallRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('campaign_id', models.IntegerField(default=0, verbose_name='campaign')),
+                ('period', models.SmallIntegerField(verbose_name='period', choices=[(1, 'minute'), (2, 'hour'), (3, 'day')])),
+                ('bucket', models.DateTimeField(verbose_name='date')),
+                ('disposition', models.CharField(default='', max_length=40, verbose_name='disposition', blank=True)),
+                ('leg_type', models.SmallIntegerField(default=0, verbose_name='leg')),
+                ('call_count', models.IntegerField(default=0)),
+                ('duration_sum', models.BigIntegerField(default=0)),
+                ('billsec_sum', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'dialer_cdr_rollup',
+                'verbose_name': 'CDR rollup',
+                'verbose_name_plural': 'CDR rollups',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='voipcallrollup',
+            unique_together=set([('user', 'campaign_id', 'period', 'bucket', 'disposition', 'leg_type')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def add_claimed_date(apps, schema_editor):
+    """
+    call_event is created by listener.lua on PostgreSQL, add the claimed_date
+    column to the existing tables, the new tables are created with it
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    cursor = connection.cursor()
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'call_event'")
+    columns = [row[0] for row in cursor.fetchall()]
+    if columns and 'claimed_date' not in columns:
+        cursor.execute("ALTER TABLE call_event ADD COLUMN claimed_date timestamp with time zone")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_cdr', '0002_voipcallrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_claimed_date, reverse_code=lambda apps, schema_editor: None),
+    ]
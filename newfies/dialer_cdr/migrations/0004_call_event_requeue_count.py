@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def add_requeue_count(apps, schema_editor):
+    """
+    call_event is created by listener.lua on PostgreSQL, add the requeue_count
+    column to the existing tables, the new tables are created with it
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    cursor = connection.cursor()
+    cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'call_event'")
+    columns = [row[0] for row in cursor.fetchall()]
+    if columns and 'requeue_count' not in columns:
+        cursor.execute("ALTER TABLE call_event ADD COLUMN requeue_count smallint NOT NULL DEFAULT 0")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dialer_cdr', '0003_call_event_claimed_date'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_requeue_count, reverse_code=lambda apps, schema_editor: None),
+    ]
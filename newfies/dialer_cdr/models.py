@@ -12,7 +12,10 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
-from django.db import models
+from django.db import models, connection
+from django.db.models import F, Sum
+from django.db.models.signals import post_delete
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.timezone import now
 from django.contrib.contenttypes.models import ContentType
@@ -20,7 +23,7 @@ from django.contrib.contenttypes import generic
 from dialer_gateway.models import Gateway
 from dialer_campaign.models import Campaign, Subscriber
 from dialer_cdr.constants import CALLREQUEST_STATUS, CALLREQUEST_TYPE, LEG_TYPE, CALL_DISPOSITION,\
-    VOIPCALL_AMD_STATUS
+    VOIPCALL_AMD_STATUS, ROLLUP_PERIOD
 from django_lets_go.intermediate_model_base_class import Model
 from country_dialcode.models import Prefix
 from datetime import datetime
@@ -43,6 +46,44 @@ class CallRequestManager(models.Manager):
         # return Callrequest.objects.all()
         return Callrequest.objects.filter(**kwargs)
 
+    def bulk_create_returning(self, list_callrequest, batch_size=1000):
+        """
+        Create the callrequests in bulk and set their primary key, each
+        callrequest keeps its own request_uuid
+
+        On PostgreSQL the ids come back with INSERT ... RETURNING id, else
+        the ids are read back by request_uuid
+        """
+        if not list_callrequest:
+            return list_callrequest
+        if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql_psycopg2':
+            self.bulk_create(list_callrequest, batch_size=batch_size)
+            dict_id = dict(self.filter(request_uuid__in=[cr.request_uuid for cr in list_callrequest])
+                           .values_list('request_uuid', 'id'))
+            for cr in list_callrequest:
+                cr.pk = dict_id.get(cr.request_uuid)
+            return list_callrequest
+
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = [f for f in opts.local_concrete_fields if not isinstance(f, models.AutoField)]
+        row_sql = '(%s)' % ', '.join(['%s'] * len(fields))
+        cursor = connection.cursor()
+        for i in range(0, len(list_callrequest), batch_size):
+            batch = list_callrequest[i:i + batch_size]
+            params = []
+            for cr in batch:
+                params.extend(f.get_db_prep_save(f.pre_save(cr, True), connection=connection) for f in fields)
+            cursor.execute('INSERT INTO %s (%s) VALUES %s RETURNING %s' % (
+                qn(opts.db_table),
+                ', '.join(qn(f.column) for f in fields),
+                ', '.join([row_sql] * len(batch)),
+                qn(opts.pk.column)), params)
+            # PostgreSQL returns the rows of a multi-row VALUES in order
+            for (cr, row) in zip(batch, cursor.fetchall()):
+                cr.pk = row[0]
+        return list_callrequest
+
 
 def str_uuid1():
     return str(uuid1())
@@ -235,3 +276,255 @@ class VoIPCall(models.Model):
 
     def __unicode__(self):
         return u"%d - %s" % (self.id, self.callid)
+
+
+# Name of the periods for date_trunc
+ROLLUP_PERIOD_TRUNC = {
+    ROLLUP_PERIOD.MINUTE: 'minute',
+    ROLLUP_PERIOD.HOUR: 'hour',
+    ROLLUP_PERIOD.DAY: 'day',
+}
+
+# Fields of VoIPCall filters and their rollup field
+ROLLUP_FILTER_FIELD = (
+    ('starting_date', 'bucket'),
+    ('callrequest__campaign_id', 'campaign_id'),
+    ('callrequest__campaign', 'campaign_id'),
+    ('disposition', 'disposition'),
+    ('leg_type', 'leg_type'),
+    ('user_id', 'user_id'),
+    ('user', 'user'),
+)
+
+
+def truncate_date(date, period):
+    """
+    Return the start of the rollup bucket of the date in UTC
+
+    >>> truncate_date(datetime(2015, 3, 10, 14, 25, 12), ROLLUP_PERIOD.HOUR)
+    datetime.datetime(2015, 3, 10, 14, 0)
+    """
+    if date.tzinfo is not None:
+        date = date.astimezone(utc)
+    if period == ROLLUP_PERIOD.MINUTE:
+        return date.replace(second=0, microsecond=0)
+    if period == ROLLUP_PERIOD.HOUR:
+        return date.replace(minute=0, second=0, microsecond=0)
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_filter(kwargs, period):
+    """
+    Translate the filter of a VoIPCall queryset into a filter of the
+    rollups, the dates starting a range are truncated to the period.
+    Raise ValueError on the fields which are not kept in the rollups
+    """
+    rollup_kwargs = {}
+    for key, value in kwargs.items():
+        for cdr_field, rollup_field in ROLLUP_FILTER_FIELD:
+            if key == cdr_field or key.startswith(cdr_field + '__'):
+                lookup = key[len(cdr_field):]
+                break
+        else:
+            raise ValueError("%s is not kept in the CDR rollups" % key)
+        if rollup_field == 'campaign_id' and hasattr(value, 'pk'):
+            value = value.pk
+        elif rollup_field == 'bucket':
+            if lookup == '__range' and isinstance(value[0], datetime):
+                value = (truncate_date(value[0], period), value[1])
+            elif lookup in ('__gte', '__gt') and isinstance(value, datetime):
+                value = truncate_date(value, period)
+                lookup = '__gte'
+        rollup_kwargs[rollup_field + lookup] = value
+    return rollup_kwargs
+
+
+class VoIPCallRollupManager(models.Manager):
+
+    """VoIPCallRollup Manager"""
+
+    def add_voipcall(self, list_voipcall):
+        """
+        Add the CDRs saved to the rollups of each period
+
+        The CDRs are aggregated in memory, then the rollups are updated with
+        one INSERT ... ON CONFLICT DO UPDATE on PostgreSQL. The rows are
+        upserted in the same order by all the workers to avoid deadlocks.
+        """
+        if not list_voipcall:
+            return 0
+        rollup = self.group_voipcall(list_voipcall)
+        list_key = sorted(rollup)
+
+        if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+            params = []
+            for key in list_key:
+                params.extend(key + rollup[key])
+            sql = "INSERT INTO dialer_cdr_rollup (user_id, campaign_id, period, bucket, disposition, leg_type, "\
+                "call_count, duration_sum, billsec_sum) VALUES %s "\
+                "ON CONFLICT (user_id, campaign_id, period, bucket, disposition, leg_type) DO UPDATE SET "\
+                "call_count = dialer_cdr_rollup.call_count + EXCLUDED.call_count, "\
+                "duration_sum = dialer_cdr_rollup.duration_sum + EXCLUDED.duration_sum, "\
+                "billsec_sum = dialer_cdr_rollup.billsec_sum + EXCLUDED.billsec_sum" % \
+                ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(list_key))
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+        else:
+            for key in list_key:
+                (call_count, duration_sum, billsec_sum) = rollup[key]
+                kwargs = dict(zip(('user_id', 'campaign_id', 'period', 'bucket', 'disposition', 'leg_type'), key))
+                updated = self.filter(**kwargs).update(
+                    call_count=F('call_count') + call_count,
+                    duration_sum=F('duration_sum') + duration_sum,
+                    billsec_sum=F('billsec_sum') + billsec_sum)
+                if not updated:
+                    self.create(call_count=call_count, duration_sum=duration_sum, billsec_sum=billsec_sum, **kwargs)
+        return len(list_key)
+
+    def remove_voipcall(self, list_voipcall):
+        """
+        Remove the CDRs deleted from the rollups of each period, the rollups
+        not built yet are left alone
+        """
+        rollup = self.group_voipcall(list_voipcall)
+        for key in sorted(rollup):
+            (call_count, duration_sum, billsec_sum) = rollup[key]
+            kwargs = dict(zip(('user_id', 'campaign_id', 'period', 'bucket', 'disposition', 'leg_type'), key))
+            self.filter(**kwargs).update(
+                call_count=F('call_count') - call_count,
+                duration_sum=F('duration_sum') - duration_sum,
+                billsec_sum=F('billsec_sum') - billsec_sum)
+        return len(rollup)
+
+    def group_voipcall(self, list_voipcall):
+        """
+        Return the (call_count, duration_sum, billsec_sum) of the CDRs per
+        rollup key (user_id, campaign_id, period, bucket, disposition, leg_type)
+        """
+        list_callrequest_id = set([v.callrequest_id for v in list_voipcall if v.callrequest_id])
+        dict_campaign = {}
+        if list_callrequest_id:
+            dict_campaign = dict(Callrequest.objects.filter(id__in=list_callrequest_id)
+                                 .values_list('id', 'campaign_id'))
+        rollup = {}
+        for voipcall in list_voipcall:
+            if not voipcall.starting_date:
+                continue
+            campaign_id = dict_campaign.get(voipcall.callrequest_id) or 0
+            for period in ROLLUP_PERIOD_TRUNC:
+                key = (voipcall.user_id, campaign_id, period, truncate_date(voipcall.starting_date, period),
+                       voipcall.disposition or '', voipcall.leg_type or 0)
+                (call_count, duration_sum, billsec_sum) = rollup.get(key, (0, 0, 0))
+                rollup[key] = (call_count + 1,
+                               duration_sum + (voipcall.duration or 0),
+                               billsec_sum + (voipcall.billsec or 0))
+        return rollup
+
+    def backfill(self, start_date, end_date):
+        """
+        Rebuild the rollups of the CDRs started from start_date to end_date
+        (excluded), the dates are truncated to the day
+        """
+        start_date = truncate_date(start_date, ROLLUP_PERIOD.DAY)
+        end_date = truncate_date(end_date, ROLLUP_PERIOD.DAY)
+        self.filter(bucket__gte=start_date, bucket__lt=end_date).delete()
+
+        if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+            cursor = connection.cursor()
+            for period in sorted(ROLLUP_PERIOD_TRUNC):
+                cursor.execute(
+                    "INSERT INTO dialer_cdr_rollup (user_id, campaign_id, period, bucket, disposition, leg_type, "
+                    "call_count, duration_sum, billsec_sum) "
+                    "SELECT cdr.user_id, COALESCE(cr.campaign_id, 0), %s, "
+                    "date_trunc(%s, cdr.starting_date AT TIME ZONE 'UTC') AT TIME ZONE 'UTC', "
+                    "COALESCE(cdr.disposition, ''), COALESCE(cdr.leg_type, 0), "
+                    "COUNT(*), COALESCE(SUM(cdr.duration), 0), COALESCE(SUM(cdr.billsec), 0) "
+                    "FROM dialer_cdr cdr LEFT JOIN dialer_callrequest cr ON cr.id = cdr.callrequest_id "
+                    "WHERE cdr.starting_date >= %s AND cdr.starting_date < %s "
+                    "GROUP BY 1, 2, 4, 5, 6",
+                    [period, ROLLUP_PERIOD_TRUNC[period], start_date, end_date])
+        else:
+            list_voipcall = []
+            for voipcall in VoIPCall.objects.filter(starting_date__gte=start_date, starting_date__lt=end_date)\
+                    .only('user', 'callrequest', 'starting_date', 'disposition', 'leg_type', 'duration', 'billsec')\
+                    .iterator():
+                list_voipcall.append(voipcall)
+                if len(list_voipcall) >= 1000:
+                    self.add_voipcall(list_voipcall)
+                    list_voipcall = []
+            self.add_voipcall(list_voipcall)
+
+    def daily_data(self, kwargs):
+        """
+        Return the CDRs matching the VoIPCall filter aggregated per day,
+        the most recent day first, with the keys of the aggregation
+        of VoIPCall per starting_date
+        """
+        total_data = self.filter(period=ROLLUP_PERIOD.DAY, **rollup_filter(kwargs, ROLLUP_PERIOD.DAY))\
+            .values('bucket')\
+            .annotate(Sum('call_count'))\
+            .annotate(Sum('duration_sum'))\
+            .order_by('-bucket')
+        return [{
+            'starting_date': data['bucket'].strftime('%Y-%m-%d'),
+            'starting_date__count': data['call_count__sum'],
+            'duration__sum': data['duration_sum__sum'],
+            'duration__avg': float(data['duration_sum__sum']) / data['call_count__sum'],
+        } for data in total_data]
+
+
+class VoIPCallRollup(models.Model):
+
+    """CDRs pre-aggregated per user, campaign, disposition and leg over a
+    minute, an hour or a day, the reports read the rollups instead of
+    aggregating the CDRs
+
+    **Attributes**:
+
+        * ``campaign_id`` - Campaign of the callrequest, 0 if none
+        * ``period`` - Period of the bucket (minute, hour, day)
+        * ``bucket`` - Start of the bucket in UTC
+        * ``disposition`` - Disposition of the calls
+        * ``leg_type`` - Leg of the calls
+        * ``call_count`` - Number of calls
+        * ``duration_sum`` - Total duration of the calls
+        * ``billsec_sum`` - Total billsec of the calls
+
+    **Relationships**:
+
+        * ``user`` - Foreign key relationship to the User model.
+
+    **Name of DB table**: dialer_cdr_rollup
+    """
+    user = models.ForeignKey('auth.User')
+    campaign_id = models.IntegerField(default=0, verbose_name=_("campaign"))
+    period = models.SmallIntegerField(choices=list(ROLLUP_PERIOD), verbose_name=_("period"))
+    bucket = models.DateTimeField(verbose_name=_("date"))
+    disposition = models.CharField(max_length=40, blank=True, default='', verbose_name=_("disposition"))
+    leg_type = models.SmallIntegerField(default=0, verbose_name=_("leg"))
+    call_count = models.IntegerField(default=0)
+    duration_sum = models.BigIntegerField(default=0)
+    billsec_sum = models.BigIntegerField(default=0)
+
+    objects = VoIPCallRollupManager()
+
+    class Meta:
+        db_table = 'dialer_cdr_rollup'
+        unique_together = ('user', 'campaign_id', 'period', 'bucket', 'disposition', 'leg_type')
+        verbose_name = _("CDR rollup")
+        verbose_name_plural = _("CDR rollups")
+
+    def __unicode__(self):
+        return u"%s - %s" % (self.bucket, self.disposition)
+
+
+def post_delete_voipcall(sender, **kwargs):
+    """A ``post_delete`` signal is sent by the VoIPCall model instance
+    whenever it is deleted, from the admin or by the cascade of its
+    callrequest, campaign or user.
+
+    The CDR deleted is removed from the rollups
+    """
+    VoIPCallRollup.objects.remove_voipcall([kwargs['instance']])
+
+post_delete.connect(post_delete_voipcall, sender=VoIPCall)
@@ -14,15 +14,21 @@
 
 from django.contrib.contenttypes.models import ContentType
 from django.db import connection
+from django.db.models import Q, F
 from django.conf import settings
 from celery.utils.log import get_task_logger
 from celery.decorators import task
 from celery.task import PeriodicTask
 
 from dialer_campaign.constants import SUBSCRIBER_STATUS, AMD_BEHAVIOR
+from dialer_campaign.models import Subscriber, campaign_config
 from dialer_cdr.models import Callrequest
-from dialer_cdr.constants import CALLREQUEST_STATUS, CALLREQUEST_TYPE
-from dialer_cdr.utils import voipcall_save  # BufferVoIPCall
+from dialer_cdr.constants import CALLREQUEST_STATUS, CALLREQUEST_TYPE, CALLEVENT_STATUS
+from dialer_cdr.utils import parse_callevent, cdr_buffer, set_callevent_status
+from dialer_cdr.esl_pool import get_esl_pool, ESLPoolError
+from dialer_cdr.dispatcher import reserve_dialer_node, reserve_node_channel, \
+    cancel_dialer_node, acquire_dialer_node, release_dialer_node, set_node_down, \
+    reconcile_node_channels
 
 from user_profile.models import CalendarUserProfile
 from appointment.models.alarms import AlarmRequest
@@ -32,10 +38,10 @@ from sms.tasks import SendMessage
 from dialer_gateway.utils import prepare_phonenumber
 from datetime import datetime, timedelta
 from django.utils.timezone import utc
-from django_lets_go.only_one_task import only_one
 from common_functions import debug_query
 from uuid import uuid1
 from time import sleep
+import time
 try:
     import ESL as ESL
 except ImportError:
@@ -45,32 +51,43 @@ except ImportError:
 logger = get_task_logger(__name__)
 
 LOCK_EXPIRE = 60 * 10 * 1  # Lock expires in 10 minutes
-NODES_NUMBER = 3
 
+# Status of the callrequests whose aleg callevent has been processed
+CALLREQUEST_FINAL_STATUS = (CALLREQUEST_STATUS.SUCCESS, CALLREQUEST_STATUS.FAILURE)
 
-def find_dialer_node(callrequest_id):
-    # Load balance
-    # from random import randint, seed
-    # seed()
-    # randval = randint(1, max)
-    # return "newfiesfs%d" % randval
-    c_node = (callrequest_id % NODES_NUMBER) + 1
-    return "newfiesfs%d" % c_node
 
+def get_dialer_connection():
+    """
+    Select the least loaded FreeSWITCH node and borrow a connection from
+    the ESL pool of the worker, return (node, pool, connection) or
+    (None, None, None) if no node can be reached
+
+    A channel is reserved on the node for the next call, it's given back
+    with cancel_dialer_node if the call isn't originated
+    """
+    # Route the call to the least loaded FreeSWITCH node
+    node = reserve_dialer_node()
+    if not node:
+        logger.error("No dialer node available")
+        return (None, None, None)
+    logger.info("Selected Node to dialout: %s" % node['name'])
+    # Borrow a persistent connection from the pool of the worker
+    pool = get_esl_pool(node['hostname'], node['port'], node['secret'], size=node['pool_size'])
+    try:
+        c = pool.borrow()
+    except ESLPoolError:
+        cancel_dialer_node(node)
+        set_node_down(node)
+        return (None, None, None)
+    return (node, pool, c)
 
-def dial_out(dial_command, callrequest_id):
-    if not ESL:
-        logger.debug('ESL not installed')
-        return 'load esl error'
 
-    reload(ESL)
-    hostname = settings.ESL_HOSTNAME
-    # hostname = find_dialer_node(callrequest_id)
-    logger.info("Selected Node to dialout: %s" % hostname)
-    c = ESL.ESLconnection(hostname, settings.ESL_PORT, settings.ESL_SECRET)
-    c.connected()
+def originate(c, dial_command):
+    """
+    Send the originate command on an ESL connection and return the Job-UUID,
+    'error' is returned if the command failed
+    """
     ev = c.api("bgapi", str(dial_command))
-    c.disconnect()
     if ev:
         result = ev.serialize()
         logger.debug(result)
@@ -84,6 +101,37 @@ def dial_out(dial_command, callrequest_id):
     return request_uuid
 
 
+def dial_out(dial_command, callrequest_id):
+    if not ESL:
+        logger.debug('ESL not installed')
+        return 'load esl error'
+
+    (node, pool, c) = get_dialer_connection()
+    if not c:
+        return 'error'
+    # The connection is released as broken if the originate raises
+    request_uuid = 'error'
+    try:
+        request_uuid = originate(c, dial_command)
+    finally:
+        # No reply means the socket is broken
+        pool.release(c, broken=(request_uuid == 'error'))
+        if request_uuid == 'error':
+            cancel_dialer_node(node)
+    if request_uuid != 'error':
+        acquire_dialer_node(node, callrequest_id)
+    return request_uuid
+
+
+def has_retry_callrequest(callrequest):
+    """
+    Return True if a retry of the callrequest has already been created, the
+    callevent is then replayed (requeued after a failed CDR flush) and the
+    subscriber must not be dialed again
+    """
+    return Callrequest.objects.filter(parent_callrequest_id=callrequest.id).exists()
+
+
 def check_retrycall_completion(callrequest):
     """
     We will check if the callrequest need to be restarted
@@ -97,6 +145,8 @@ def check_retrycall_completion(callrequest):
             or not callrequest.campaign.completion_maxretry
             or callrequest.campaign.completion_maxretry == 0):
         logger.debug("Subscriber completed or limit reached!")
+    elif has_retry_callrequest(callrequest):
+        logger.warning("Completion Retry of CallRequest %d already created" % callrequest.id)
     else:
         # Increment subscriber.completion_count_attempt
         if callrequest.subscriber.completion_count_attempt:
@@ -134,10 +184,12 @@ def check_retrycall_completion(callrequest):
             countdown=second_towait)
 
 
-@task(ignore_result=True)
-def update_callrequest(callrequest, opt_hangup_cause):
+def set_callrequest_status(callrequest, opt_hangup_cause):
+    """
+    Set the status of the callrequest and its subscriber from the hangup cause,
+    the changes are not saved
+    """
     # Only the aleg will update the subscriber status / Bleg is only recorded
-    # Update Callrequest Status
     if opt_hangup_cause == 'NORMAL_CLEARING':
         callrequest.status = CALLREQUEST_STATUS.SUCCESS
         if callrequest.subscriber.status != SUBSCRIBER_STATUS.COMPLETED:
@@ -147,6 +199,77 @@ def update_callrequest(callrequest, opt_hangup_cause):
         callrequest.subscriber.status = SUBSCRIBER_STATUS.FAIL
     callrequest.hangup_cause = opt_hangup_cause
 
+
+def check_campaign_retry(callrequest, opt_hangup_cause, amd_status):
+    """
+    Check if a campaign callrequest has to be retried or restarted to achieve
+    completion, return True if the callrequest call_type has been updated to
+    RETRY_DONE, the callrequest itself is not saved
+    """
+    # If the call failed we will check if we want to make a retry call
+    # Add condition to retry when it s machine and we want to reach a human
+    if callrequest.call_type == CALLREQUEST_TYPE.ALLOW_RETRY and \
+       (opt_hangup_cause != 'NORMAL_CLEARING' or
+        (amd_status == 'machine' and callrequest.campaign.voicemail and
+            callrequest.campaign.amd_behavior == AMD_BEHAVIOR.HUMAN_ONLY)):
+        # Update to Retry Done
+        callrequest.call_type = CALLREQUEST_TYPE.RETRY_DONE
+
+        # check if we are allowed to retry on failure
+        if ((callrequest.subscriber.count_attempt - 1) >= callrequest.campaign.maxretry
+                or not callrequest.campaign.maxretry):
+            logger.error("Not allowed retry - Maxretry (%d)" %
+                         callrequest.campaign.maxretry)
+            # Check here if we should try for completion
+            check_retrycall_completion(callrequest)
+            debug_query(28)
+        elif has_retry_callrequest(callrequest):
+            logger.warning("Retry of CallRequest %d already created" % callrequest.id)
+        else:
+            # Allowed Retry
+            logger.error("Allowed Retry - Maxretry (%d)" % callrequest.campaign.maxretry)
+
+            # Create new callrequest, Assign parent_callrequest,
+            # Change callrequest_type & num_attempt
+            new_callrequest = Callrequest(
+                request_uuid=uuid1(),
+                parent_callrequest_id=callrequest.id,
+                call_type=CALLREQUEST_TYPE.ALLOW_RETRY,
+                num_attempt=callrequest.num_attempt + 1,
+                user=callrequest.user,
+                campaign_id=callrequest.campaign_id,
+                aleg_gateway_id=callrequest.aleg_gateway_id,
+                content_type=callrequest.content_type,
+                object_id=callrequest.object_id,
+                phone_number=callrequest.phone_number,
+                timelimit=callrequest.timelimit,
+                callerid=callrequest.callerid,
+                timeout=callrequest.timeout,
+                subscriber_id=callrequest.subscriber_id
+            )
+            new_callrequest.save()
+            # NOTE : implement a PID algorithm
+            second_towait = callrequest.campaign.intervalretry
+            debug_query(29)
+
+            logger.debug("Init Retry CallRequest in  %d seconds" % second_towait)
+            init_callrequest.apply_async(
+                args=[new_callrequest.id, callrequest.campaign.id, callrequest.campaign.callmaxduration],
+                countdown=second_towait)
+        return True
+
+    # The Call is Answered and it's a campaign call
+    logger.info("Check for completion call")
+
+    # Check if we should relaunch a new call to achieve completion
+    check_retrycall_completion(callrequest)
+    return False
+
+
+@task(ignore_result=True)
+def update_callrequest(callrequest, opt_hangup_cause):
+    # Update Callrequest Status
+    set_callrequest_status(callrequest, opt_hangup_cause)
     callrequest.save()
     callrequest.subscriber.save()
     debug_query(24)
@@ -159,34 +282,19 @@ def process_callevent(record):
         - Retrieve the callrequest using either callrequest_id or request_uuid
         - create the voipcall, and save different data
     """
-    # TODO: add method in utils parse_callevent
     app_type = 'campaign'
-    event_name = record[1]
-    body = record[2]
-    job_uuid = record[3]
-    call_uuid = record[4]
-    # used_gateway_id = record[5]
-    callrequest_id = record[6]
-    alarm_request_id = record[7]
-    callerid = record[8]
-    phonenumber = record[9]
-    duration = record[10]
-    billsec = record[11]
-    hangup_cause = record[12]
-    hangup_cause_q850 = record[13]
-    starting_date = record[14]
-    amd_status = record[17]
-    leg = record[18]
-
-    if event_name == 'BACKGROUND_JOB':
-        # hangup cause come from body
-        hangup_cause = body[5:]
-
-    if hangup_cause == '':
-        hangup_cause = body[5:]
-
-    request_uuid = job_uuid
-    opt_hangup_cause = hangup_cause
+    event = parse_callevent(record)
+    job_uuid = event['job_uuid']
+    call_uuid = event['call_uuid']
+    callrequest_id = event['callrequest_id']
+    alarm_request_id = event['alarm_request_id']
+    callerid = event['callerid']
+    phonenumber = event['phonenumber']
+    duration = event['duration']
+    amd_status = event['amd_status']
+    leg = event['leg']
+    request_uuid = event['request_uuid']
+    opt_hangup_cause = event['hangup_cause']
     debug_query(22)
 
     try:
@@ -201,6 +309,8 @@ def process_callevent(record):
                 .get(id=callrequest_id)
     except:
         logger.error("Cannot find Callrequest job_uuid : %s" % job_uuid)
+        # Not a call of the dialer, there is no CDR to save
+        set_callevent_status([event['call_event_id']], CALLEVENT_STATUS.IGNORED)
         return True
 
     if callrequest.alarm_request_id:
@@ -212,23 +322,21 @@ def process_callevent(record):
     logger.debug("Find Callrequest id : %d" % callrequest.id)
     debug_query(23)
 
-    if leg == 'aleg' and app_type == 'campaign':
+    # The aleg of the callrequest has already been processed, the callevent is
+    # replayed after a failed CDR flush and only its CDR is saved again
+    replayed = leg == 'aleg' and app_type == 'campaign' and callrequest.status in CALLREQUEST_FINAL_STATUS
+
+    if leg == 'aleg' and not replayed:
+        # The call is not in flight anymore on its dialer node
+        release_dialer_node([callrequest.id])
+
+    if replayed:
+        logger.warning("Callevent of CallRequest %d replayed" % callrequest.id)
+    elif leg == 'aleg' and app_type == 'campaign':
         # Update callrequest
         # update_callrequest.delay(callrequest, opt_hangup_cause)
         # Disabled above tasks to reduce amount of tasks
-
-        # Only the aleg will update the subscriber status / Bleg is only recorded
-        # Update Callrequest Status
-        if opt_hangup_cause == 'NORMAL_CLEARING':
-            callrequest.status = CALLREQUEST_STATUS.SUCCESS
-            if callrequest.subscriber.status != SUBSCRIBER_STATUS.COMPLETED:
-                callrequest.subscriber.status = SUBSCRIBER_STATUS.SENT
-        else:
-            callrequest.status = CALLREQUEST_STATUS.FAILURE
-            callrequest.subscriber.status = SUBSCRIBER_STATUS.FAIL
-        callrequest.hangup_cause = opt_hangup_cause
-        # ...
-
+        set_callrequest_status(callrequest, opt_hangup_cause)
         callrequest.save()
         callrequest.subscriber.save()
         debug_query(24)
@@ -237,6 +345,7 @@ def process_callevent(record):
             caluser_profile = CalendarUserProfile.objects.get(user=alarm_req.alarm.event.creator)
         except CalendarUserProfile.DoesNotExist:
             logger.error("Error retrieving CalendarUserProfile")
+            set_callevent_status([event['call_event_id']], CALLEVENT_STATUS.IGNORED)
             return False
 
         if opt_hangup_cause == 'NORMAL_CLEARING' and \
@@ -271,95 +380,26 @@ def process_callevent(record):
         callerid = callrequest.callerid
     if phonenumber == '':
         phonenumber = callrequest.phone_number
-    # Create those in Bulk - add in a buffer until reach certain number
-    # buff_voipcall.save(
-    #     obj_callrequest=callrequest,
-    #     request_uuid=request_uuid,
-    #     leg=leg,
-    #     hangup_cause=opt_hangup_cause,
-    #     hangup_cause_q850=hangup_cause_q850,
-    #     callerid=callerid,
-    #     phonenumber=phonenumber,
-    #     starting_date=starting_date,
-    #     call_uuid=call_uuid,
-    #     duration=duration,
-    #     billsec=billsec,
-    #     amd_status=amd_status)
-
-    # debug_query(25)
-
-    voipcall_save(
-        callrequest=callrequest,
+
+    cdr_buffer.save(
+        obj_callrequest=callrequest,
         request_uuid=request_uuid,
         leg=leg,
         hangup_cause=opt_hangup_cause,
-        hangup_cause_q850=hangup_cause_q850,
+        hangup_cause_q850=event['hangup_cause_q850'],
         callerid=callerid,
         phonenumber=phonenumber,
-        starting_date=starting_date,
+        starting_date=event['starting_date'],
         call_uuid=call_uuid,
         duration=duration,
-        billsec=billsec,
-        amd_status=amd_status)
-
-    # If the call failed we will check if we want to make a retry call
-    # Add condition to retry when it s machine and we want to reach a human
-    if (app_type == 'campaign' and opt_hangup_cause != 'NORMAL_CLEARING'
-        and callrequest.call_type == CALLREQUEST_TYPE.ALLOW_RETRY) or \
-       (app_type == 'campaign' and amd_status == 'machine' and callrequest.campaign.voicemail and
-            callrequest.campaign.amd_behavior == AMD_BEHAVIOR.HUMAN_ONLY):
-        # Update to Retry Done
-        callrequest.call_type = CALLREQUEST_TYPE.RETRY_DONE
-        callrequest.save()
-
-        debug_query(26)
-
-        # check if we are allowed to retry on failure
-        if ((callrequest.subscriber.count_attempt - 1) >= callrequest.campaign.maxretry
-                or not callrequest.campaign.maxretry):
-            logger.error("Not allowed retry - Maxretry (%d)" %
-                         callrequest.campaign.maxretry)
-            # Check here if we should try for completion
-            check_retrycall_completion(callrequest)
-            debug_query(28)
-        else:
-            # Allowed Retry
-            logger.error("Allowed Retry - Maxretry (%d)" % callrequest.campaign.maxretry)
-
-            # Create new callrequest, Assign parent_callrequest,
-            # Change callrequest_type & num_attempt
-            new_callrequest = Callrequest(
-                request_uuid=uuid1(),
-                parent_callrequest_id=callrequest.id,
-                call_type=CALLREQUEST_TYPE.ALLOW_RETRY,
-                num_attempt=callrequest.num_attempt + 1,
-                user=callrequest.user,
-                campaign_id=callrequest.campaign_id,
-                aleg_gateway_id=callrequest.aleg_gateway_id,
-                content_type=callrequest.content_type,
-                object_id=callrequest.object_id,
-                phone_number=callrequest.phone_number,
-                timelimit=callrequest.timelimit,
-                callerid=callrequest.callerid,
-                timeout=callrequest.timeout,
-                subscriber_id=callrequest.subscriber_id
-            )
-            new_callrequest.save()
-            # NOTE : implement a PID algorithm
-            second_towait = callrequest.campaign.intervalretry
-            debug_query(29)
-
-            logger.debug("Init Retry CallRequest in  %d seconds" % second_towait)
-            init_callrequest.apply_async(
-                args=[new_callrequest.id, callrequest.campaign.id, callrequest.campaign.callmaxduration],
-                countdown=second_towait)
+        billsec=event['billsec'],
+        amd_status=amd_status,
+        call_event_id=event['call_event_id'])
 
-    elif app_type == 'campaign':
-        # The Call is Answered and it's a campaign call
-        logger.info("Check for completion call")
-
-        # Check if we should relaunch a new call to achieve completion
-        check_retrycall_completion(callrequest)
+    if app_type == 'campaign' and not replayed:
+        if check_campaign_retry(callrequest, opt_hangup_cause, amd_status):
+            callrequest.save()
+            debug_query(26)
 
     elif (opt_hangup_cause != 'NORMAL_CLEARING' and app_type == 'alarm') or \
          (amd_status == 'machine' and app_type == 'alarm' and
@@ -372,6 +412,131 @@ def process_callevent(record):
         logger.info("Retry: No matching conditions")
 
 
+def bulk_update_callrequest(list_callrequest):
+    """
+    Save the status, hangup_cause & call_type of a list of callrequests
+    and the status of their subscribers, using one UPDATE per distinct value
+    """
+    now = datetime.utcnow().replace(tzinfo=utc)
+    group_callrequest = {}
+    group_subscriber = {}
+    for callrequest in list_callrequest:
+        key = (callrequest.status, callrequest.hangup_cause, callrequest.call_type)
+        group_callrequest.setdefault(key, []).append(callrequest.id)
+        if callrequest.subscriber_id:
+            group_subscriber.setdefault(callrequest.subscriber.status, set()).add(callrequest.subscriber_id)
+
+    for (status, hangup_cause, call_type), id_list in group_callrequest.items():
+        Callrequest.objects.filter(id__in=id_list).update(
+            status=status, hangup_cause=hangup_cause, call_type=call_type, updated_date=now)
+
+    for status, id_list in group_subscriber.items():
+        Subscriber.objects.filter(id__in=list(id_list)).update(status=status, updated_date=now)
+
+
+@task(ignore_result=True)
+def process_callevent_batch(list_record):
+    """
+    Process a chunk of callevents in one worker invocation, this tasks will:
+        - Retrieve all the callrequests with their subscriber and campaign
+          in one query
+        - Compute the callrequest & subscriber status in memory
+        - Save the status with bulk updates and push the voipcalls to the
+          CDR buffer which saves them in bulk
+
+    Alarm callevents are rare and are processed one by one with process_callevent
+    """
+    list_event = []
+    callrequest_ids = set()
+    request_uuids = set()
+    for record in list_record:
+        event = parse_callevent(record)
+        event['record'] = record
+        event['request_uuid'] = event['request_uuid'].strip(' \t\n\r')
+        if event['callrequest_id']:
+            callrequest_ids.add(event['callrequest_id'])
+        else:
+            request_uuids.add(event['request_uuid'])
+        list_event.append(event)
+
+    query = Q(id__in=list(callrequest_ids))
+    if request_uuids:
+        query = query | Q(request_uuid__in=list(request_uuids))
+    dict_callrequest = {}
+    dict_callrequest_uuid = {}
+    final_callrequest_ids = set()
+    for callrequest in Callrequest.objects.select_related('aleg_gateway', 'subscriber', 'campaign').filter(query):
+        dict_callrequest[callrequest.id] = callrequest
+        dict_callrequest_uuid[callrequest.request_uuid] = callrequest
+        if callrequest.status in CALLREQUEST_FINAL_STATUS:
+            final_callrequest_ids.add(callrequest.id)
+    debug_query(23)
+
+    updated_callrequest = {}
+    hangup_callrequest_ids = []
+    # The call_event without CDR are flagged now, the others once their CDR is flushed
+    ignored_call_event_ids = []
+    failed_call_event_ids = []
+    for event in list_event:
+        if event['callrequest_id']:
+            callrequest = dict_callrequest.get(event['callrequest_id'])
+        else:
+            callrequest = dict_callrequest_uuid.get(event['request_uuid'])
+        if not callrequest:
+            logger.error("Cannot find Callrequest job_uuid : %s" % event['job_uuid'])
+            ignored_call_event_ids.append(event['call_event_id'])
+            continue
+
+        # The CDR of the callevent is flushed with its status, a callevent failing
+        # before its CDR is buffered is flagged failed
+        buffered = False
+        try:
+            if callrequest.alarm_request_id:
+                process_callevent(event['record'])
+                continue
+
+            opt_hangup_cause = event['hangup_cause']
+            # The aleg of the callrequest has already been processed, the callevent is
+            # replayed after a failed CDR flush and only its CDR is saved again
+            replayed = event['leg'] == 'aleg' and callrequest.id in final_callrequest_ids
+            if replayed:
+                logger.warning("Callevent of CallRequest %d replayed" % callrequest.id)
+            elif event['leg'] == 'aleg':
+                hangup_callrequest_ids.append(callrequest.id)
+                set_callrequest_status(callrequest, opt_hangup_cause)
+                updated_callrequest[callrequest.id] = callrequest
+
+            cdr_buffer.save(
+                obj_callrequest=callrequest,
+                request_uuid=event['request_uuid'],
+                leg=event['leg'],
+                hangup_cause=opt_hangup_cause,
+                hangup_cause_q850=event['hangup_cause_q850'],
+                callerid=event['callerid'] or callrequest.callerid,
+                phonenumber=event['phonenumber'] or callrequest.phone_number,
+                starting_date=event['starting_date'],
+                call_uuid=event['call_uuid'] or event['job_uuid'],
+                duration=event['duration'],
+                billsec=event['billsec'],
+                amd_status=event['amd_status'],
+                call_event_id=event['call_event_id'])
+            buffered = True
+
+            if not replayed and check_campaign_retry(callrequest, opt_hangup_cause, event['amd_status']):
+                updated_callrequest[callrequest.id] = callrequest
+        except Exception as e:
+            logger.error("Error processing call_event %s : %s" % (event['call_event_id'], str(e)))
+            if not buffered:
+                failed_call_event_ids.append(event['call_event_id'])
+
+    set_callevent_status(ignored_call_event_ids, CALLEVENT_STATUS.IGNORED)
+    set_callevent_status(failed_call_event_ids, CALLEVENT_STATUS.FAILED)
+    bulk_update_callrequest(updated_callrequest.values())
+    release_dialer_node(hangup_callrequest_ids)
+    debug_query(24)
+    logger.info("Processed Call_Event batch : %d" % len(list_event))
+
+
 # OPTIMIZATION - TO REVIEW
 def callevent_processing():
     """
@@ -398,7 +563,9 @@ def callevent_processing():
         starting_date timestamp with time zone,
         status smallint,
         leg smallint,
-        created_date timestamp with time zone NOT NULL
+        created_date timestamp with time zone NOT NULL,
+        claimed_date timestamp with time zone,
+        requeue_count smallint NOT NULL DEFAULT 0
         );
     CREATE INDEX call_event_idx_status ON call_event (status);
     --CREATE INDEX call_event_idx_date ON call_event (created_date);
@@ -406,42 +573,76 @@ def callevent_processing():
     """
     debug_query(20)
 
-    cursor = connection.cursor()
-    # TODO (Areski)
-    # Replace this for ORM with select_for_update or transaction
-
     try:
-        sql_statement = "SELECT id, event_name, body, job_uuid, call_uuid, used_gateway_id, " \
-            "callrequest_id, alarm_request_id, callerid, phonenumber, duration, billsec, hangup_cause, " \
-            "hangup_cause_q850, starting_date, status, created_date, amd_status, leg " \
-            "FROM call_event WHERE status=1 LIMIT 1000 OFFSET 0"
-
-        cursor.execute(sql_statement)
-        row = cursor.fetchall()
+        row = claim_callevent(1000)
     except:
         # Error on sql / Lua listener might not be on
         logger.error("Error Fetching call_event")
     else:
         debug_query(21)
-        # buff_voipcall = BufferVoIPCall()
-        call_event_list = []
-        for record in row:
-            call_event_id = record[0]
-            event_name = record[1]
-            call_event_list.append(str(call_event_id))
-            logger.info("Processing Call_Event : %s" % event_name)
-            process_callevent.delay(record)
-
-        if call_event_list:
-            # Update Call Event
-            sql_statement = "UPDATE call_event SET status=2 WHERE id IN (%s)" % ','.join(call_event_list)
-            cursor.execute(sql_statement)
-            debug_query(30)
-        # buff_voipcall.commit()
-        # debug_query(31)
+        if settings.CALLEVENT_BATCH_SIZE > 0:
+            # Process the callevents per chunk, one task per chunk
+            for i in range(0, len(row), settings.CALLEVENT_BATCH_SIZE):
+                chunk = row[i:i + settings.CALLEVENT_BATCH_SIZE]
+                logger.info("Processing Call_Event batch : %d" % len(chunk))
+                process_callevent_batch.delay(chunk)
+        else:
+            for record in row:
+                logger.info("Processing Call_Event : %s" % record[1])
+                process_callevent.delay(record)
         logger.debug('End Loop : callevent_processing')
 
 
+def claim_callevent(limit):
+    """
+    Claim up to ``limit`` pending call_event and flag them as in process in one statement,
+    rows locked by another consumer are skipped so several workers can drain
+    the call_event table in parallel without processing an event twice
+
+    The call_event will be flagged as processed when their CDRs are flushed
+    by the CDR buffer, or as ignored or failed when they have no CDR,
+    claimed_date is the time of the claim used to requeue the call_event of
+    the dead workers
+    """
+    cursor = connection.cursor()
+    sql_statement = "UPDATE call_event SET status=%d, claimed_date=NOW() WHERE id IN (" \
+        "SELECT id FROM call_event WHERE status=%d ORDER BY id LIMIT %d FOR UPDATE SKIP LOCKED) " \
+        "RETURNING id, event_name, body, job_uuid, call_uuid, used_gateway_id, " \
+        "callrequest_id, alarm_request_id, callerid, phonenumber, duration, billsec, hangup_cause, " \
+        "hangup_cause_q850, starting_date, status, created_date, amd_status, leg" % \
+        (CALLEVENT_STATUS.IN_PROCESS, CALLEVENT_STATUS.PENDING, limit)
+    cursor.execute(sql_statement)
+    # RETURNING doesn't preserve the order of the subquery
+    return sorted(cursor.fetchall(), key=lambda record: record[0])
+
+
+def requeue_callevent():
+    """
+    Requeue the call_event which have been claimed but never flagged as processed,
+    this happens when a worker dies before flushing its CDR buffer
+
+    The delay is counted from the claim, the call_event claimed before
+    claimed_date existed fall back on their created_date. The call_event
+    already requeued CALLEVENT_MAX_REQUEUE times are flagged failed instead,
+    so a call_event failing its processing isn't replayed forever.
+    """
+    cursor = connection.cursor()
+    sql_expired = "status=%d AND COALESCE(claimed_date, created_date) < NOW() - interval '%d seconds'" % \
+        (CALLEVENT_STATUS.IN_PROCESS, settings.CALLEVENT_REQUEUE_DELAY)
+    try:
+        cursor.execute("UPDATE call_event SET status=%d WHERE %s AND requeue_count >= %d" %
+                       (CALLEVENT_STATUS.FAILED, sql_expired, settings.CALLEVENT_MAX_REQUEUE))
+        if cursor.rowcount > 0:
+            logger.error("Failed call_event : %d" % cursor.rowcount)
+        cursor.execute("UPDATE call_event SET status=%d, requeue_count=requeue_count + 1 WHERE %s" %
+                       (CALLEVENT_STATUS.PENDING, sql_expired))
+    except:
+        logger.error("Error Requeuing call_event")
+    else:
+        if cursor.rowcount > 0:
+            logger.warning("Requeued call_event : %d" % cursor.rowcount)
+
+
 class task_pending_callevent(PeriodicTask):
 
     """
@@ -455,14 +656,31 @@ class task_pending_callevent(PeriodicTask):
     # of calls per minute. Cons : new calls might delay 60seconds
     run_every = timedelta(seconds=15)
 
-    # run_every = timedelta(seconds=15)
-
-    # TODO: problem of the lock if it's a cloud, it won't be shared
-    @only_one(ikey="task_pending_callevent", timeout=LOCK_EXPIRE)
+    # No lock needed, call_event are claimed atomically by claim_callevent
+    # so several workers on several nodes can drain the table in parallel
     def run(self, **kwargs):
         logger.info("TASK :: task_pending_callevent")
+        requeue_callevent()
         callevent_processing()
 
+
+class task_reconcile_dialer_node(PeriodicTask):
+
+    """
+    A periodic task that rebuilds the calls in flight of the FreeSWITCH nodes
+    from the callrequests still calling
+
+    **Usage**:
+
+        reconcile_node_channels()
+    """
+    run_every = timedelta(seconds=settings.FREESWITCH_NODE_RECONCILE)
+
+    def run(self, **kwargs):
+        logger.info("TASK :: task_reconcile_dialer_node")
+        channels = reconcile_node_channels()
+        logger.debug("Calls in flight per node : %s" % channels)
+
 """
 from celery.decorators import periodic_task
 from datetime import timedelta
@@ -494,46 +712,31 @@ def callrequest_pending(*args, **kwargs):
 """
 
 
-@task(ignore_result=True)
-def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=0, alarm_request_id=None):
+def attach_campaign_config(obj_callrequest, obj_campaign):
     """
-    This task read the callrequest, update it as 'In Process'
-    then proceed on the call outbound, using the different call engine supported
+    Set the campaign, gateway and user of the callrequest from the cached
+    configuration of its campaign, instead of reading them for each call
+    """
+    obj_callrequest.campaign = obj_campaign
+    if obj_callrequest.aleg_gateway_id == obj_campaign.aleg_gateway_id:
+        obj_callrequest.aleg_gateway = obj_campaign.aleg_gateway
+    if obj_callrequest.user_id == obj_campaign.user_id:
+        obj_callrequest.user = obj_campaign.user
 
-    **Attributes**:
 
-        * ``callrequest_id`` - Callrequest ID
-        * ``campaign_id`` - Campaign ID
-        * ``callmaxduration`` - Max duration
-        * ``ms_addtowait`` - Milliseconds to wait before outbounding the call
+def build_dial_command(obj_callrequest, campaign_id, callmaxduration, alarm_request_id=None):
+    """
+    Build the originate command of a callrequest, return False if the
+    phone number cannot be dialed
 
+    The callrequest needs to be loaded with its aleg_gateway, user__userprofile
+    and for campaign with subscriber
     """
-    outbound_failure = False
     subscriber_id = None
     contact_id = None
-    debug_query(8)
-
-    if ms_addtowait > 0:
-        sleep(ms_addtowait)
-
-    # Survey Call or Alarm Call
     if campaign_id:
-        # TODO: use only
-        # https://docs.djangoproject.com/en/dev/ref/models/querysets/#django.db.models.query.QuerySet.only
-        obj_callrequest = Callrequest.objects\
-            .select_related('aleg_gateway', 'user__userprofile', 'subscriber', 'campaign').get(id=callrequest_id)
         subscriber_id = obj_callrequest.subscriber_id
         contact_id = obj_callrequest.subscriber.contact_id
-    elif alarm_request_id:
-        obj_callrequest = Callrequest.objects.select_related('aleg_gateway', 'user__userprofile').get(id=callrequest_id)
-        alarm_request_id = obj_callrequest.alarm_request_id
-    else:
-        logger.info("TASK :: init_callrequest, wrong campaign_id & alarm_request_id")
-        return False
-
-    debug_query(9)
-    logger.info("TASK :: init_callrequest - status:%s;cmpg:%s;alarm:%s" %
-                (obj_callrequest.status, campaign_id, alarm_request_id))
 
     # TODO: move method prepare_phonenumber into the model gateway
     # Obj_callrequest.aleg_gatewayprepare_phonenumber()
@@ -548,8 +751,6 @@ def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=
     else:
         logger.debug("dialout_phone_number : %s" % dialout_phone_number)
 
-    debug_query(10)
-
     if settings.DIALERDEBUG:
         dialout_phone_number = settings.DIALERDEBUG_PHONENUMBER
 
@@ -568,8 +769,6 @@ def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=
         dialing_timeout = 45
     originate_dial_string = obj_callrequest.aleg_gateway.originate_dial_string
 
-    debug_query(11)
-
     # Sanitize gateways
     gateways = gateways.strip()
     if gateways[-1] != '/':
@@ -580,93 +779,135 @@ def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=
         originate_dial_string = originate_dial_string + ',accountcode=' + \
             str(obj_callrequest.user.userprofile.accountcode)
 
-    debug_query(12)
+    args_list = []
+    send_digits = False
+    time_limit = callmaxduration
+
+    # To wait before sending DTMF to the extension, you can add leading 'w'
+    # characters.
+    # Each 'w' character waits 0.5 seconds instead of sending a digit.
+    # Each 'W' character waits 1.0 seconds instead of sending a digit.
+    # You can also add the tone duration in ms by appending @[duration] after string.
+    # Eg. 1w2w3@1000
+    check_senddigit = dialout_phone_number.partition('w')
+    if check_senddigit[1] == 'w':
+        send_digits = check_senddigit[1] + check_senddigit[2]
+        dialout_phone_number = check_senddigit[0]
+
+    if obj_callrequest.callerid and len(obj_callrequest.callerid) > 0:
+        args_list.append("origination_caller_id_number='%s'" % obj_callrequest.callerid)
+    if obj_callrequest.caller_name and len(obj_callrequest.caller_name) > 0:
+        args_list.append("origination_caller_id_name='%s'" % obj_callrequest.caller_name)
+
+    # Add App Vars
+    args_list.append("campaign_id=%s,subscriber_id=%s,alarm_request_id=%s,used_gateway_id=%s,callrequest_id=%s,contact_id=%s,dialout_phone_number=%s" %
+                     (campaign_id, subscriber_id, alarm_request_id, gateway_id, obj_callrequest.id, contact_id, obj_callrequest.phone_number))
+    args_list.append(originate_dial_string)
+
+    # Call Vars
+    callvars = "bridge_early_media=true,originate_timeout=%d,newfiesdialer=true,leg_type=1" % \
+        (dialing_timeout, )
+    args_list.append(callvars)
+
+    # Default Test
+    hangup_on_ring = ''
+    send_preanswer = False
+    # set hangup_on_ring
+    try:
+        hangup_on_ring = int(hangup_on_ring)
+    except ValueError:
+        hangup_on_ring = -1
+    exec_on_media = 1
+    if hangup_on_ring >= 10:  # 0->10 fraud protection on short calls
+        args_list.append("execute_on_media_%d='sched_hangup +%d ORIGINATOR_CANCEL'" %
+                         (exec_on_media, hangup_on_ring))
+        exec_on_media += 1
+
+    # TODO: look and test http://wiki.freeswitch.org/wiki/Misc._Dialplan_Tools_queue_dtmf
+    # Send digits
+    if send_digits:
+        if send_preanswer:
+            args_list.append("execute_on_media_%d='send_dtmf %s'" % (exec_on_media, send_digits))
+            exec_on_media += 1
+        else:
+            args_list.append("execute_on_answer='send_dtmf %s'" % send_digits)
 
-    if settings.NEWFIES_DIALER_ENGINE.lower() == 'esl':
-        try:
-            args_list = []
-            send_digits = False
-            time_limit = callmaxduration
-
-            # To wait before sending DTMF to the extension, you can add leading 'w'
-            # characters.
-            # Each 'w' character waits 0.5 seconds instead of sending a digit.
-            # Each 'W' character waits 1.0 seconds instead of sending a digit.
-            # You can also add the tone duration in ms by appending @[duration] after string.
-            # Eg. 1w2w3@1000
-            check_senddigit = dialout_phone_number.partition('w')
-            if check_senddigit[1] == 'w':
-                send_digits = check_senddigit[1] + check_senddigit[2]
-                dialout_phone_number = check_senddigit[0]
-
-            if obj_callrequest.callerid and len(obj_callrequest.callerid) > 0:
-                args_list.append("origination_caller_id_number='%s'" % obj_callrequest.callerid)
-            if obj_callrequest.caller_name and len(obj_callrequest.caller_name) > 0:
-                args_list.append("origination_caller_id_name='%s'" % obj_callrequest.caller_name)
-
-            # Add App Vars
-            args_list.append("campaign_id=%s,subscriber_id=%s,alarm_request_id=%s,used_gateway_id=%s,callrequest_id=%s,contact_id=%s,dialout_phone_number=%s" %
-                             (campaign_id, subscriber_id, alarm_request_id, gateway_id, obj_callrequest.id, contact_id, obj_callrequest.phone_number))
-            args_list.append(originate_dial_string)
-
-            # Call Vars
-            callvars = "bridge_early_media=true,originate_timeout=%d,newfiesdialer=true,leg_type=1" % \
-                (dialing_timeout, )
-            args_list.append(callvars)
-
-            # Default Test
-            hangup_on_ring = ''
-            send_preanswer = False
-            # set hangup_on_ring
-            try:
-                hangup_on_ring = int(hangup_on_ring)
-            except ValueError:
-                hangup_on_ring = -1
-            exec_on_media = 1
-            if hangup_on_ring >= 10:  # 0->10 fraud protection on short calls
-                args_list.append("execute_on_media_%d='sched_hangup +%d ORIGINATOR_CANCEL'" %
-                                 (exec_on_media, hangup_on_ring))
-                exec_on_media += 1
-
-            # TODO: look and test http://wiki.freeswitch.org/wiki/Misc._Dialplan_Tools_queue_dtmf
-            # Send digits
-            if send_digits:
-                if send_preanswer:
-                    args_list.append("execute_on_media_%d='send_dtmf %s'" % (exec_on_media, send_digits))
-                    exec_on_media += 1
-                else:
-                    args_list.append("execute_on_answer='send_dtmf %s'" % send_digits)
+    # Set time_limit
+    try:
+        time_limit = int(time_limit)
+        if time_limit > 0:
+            args_list.append("execute_on_answer='sched_hangup +%d ALLOTTED_TIMEOUT'" % time_limit)
+    except ValueError:
+        logger.error('ValueError time_limit :> %s' % time_limit)
 
-            # Set time_limit
-            try:
-                time_limit = int(time_limit)
-                if time_limit > 0:
-                    args_list.append("execute_on_answer='sched_hangup +%d ALLOTTED_TIMEOUT'" % time_limit)
-            except ValueError:
-                logger.error('ValueError time_limit :> %s' % time_limit)
-
-            # build originate string
-            args_str = ','.join(args_list)
-
-            # DEBUG
-            # settings.ESL_SCRIPT = '&playback(/usr/local/freeswitch/sounds/en/us/callie/voicemail/8000/vm-record_greeting.wav)'
-            if settings.DIALERDEBUG:
-                dial_command = "originate {%s}user/areski '%s'" % (args_str, settings.ESL_SCRIPT)
-            else:
-                dial_command = "originate {%s}%s%s '%s'" % \
-                    (args_str, gateways, dialout_phone_number, settings.ESL_SCRIPT)
+    # build originate string
+    args_str = ','.join(args_list)
+
+    # DEBUG
+    # settings.ESL_SCRIPT = '&playback(/usr/local/freeswitch/sounds/en/us/callie/voicemail/8000/vm-record_greeting.wav)'
+    if settings.DIALERDEBUG:
+        dial_command = "originate {%s}user/areski '%s'" % (args_str, settings.ESL_SCRIPT)
+    else:
+        dial_command = "originate {%s}%s%s '%s'" % \
+            (args_str, gateways, dialout_phone_number, settings.ESL_SCRIPT)
+
+    # originate {bridge_early_media=true,hangup_after_bridge=true,originate_timeout=10}user/areski &playback(/tmp/myfile.wav)
+    # dial = "originate {bridge_early_media=true,hangup_after_bridge=true,originate_timeout=,newfiesdialer=true,used_gateway_id=1,callrequest_id=38,leg_type=1,origination_caller_id_number=234234234,origination_caller_id_name=234234,effective_caller_id_number=234234234,effective_caller_id_name=234234,}user//1000 '&lua(/usr/share/newfies-lua/newfies.lua)'"
+
+    # Load balance on testing
+    # from random import randint, seed
+    # seed()
+    # randval = randint(1, 2)
+    # if randval == 1:
+    #     dial_command = dial_command.replace('88.208.208.244', '88.208.208.209')
+    # logger.warn('dial_command (%d): %s' % (randval, dial_command))
+    return dial_command
+
+
+@task(ignore_result=True)
+def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=0, alarm_request_id=None):
+    """
+    This task read the callrequest, update it as 'In Process'
+    then proceed on the call outbound, using the different call engine supported
+
+    **Attributes**:
+
+        * ``callrequest_id`` - Callrequest ID
+        * ``campaign_id`` - Campaign ID
+        * ``callmaxduration`` - Max duration
+        * ``ms_addtowait`` - Milliseconds to wait before outbounding the call
 
-            # originate {bridge_early_media=true,hangup_after_bridge=true,originate_timeout=10}user/areski &playback(/tmp/myfile.wav)
-            # dial = "originate {bridge_early_media=true,hangup_after_bridge=true,originate_timeout=,newfiesdialer=true,used_gateway_id=1,callrequest_id=38,leg_type=1,origination_caller_id_number=234234234,origination_caller_id_name=234234,effective_caller_id_number=234234234,effective_caller_id_name=234234,}user//1000 '&lua(/usr/share/newfies-lua/newfies.lua)'"
+    """
+    outbound_failure = False
+    debug_query(8)
 
-            # Load balance on testing
-            # from random import randint, seed
-            # seed()
-            # randval = randint(1, 2)
-            # if randval == 1:
-            #     dial_command = dial_command.replace('88.208.208.244', '88.208.208.209')
-            # logger.warn('dial_command (%d): %s' % (randval, dial_command))
+    if ms_addtowait > 0:
+        sleep(ms_addtowait)
 
+    # Survey Call or Alarm Call
+    if campaign_id:
+        # The campaign, gateway & user come from the campaign config cache
+        obj_callrequest = Callrequest.objects.select_related('subscriber').get(id=callrequest_id)
+        attach_campaign_config(obj_callrequest, campaign_config.get(campaign_id))
+    elif alarm_request_id:
+        obj_callrequest = Callrequest.objects.select_related('aleg_gateway', 'user__userprofile').get(id=callrequest_id)
+        alarm_request_id = obj_callrequest.alarm_request_id
+    else:
+        logger.info("TASK :: init_callrequest, wrong campaign_id & alarm_request_id")
+        return False
+
+    debug_query(9)
+    logger.info("TASK :: init_callrequest - status:%s;cmpg:%s;alarm:%s" %
+                (obj_callrequest.status, campaign_id, alarm_request_id))
+
+    dial_command = build_dial_command(obj_callrequest, campaign_id, callmaxduration, alarm_request_id)
+    if not dial_command:
+        return False
+
+    debug_query(12)
+
+    if settings.NEWFIES_DIALER_ENGINE.lower() == 'esl':
+        try:
             logger.warn('dial_command : %s' % dial_command)
             request_uuid = dial_out(dial_command, obj_callrequest.id)
 
@@ -717,6 +958,140 @@ def init_callrequest(callrequest_id, campaign_id, callmaxduration, ms_addtowait=
     return True
 
 
+@task(ignore_result=True)
+def init_callrequest_batch(list_callrequest_id, campaign_id, callmaxduration, time_to_wait=0):
+    """
+    Originate a batch of callrequests of a campaign through a single ESL
+    connection, the calls are spaced by time_to_wait seconds. Each
+    callrequest is updated as soon as it's originated, its hangup can be
+    processed before the end of the batch, then the subscribers are updated
+    with a few statements
+
+    **Attributes**:
+
+        * ``list_callrequest_id`` - List of Callrequest ID
+        * ``campaign_id`` - Campaign ID
+        * ``callmaxduration`` - Max duration
+        * ``time_to_wait`` - Seconds to wait between two calls
+    """
+    list_callrequest = list(Callrequest.objects.select_related('subscriber')
+                            .filter(id__in=list_callrequest_id).order_by('id'))
+    obj_campaign = campaign_config.get(campaign_id)
+    for obj_callrequest in list_callrequest:
+        attach_campaign_config(obj_callrequest, obj_campaign)
+    logger.info("TASK :: init_callrequest_batch - cmpg:%s;calls:%d" % (campaign_id, len(list_callrequest)))
+
+    if settings.NEWFIES_DIALER_ENGINE.lower() != 'esl':
+        logger.error('No other method supported!')
+        Callrequest.objects.filter(id__in=list_callrequest_id).update(
+            status=CALLREQUEST_STATUS.FAILURE, updated_date=datetime.utcnow().replace(tzinfo=utc))
+        return False
+
+    node = pool = c = None
+    if ESL:
+        (node, pool, c) = get_dialer_connection()
+    # A channel of the node is reserved for the next call
+    reserved = c is not None
+
+    list_subscriber_id = []
+    list_failed_subscriber_id = []
+    start = time.time()
+    # The connection is released as broken if the batch is interrupted
+    broken = True
+    try:
+        for count, obj_callrequest in enumerate(list_callrequest):
+            dial_command = build_dial_command(obj_callrequest, campaign_id, callmaxduration)
+            if not dial_command:
+                continue
+
+            # Keep the pace computed by the spooler
+            delay = start + count * time_to_wait - time.time()
+            if delay > 0:
+                sleep(delay)
+
+            if c and not reserved:
+                reserved = reserve_node_channel(node)
+                if not reserved:
+                    # The node reached max_channels, move to the least loaded node
+                    pool.release(c)
+                    c = None
+                    (node, pool, c) = get_dialer_connection()
+                    reserved = c is not None
+
+            if not ESL:
+                request_uuid = 'load esl error'
+            elif not c:
+                request_uuid = 'error'
+            else:
+                logger.warn('dial_command : %s' % dial_command)
+                try:
+                    request_uuid = originate(c, dial_command)
+                except Exception as e:
+                    logger.error("Originate of CallRequest %d failed: %s" % (obj_callrequest.id, str(e)))
+                    request_uuid = 'error'
+                # The reserved channel is used by this call
+                reserved = False
+                if request_uuid == 'error':
+                    # The connection is broken, try to get a new one for the next calls
+                    cancel_dialer_node(node)
+                    pool.release(c, broken=True)
+                    c = None
+                    (node, pool, c) = get_dialer_connection()
+                    reserved = c is not None
+                else:
+                    acquire_dialer_node(node, obj_callrequest.id)
+            logger.debug('Received RequestUUID :> %s' % request_uuid)
+
+            update_callrequest_originate(obj_callrequest.id, request_uuid)
+            list_subscriber_id.append(obj_callrequest.subscriber_id)
+            if request_uuid[:5] == 'error':
+                list_failed_subscriber_id.append(obj_callrequest.subscriber_id)
+        broken = False
+    finally:
+        if c:
+            if reserved:
+                cancel_dialer_node(node)
+            pool.release(c, broken=broken)
+
+    if list_subscriber_id:
+        update_callrequest_batch(list_subscriber_id, list_failed_subscriber_id)
+    return True
+
+
+def update_callrequest_originate(callrequest_id, request_uuid):
+    """
+    Save the request_uuid & status of a callrequest once originated, the
+    -ERR BACKGROUND_JOB events find the callrequest by its request_uuid.
+    The callrequests whose hangup has already been processed aren't pending
+    anymore and are left unchanged.
+    """
+    if request_uuid[:5] == 'error':
+        status = CALLREQUEST_STATUS.FAILURE
+    else:
+        status = CALLREQUEST_STATUS.CALLING
+    return Callrequest.objects.filter(id=callrequest_id, status=CALLREQUEST_STATUS.PENDING).update(
+        request_uuid=request_uuid, status=status, updated_date=datetime.utcnow().replace(tzinfo=utc))
+
+
+def update_callrequest_batch(list_subscriber_id, list_failed_subscriber_id):
+    """
+    Update the attempt of the subscribers called by init_callrequest_batch,
+    the callrequests are updated after each call by update_callrequest_originate
+
+    **Attributes**:
+
+        * ``list_subscriber_id`` - Subscribers called
+        * ``list_failed_subscriber_id`` - Subscribers whose call failed
+    """
+    now = datetime.utcnow().replace(tzinfo=utc)
+    Subscriber.objects.filter(id__in=list_subscriber_id, count_attempt__isnull=True).update(count_attempt=0)
+    Subscriber.objects.filter(id__in=list_subscriber_id).update(
+        count_attempt=F('count_attempt') + 1, last_attempt=now, updated_date=now)
+    if list_failed_subscriber_id:
+        Subscriber.objects.filter(id__in=list_failed_subscriber_id).update(
+            status=SUBSCRIBER_STATUS.FAIL, updated_date=now)
+
+
 # def event_replace_tag(text, phone_number, additional_vars):
 #     """
 #     Replace tag by contact values
@@ -12,19 +12,38 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 from django_lets_go.utils import BaseAuthenticatedClient
-from dialer_campaign.models import Campaign
-from dialer_cdr.models import Callrequest, VoIPCall
+from dialer_campaign.models import Campaign, Subscriber
+from dialer_campaign.constants import SUBSCRIBER_STATUS
+from dialer_cdr.models import Callrequest, VoIPCall, VoIPCallRollup, truncate_date, rollup_filter
 from dialer_cdr.forms import VoipSearchForm
 from dialer_cdr.views import export_voipcall_report, voipcall_report
 from dialer_cdr.function_def import voipcall_search_admin_form_fun
+from dialer_cdr.constants import CALLREQUEST_STATUS, CALLEVENT_STATUS, ROLLUP_PERIOD
+from dialer_cdr.utils import parse_callevent, get_disposition, cdr_buffer, BufferVoIPCall
+from dialer_cdr.tasks import process_callevent_batch, update_callrequest_batch, \
+    update_callrequest_originate, claim_callevent, requeue_callevent
+from dialer_cdr.management.commands.listen_callevent import Command as ListenCallEventCommand
+from dialer_cdr.esl_pool import ESLConnectionPool, ESLPoolError, ESL
+from mod_utils.exporter import ExportJob
+from mod_utils.report import ReportJob, report_job_id, report_job_key
+from django.core.cache import cache
+from dialer_cdr.dispatcher import select_dialer_node, reserve_dialer_node, reserve_node_channel, \
+    acquire_dialer_node, cancel_dialer_node, release_dialer_node, set_node_down, reconcile_node_channels
 # from dialer_cdr.tasks import init_callrequest
 from datetime import datetime
 from django.utils.timezone import utc
+from django.utils import unittest
+from uuid import uuid1
+import SocketServer
+import json
+import threading
 
 
 class DialerCdrView(BaseAuthenticatedClient):
@@ -126,6 +145,49 @@ class DialerCdrCustomerView(BaseAuthenticatedClient):
         response = export_voipcall_report(request)
         self.assertEqual(response.status_code, 200)
 
+    def test_export_voipcall_report_stream(self):
+        """The CSV export is streamed, the XLS export is written by a task"""
+        kwargs = {'user': self.user}
+        voipcall_count = VoIPCall.objects.filter(**kwargs).count()
+        request = self.factory.get('/export_voipcall_report/?format=csv')
+        request.user = self.user
+        request.session = {'voipcall_record_kwargs': kwargs}
+        response = export_voipcall_report(request)
+        self.assertTrue(response.streaming)
+        content = ''.join(response.streaming_content)
+        self.assertTrue(content.startswith('user,callid,callerid,phone_number,starting_date'))
+        self.assertEqual(len(content.splitlines()), voipcall_count + 1)
+
+        request = self.factory.get('/export_voipcall_report/?format=xls')
+        request.user = self.user
+        request.session = {'voipcall_record_kwargs': kwargs}
+        response = export_voipcall_report(request)
+        self.assertEqual(response.status_code, 200)
+        # CELERY_ALWAYS_EAGER, the file is written by the time the page is returned
+        job_id = response.content.split('/export/status/')[1].split('/')[0]
+        job = ExportJob.get(job_id)
+        self.assertEqual(job.status, ExportJob.DONE)
+        self.assertEqual(job.row_count, voipcall_count)
+        response = self.client.get('/export/download/%s/' % job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment;filename=export.xls')
+
+    def test_voipcall_report_job(self):
+        """The daily data of the CDR report is computed once by a report job"""
+        kwargs = {'user_id': self.user.id}
+        report_path = 'dialer_cdr.views.voipcall_report_data'
+        job_id = report_job_id(report_path, self.user.id, kwargs)
+        cache.delete(report_job_key(job_id))
+        # CELERY_ALWAYS_EAGER, the report is computed by the time the job is returned
+        report_job = ReportJob.start(report_path, self.user.id, kwargs)
+        self.assertEqual(report_job.job_id, job_id)
+        self.assertTrue(report_job.is_done())
+        self.assertEqual(report_job.data['call_count'], VoIPCall.objects.filter(**kwargs).count())
+        self.assertEqual(ReportJob.start(report_path, self.user.id, dict(kwargs)).data, report_job.data)
+
+        response = self.client.get('/report/status/%s/' % job_id)
+        self.assertEqual(json.loads(response.content)['status'], ReportJob.DONE)
+
 
 class DialerCdrCeleryTaskTestCase(TestCase):
 
@@ -141,12 +203,181 @@ class DialerCdrCeleryTaskTestCase(TestCase):
         self.callrequest = Callrequest.objects.get(pk=1)
         self.campaign = Campaign.objects.get(pk=1)
 
+    def create_call_event(self, status_list):
+        """call_event is created by listener.lua, create it with one row per (id, status)"""
+        cursor = connection.cursor()
+        cursor.execute(
+            "CREATE TABLE call_event (id integer PRIMARY KEY, event_name varchar(200), body varchar(200), "
+            "job_uuid varchar(200), call_uuid varchar(200), used_gateway_id integer, callrequest_id integer, "
+            "alarm_request_id integer, callerid varchar(200), phonenumber varchar(200), duration integer, "
+            "billsec integer, hangup_cause varchar(40), hangup_cause_q850 varchar(10), amd_status varchar(40), "
+            "leg varchar(10), starting_date timestamp with time zone, status smallint, "
+            "created_date timestamp with time zone NOT NULL, claimed_date timestamp with time zone, "
+            "requeue_count smallint NOT NULL DEFAULT 0)")
+        for (call_event_id, status) in status_list:
+            cursor.execute(
+                "INSERT INTO call_event (id, event_name, call_uuid, callrequest_id, status, created_date) "
+                "VALUES (%d, 'CHANNEL_HANGUP_COMPLETE', 'call-uuid-%d', %d, %d, CURRENT_TIMESTAMP)" %
+                (call_event_id, call_event_id, self.callrequest.id, status))
+        return cursor
+
     # def test_init_callrequest(self):
     #    """Test that the ``init_callrequest``
     #    task runs with no errors, and returns the correct result."""
     #    result = init_callrequest.delay(self.callrequest.id, self.campaign.id, 30)
     #    self.assertEqual(result.successful(), True)
 
+    def test_process_callevent_batch(self):
+        """Test that the ``process_callevent_batch`` task updates the
+        callrequests and creates the voipcalls"""
+        self.callrequest.subscriber_id = 1
+        self.callrequest.call_type = 2
+        self.callrequest.save()
+        now = datetime.utcnow().replace(tzinfo=utc)
+        record = (1, 'CHANNEL_HANGUP_COMPLETE', '', self.callrequest.request_uuid, 'call-uuid-1',
+                  1, self.callrequest.id, 0, '', '', 20, 15, 'NORMAL_CLEARING', '16',
+                  now, 1, now, 'person', 'aleg')
+        self.assertEqual(parse_callevent(record)['callrequest_id'], self.callrequest.id)
+        self.assertEqual(get_disposition('NORMAL_CLEARING'), 'ANSWER')
+
+        cursor = self.create_call_event([(1, CALLEVENT_STATUS.IN_PROCESS)])
+
+        count_voipcall = VoIPCall.objects.count()
+        process_callevent_batch.delay([record])
+        callrequest = Callrequest.objects.get(pk=self.callrequest.id)
+        self.assertEqual(callrequest.status, CALLREQUEST_STATUS.SUCCESS)
+        self.assertEqual(callrequest.hangup_cause, 'NORMAL_CLEARING')
+
+        # CDRs are saved when the buffer is flushed
+        self.assertEqual(cdr_buffer.flush(), 1)
+        self.assertEqual(VoIPCall.objects.count(), count_voipcall + 1)
+        cursor.execute("SELECT status FROM call_event WHERE id=1")
+        self.assertEqual(cursor.fetchone()[0], CALLEVENT_STATUS.PROCESSED)
+
+    def test_process_callevent_batch_ignored(self):
+        """Test that the callevents of calls not made by the dialer are flagged ignored"""
+        now = datetime.utcnow().replace(tzinfo=utc)
+        record = (1, 'CHANNEL_HANGUP_COMPLETE', '', '', 'call-uuid-1',
+                  1, 0, 0, '', '', 20, 15, 'NORMAL_CLEARING', '16',
+                  now, 1, now, 'person', 'aleg')
+        cursor = self.create_call_event([(1, CALLEVENT_STATUS.IN_PROCESS)])
+        process_callevent_batch.delay([record])
+        cursor.execute("SELECT status FROM call_event WHERE id=1")
+        self.assertEqual(cursor.fetchone()[0], CALLEVENT_STATUS.IGNORED)
+
+    def test_buffer_voipcall_retry(self):
+        """Test that the CDRs of a failed flush are kept and saved by the next flush"""
+        buffer_voipcall = BufferVoIPCall(max_size=10, max_retry=1)
+        buffer_voipcall.save(self.callrequest, self.callrequest.request_uuid, call_event_id=1)
+        count_voipcall = VoIPCall.objects.count()
+
+        # call_event doesn't exist yet, the flush fails
+        self.assertEqual(buffer_voipcall.flush(), 0)
+        self.assertEqual(len(buffer_voipcall.list_voipcall), 1)
+        self.assertEqual(VoIPCall.objects.count(), count_voipcall)
+
+        self.create_call_event([(1, CALLEVENT_STATUS.IN_PROCESS)])
+        self.assertEqual(buffer_voipcall.flush(), 1)
+        self.assertEqual(VoIPCall.objects.count(), count_voipcall + 1)
+        self.assertEqual(buffer_voipcall.list_voipcall, [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED requires PostgreSQL')
+    def test_claim_callevent(self):
+        """Test that ``claim_callevent`` returns the pending call_event
+        sorted by id and flags them as in process"""
+        cursor = self.create_call_event([
+            (3, CALLEVENT_STATUS.PENDING), (1, CALLEVENT_STATUS.PENDING),
+            (2, CALLEVENT_STATUS.PENDING), (4, CALLEVENT_STATUS.PROCESSED)])
+
+        list_record = claim_callevent(10)
+        self.assertEqual([record[0] for record in list_record], [1, 2, 3])
+        cursor.execute("SELECT id FROM call_event WHERE status=%d AND claimed_date IS NOT NULL ORDER BY id" %
+                       CALLEVENT_STATUS.IN_PROCESS)
+        self.assertEqual([row[0] for row in cursor.fetchall()], [1, 2, 3])
+
+        # The claimed call_event aren't claimed again
+        self.assertEqual(claim_callevent(10), [])
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED requires PostgreSQL')
+    def test_listen_callevent_process_pending(self):
+        """Test that ``process_pending`` of listen_callevent claims and
+        processes the pending call_event until the table is drained"""
+        cursor = self.create_call_event([
+            (1, CALLEVENT_STATUS.PENDING), (2, CALLEVENT_STATUS.PENDING), (3, CALLEVENT_STATUS.PENDING)])
+
+        # Claimed by 2, the last claim is shorter than the limit
+        ListenCallEventCommand().process_pending(2)
+        cdr_buffer.flush()
+        cursor.execute("SELECT COUNT(*) FROM call_event WHERE status IN (%d, %d)" %
+                       (CALLEVENT_STATUS.PENDING, CALLEVENT_STATUS.IN_PROCESS))
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'interval requires PostgreSQL')
+    def test_requeue_callevent(self):
+        """Test that ``requeue_callevent`` requeues the call_event claimed
+        for more than CALLEVENT_REQUEUE_DELAY"""
+        cursor = self.create_call_event([
+            (1, CALLEVENT_STATUS.IN_PROCESS), (2, CALLEVENT_STATUS.IN_PROCESS),
+            (3, CALLEVENT_STATUS.PROCESSED), (4, CALLEVENT_STATUS.IN_PROCESS)])
+        # call_event 1 & 4 were claimed by a dead worker, their created_date is recent
+        cursor.execute("UPDATE call_event SET claimed_date=NOW() - interval '%d seconds' WHERE id IN (1, 3, 4)" %
+                       (settings.CALLEVENT_REQUEUE_DELAY + 60))
+        cursor.execute("UPDATE call_event SET claimed_date=NOW() WHERE id=2")
+        # call_event 4 was already requeued too many times
+        cursor.execute("UPDATE call_event SET requeue_count=%d WHERE id=4" % settings.CALLEVENT_MAX_REQUEUE)
+
+        requeue_callevent()
+        cursor.execute("SELECT id, status FROM call_event ORDER BY id")
+        self.assertEqual(cursor.fetchall(), [
+            (1, CALLEVENT_STATUS.PENDING), (2, CALLEVENT_STATUS.IN_PROCESS), (3, CALLEVENT_STATUS.PROCESSED),
+            (4, CALLEVENT_STATUS.FAILED)])
+
+        # The requeued call_event are claimed again
+        self.assertEqual([record[0] for record in claim_callevent(10)], [1])
+
+    def test_buffer_voipcall_bad_row(self):
+        """Test that only the bad CDR is dropped once the retries of the flush are exhausted"""
+        buffer_voipcall = BufferVoIPCall(max_size=10, max_retry=0)
+        buffer_voipcall.save(self.callrequest, self.callrequest.request_uuid, call_event_id=1)
+        buffer_voipcall.save(self.callrequest, self.callrequest.request_uuid, call_event_id=2)
+        # The CDR of call_event 1 violates the NOT NULL constraint
+        buffer_voipcall.list_voipcall[0].user_id = None
+        cursor = self.create_call_event([(1, CALLEVENT_STATUS.IN_PROCESS), (2, CALLEVENT_STATUS.IN_PROCESS)])
+        count_voipcall = VoIPCall.objects.count()
+
+        self.assertEqual(buffer_voipcall.flush(), 1)
+        self.assertEqual(VoIPCall.objects.count(), count_voipcall + 1)
+        self.assertEqual(buffer_voipcall.list_voipcall, [])
+        cursor.execute("SELECT id, status FROM call_event ORDER BY id")
+        self.assertEqual(cursor.fetchall(), [(1, CALLEVENT_STATUS.FAILED), (2, CALLEVENT_STATUS.PROCESSED)])
+
+    def test_update_callrequest_batch(self):
+        """Test that ``update_callrequest_originate`` updates the originated
+        callrequests and ``update_callrequest_batch`` their subscribers"""
+        Callrequest.objects.filter(pk=self.callrequest.id).update(status=CALLREQUEST_STATUS.PENDING)
+        subscriber = Subscriber.objects.get(pk=1)
+        count_attempt = subscriber.count_attempt or 0
+        self.assertEqual(update_callrequest_originate(self.callrequest.id, 'error'), 1)
+        update_callrequest_batch([subscriber.id], [subscriber.id])
+        callrequest = Callrequest.objects.get(pk=self.callrequest.id)
+        self.assertEqual(callrequest.status, CALLREQUEST_STATUS.FAILURE)
+        self.assertEqual(callrequest.request_uuid, 'error')
+        subscriber = Subscriber.objects.get(pk=1)
+        self.assertEqual(subscriber.count_attempt, count_attempt + 1)
+        self.assertEqual(subscriber.status, SUBSCRIBER_STATUS.FAIL)
+
+        Callrequest.objects.filter(pk=self.callrequest.id).update(status=CALLREQUEST_STATUS.PENDING)
+        job_uuid = str(uuid1())
+        update_callrequest_originate(self.callrequest.id, job_uuid)
+        callrequest = Callrequest.objects.get(pk=self.callrequest.id)
+        self.assertEqual(callrequest.status, CALLREQUEST_STATUS.CALLING)
+        self.assertEqual(callrequest.request_uuid, job_uuid)
+
+        # The hangup was processed before the end of the originate
+        Callrequest.objects.filter(pk=self.callrequest.id).update(status=CALLREQUEST_STATUS.SUCCESS)
+        self.assertEqual(update_callrequest_originate(self.callrequest.id, str(uuid1())), 0)
+        self.assertEqual(Callrequest.objects.get(pk=self.callrequest.id).status, CALLREQUEST_STATUS.SUCCESS)
+
 
 class DialerCdrModel(TestCase):
 
@@ -212,6 +443,202 @@ class DialerCdrModel(TestCase):
         self.voipcall.duration = 12
         self.voipcall.min_duration()
 
+    def test_bulk_create_returning(self):
+        list_callrequest = [
+            Callrequest(call_type=1, status=1, user=self.user, phone_number='12345%d' % i,
+                        subscriber_id=1, campaign_id=1, aleg_gateway_id=1,
+                        content_type_id=self.callrequest.content_type_id, object_id=1)
+            for i in range(3)]
+        Callrequest.objects.bulk_create_returning(list_callrequest, batch_size=2)
+        self.assertEqual(len(set(cr.request_uuid for cr in list_callrequest)), 3)
+        for cr in list_callrequest:
+            self.assertEqual(Callrequest.objects.get(pk=cr.id).phone_number, cr.phone_number)
+
+    def test_voipcall_rollup_delete(self):
+        """The CDRs deleted are removed from the rollups"""
+        VoIPCallRollup.objects.add_voipcall([self.voipcall])
+        bucket = truncate_date(self.voipcall.starting_date, ROLLUP_PERIOD.MINUTE)
+        self.voipcall.delete()
+        rollup = VoIPCallRollup.objects.get(
+            user=self.user, campaign_id=1, disposition='', leg_type=1, period=ROLLUP_PERIOD.MINUTE, bucket=bucket)
+        self.assertEqual((rollup.call_count, rollup.duration_sum), (0, 0))
+
+    def test_voipcall_rollup(self):
+        """The rollups are updated when the CDRs are saved and can be rebuilt"""
+        user_voipcall = VoIPCall.objects.filter(user=self.user)
+        kwargs = {'user': self.user, 'callrequest__campaign_id': 1}
+        VoIPCallRollup.objects.add_voipcall([self.voipcall])
+        rollup = VoIPCallRollup.objects.get(
+            user=self.user, campaign_id=1, disposition='', leg_type=1, period=ROLLUP_PERIOD.MINUTE,
+            bucket=truncate_date(self.voipcall.starting_date, ROLLUP_PERIOD.MINUTE))
+        self.assertEqual((rollup.call_count, rollup.duration_sum), (1, 20))
+
+        # The rollups of the day are rebuilt from the CDRs
+        tday = datetime.utcnow().replace(tzinfo=utc)
+        call_command("rollup_cdr", from_date=tday.strftime('%Y-%m-%d'))
+        total_calls = sum([data['starting_date__count'] for data in VoIPCallRollup.objects.daily_data(kwargs)])
+        self.assertEqual(total_calls, user_voipcall.filter(callrequest__campaign_id=1,
+                                                           starting_date__gte=truncate_date(tday, ROLLUP_PERIOD.DAY))
+                         .count())
+        for period in (ROLLUP_PERIOD.MINUTE, ROLLUP_PERIOD.HOUR):
+            self.assertEqual(
+                sum(VoIPCallRollup.objects.filter(period=period).values_list('call_count', flat=True)),
+                sum(VoIPCallRollup.objects.filter(period=ROLLUP_PERIOD.DAY).values_list('call_count', flat=True)))
+
+        self.assertEqual(rollup_filter({'starting_date__gte': tday, 'disposition__exact': 'ANSWER'},
+                                       ROLLUP_PERIOD.HOUR),
+                         {'bucket__gte': truncate_date(tday, ROLLUP_PERIOD.HOUR), 'disposition__exact': 'ANSWER'})
+        self.assertRaises(ValueError, rollup_filter, {'phone_number': '123456'}, ROLLUP_PERIOD.DAY)
+
     def teardown(self):
         self.callrequest.delete()
         self.voipcall.delete()
+
+
+class FakeESLConnection(object):
+
+    """Fake ESL connection, the connection fails with a wrong secret"""
+
+    def __init__(self, hostname, port, secret):
+        self.is_connected = (secret == 'ClueCon')
+
+    def connected(self):
+        return self.is_connected
+
+    def disconnect(self):
+        self.is_connected = False
+
+
+class FakeESLHandler(SocketServer.StreamRequestHandler):
+
+    """Minimal FreeSWITCH event socket answering auth and api commands"""
+
+    def read_command(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            if not line.strip():
+                return ' '.join(lines)
+            lines.append(line.strip())
+
+    def handle(self):
+        self.wfile.write("Content-Type: auth/request\n\n")
+        while True:
+            command = self.read_command()
+            if command is None:
+                return
+            if command.startswith('auth'):
+                self.wfile.write("Content-Type: command/reply\nReply-Text: +OK accepted\n\n")
+            elif command.startswith('api'):
+                body = "+OK Job-UUID: %s\n" % str(uuid1())
+                self.wfile.write("Content-Type: api/response\nContent-Length: %d\n\n%s" % (len(body), body))
+            else:
+                self.wfile.write("Content-Type: command/reply\nReply-Text: -ERR command not found\n\n")
+
+
+class ESLConnectionPoolTestCase(TestCase):
+
+    """Test the ESL connection pool"""
+
+    def test_pool(self):
+        pool = ESLConnectionPool('127.0.0.1', 8021, 'ClueCon', size=1,
+                                 connection_factory=FakeESLConnection)
+        conn = pool.borrow()
+        self.assertRaises(ESLPoolError, pool.borrow)
+        pool.release(conn)
+        # The connection is reused
+        self.assertEqual(pool.borrow(), conn)
+        pool.release(conn)
+
+        # A broken connection is replaced
+        conn.disconnect()
+        new_conn = pool.borrow()
+        self.assertNotEqual(new_conn, conn)
+        self.assertTrue(new_conn.connected())
+        pool.release(new_conn)
+
+    def test_pool_backoff(self):
+        pool = ESLConnectionPool('127.0.0.1', 8021, 'wrong', size=1,
+                                 connection_factory=FakeESLConnection, retry_delay=60)
+        self.assertRaises(ESLPoolError, pool.borrow)
+        self.assertFalse(pool.is_healthy())
+        # No new attempt until the backoff delay is reached
+        pool.secret = 'ClueCon'
+        self.assertRaises(ESLPoolError, pool.borrow)
+
+    @unittest.skipUnless(ESL, 'ESL not installed')
+    def test_pool_fake_server(self):
+        server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), FakeESLHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        pool = ESLConnectionPool('127.0.0.1', server.server_address[1], 'ClueCon', size=1)
+        for i in range(3):
+            with pool.connection() as conn:
+                ev = conn.api("bgapi", "originate user/1000 &park()")
+                self.assertTrue('Job-UUID:' in ev.serialize())
+        self.assertEqual(pool.count, 1)
+        pool.close()
+        server.shutdown()
+
+
+class DialerNodeTestCase(TestCase):
+
+    """Test the selection of the FreeSWITCH node"""
+
+    def test_select_dialer_node(self):
+        list_node = [
+            {'name': 'test-fs1', 'weight': 2, 'max_channels': 0},
+            {'name': 'test-fs2', 'weight': 1, 'max_channels': 1},
+        ]
+        node = reserve_dialer_node(list_node)
+        self.assertEqual(node['name'], 'test-fs1')
+        acquire_dialer_node(node, 1001)
+        # 1 call on fs1 with weight 2 is less loaded than 1 call on fs2
+        self.assertEqual(select_dialer_node(list_node)['name'], 'test-fs2')
+        node = reserve_dialer_node(list_node)
+        self.assertEqual(node['name'], 'test-fs2')
+        acquire_dialer_node(node, 1002)
+        # fs2 reached max_channels
+        self.assertEqual(reserve_dialer_node(list_node)['name'], 'test-fs1')
+        cancel_dialer_node(list_node[0])
+
+        set_node_down(list_node[0])
+        self.assertEqual(select_dialer_node(list_node), None)
+
+        release_dialer_node([1001, 1002])
+        self.assertEqual(select_dialer_node(list_node)['name'], 'test-fs2')
+
+    def test_reserve_dialer_node(self):
+        """Test that the workers can't reserve more than max_channels on a node"""
+        list_node = [
+            {'name': 'test-fs3', 'weight': 1, 'max_channels': 1},
+            {'name': 'test-fs4', 'weight': 1, 'max_channels': 1},
+        ]
+        # Two workers selected fs3, only one of them gets its last channel
+        self.assertEqual(select_dialer_node(list_node)['name'], 'test-fs3')
+        self.assertTrue(reserve_node_channel(list_node[0]))
+        self.assertFalse(reserve_node_channel(list_node[0]))
+
+        self.assertEqual(reserve_dialer_node(list_node)['name'], 'test-fs4')
+        self.assertEqual(reserve_dialer_node(list_node), None)
+
+        cancel_dialer_node(list_node[0])
+        cancel_dialer_node(list_node[1])
+        self.assertEqual(reserve_dialer_node(list_node)['name'], 'test-fs3')
+        cancel_dialer_node(list_node[0])
+
+    def test_reconcile_node_channels(self):
+        """Test that the channels of the lost hangups are recovered"""
+        list_node = [{'name': 'test-fs5', 'weight': 1, 'max_channels': 1}]
+        # The hangup of the call was never processed
+        self.assertEqual(reserve_dialer_node(list_node)['name'], 'test-fs5')
+        self.assertEqual(reserve_dialer_node(list_node), None)
+
+        self.assertEqual(reconcile_node_channels(list_node), {'test-fs5': 0})
+        self.assertEqual(reserve_dialer_node(list_node)['name'], 'test-fs5')
+        cancel_dialer_node(list_node[0])
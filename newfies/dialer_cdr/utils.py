@@ -12,116 +12,80 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
-from dialer_cdr.models import VoIPCall
-from dialer_cdr.constants import VOIPCALL_AMD_STATUS, LEG_TYPE
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from dialer_cdr.models import VoIPCall, VoIPCallRollup
+from dialer_cdr.constants import VOIPCALL_AMD_STATUS, LEG_TYPE, CALLEVENT_STATUS
 from celery.utils.log import get_task_logger
+from celery.signals import worker_process_shutdown
+import threading
 # from dialer_cdr.function_def import get_prefix_obj
 
 logger = get_task_logger(__name__)
 
 
-class BufferVoIPCall:
+def parse_callevent(record):
+    """
+    Convert a row of the call_event table into a dictionary
 
+    The row is expected to follow the column order used by callevent_processing
     """
-    BufferVoIPCall stores VoIPCall (CDR) into a buffer and allow
-    to save CDRs per bulk.
-    - save : store the CDRs in memory
-    - commit : trigger the bulk_create method to save the CDRs
+    event = {
+        'call_event_id': record[0],
+        'event_name': record[1],
+        'body': record[2],
+        'job_uuid': record[3],
+        'call_uuid': record[4],
+        'used_gateway_id': record[5],
+        'callrequest_id': record[6],
+        'alarm_request_id': record[7],
+        'callerid': record[8],
+        'phonenumber': record[9],
+        'duration': record[10],
+        'billsec': record[11],
+        'hangup_cause': record[12],
+        'hangup_cause_q850': record[13],
+        'starting_date': record[14],
+        'amd_status': record[17],
+        'leg': record[18],
+    }
+    if event['event_name'] == 'BACKGROUND_JOB' or event['hangup_cause'] == '':
+        # hangup cause come from body
+        event['hangup_cause'] = event['body'][5:]
+    event['request_uuid'] = event['job_uuid']
+    return event
+
+
+def get_disposition(hangup_cause):
     """
+    Return the call disposition of a hangup cause
 
-    def __init__(self):
-        self.list_voipcall = []
+    >>> get_disposition('NORMAL_CLEARING')
+    'ANSWER'
 
-    def save(self, obj_callrequest, request_uuid, leg='aleg', hangup_cause='',
-             hangup_cause_q850='', callerid='',
-             phonenumber='', starting_date='',
-             call_uuid='', duration=0, billsec=0, amd_status='person'):
-        """
-        Save voip call into buffer
-        """
-        if leg == 'aleg':
-            # A-Leg
-            leg_type = LEG_TYPE.A_LEG
-            used_gateway = obj_callrequest.aleg_gateway
-        else:
-            # B-Leg
-            leg_type = LEG_TYPE.B_LEG
-            used_gateway = obj_callrequest.aleg_gateway
-            # This code is useful if we want to let the survey editor select the gateway
-            # if obj_callrequest.content_object.__class__.__name__ == 'Survey':
-            #     #Get the gateway from the App
-            #     used_gateway = obj_callrequest.content_object.gateway
-            # else:
-            #     #Survey
-            #     used_gateway = obj_callrequest.aleg_gateway
-        if amd_status == 'machine':
-            amd_status_id = VOIPCALL_AMD_STATUS.MACHINE
-        else:
-            amd_status_id = VOIPCALL_AMD_STATUS.PERSON
-
-        logger.debug('Create CDR - request_uuid=%s;leg=%d;hangup_cause=%s;billsec=%s;amd_status=%s' %
-                     (request_uuid, leg_type, hangup_cause, str(billsec), amd_status))
-
-        # Get the first word only
-        hangup_cause = hangup_cause.split()[0]
-
-        if hangup_cause == 'NORMAL_CLEARING' or hangup_cause == 'ALLOTTED_TIMEOUT':
-            hangup_cause = 'ANSWER'
-
-        if hangup_cause == 'ANSWER':
-            disposition = 'ANSWER'
-        elif hangup_cause == 'USER_BUSY':
-            disposition = 'BUSY'
-        elif hangup_cause == 'NO_ANSWER':
-            disposition = 'NOANSWER'
-        elif hangup_cause == 'ORIGINATOR_CANCEL':
-            disposition = 'CANCEL'
-        elif hangup_cause == 'NORMAL_CIRCUIT_CONGESTION':
-            disposition = 'CONGESTION'
-        else:
-            disposition = 'FAILED'
-
-        # Note: Removed for test performance
-        # Note: Look at prefix PG module : https://github.com/dimitri/prefix
-        #prefix_obj = get_prefix_obj(phonenumber)
-
-        # Save this for bulk saving
-        self.list_voipcall.append(
-            VoIPCall(
-                user_id=obj_callrequest.user_id,
-                request_uuid=request_uuid,
-                leg_type=leg_type,
-                used_gateway=used_gateway,
-                callrequest_id=obj_callrequest.id,
-                callid=call_uuid,
-                callerid=callerid,
-                phone_number=phonenumber,
-                # dialcode=prefix_obj,
-                starting_date=starting_date,
-                duration=duration,
-                billsec=billsec,
-                disposition=disposition,
-                hangup_cause=hangup_cause,
-                hangup_cause_q850=hangup_cause_q850,
-                amd_status=amd_status_id)
-        )
-
-    def commit(self):
-        """
-        function to create CDR / VoIP Call
-        """
-        VoIPCall.objects.bulk_create(self.list_voipcall)
+    >>> get_disposition('USER_BUSY')
+    'BUSY'
+    """
+    if hangup_cause == 'NORMAL_CLEARING' or hangup_cause == 'ALLOTTED_TIMEOUT':
+        return 'ANSWER'
+    elif hangup_cause == 'USER_BUSY':
+        return 'BUSY'
+    elif hangup_cause == 'NO_ANSWER':
+        return 'NOANSWER'
+    elif hangup_cause == 'ORIGINATOR_CANCEL':
+        return 'CANCEL'
+    elif hangup_cause == 'NORMAL_CIRCUIT_CONGESTION':
+        return 'CONGESTION'
+    return 'FAILED'
 
 
-def voipcall_save(callrequest, request_uuid, leg='aleg', hangup_cause='',
-                  hangup_cause_q850='', callerid='', phonenumber='', starting_date='',
-                  call_uuid='', duration=0, billsec=0, amd_status='person'):
+def build_voipcall(callrequest, request_uuid, leg='aleg', hangup_cause='',
+                   hangup_cause_q850='', callerid='', phonenumber='', starting_date='',
+                   call_uuid='', duration=0, billsec=0, amd_status='person'):
     """
-    This task will save the voipcall(CDR) to the DB,
+    Build the VoIPCall (CDR) of a callrequest leg without saving it,
     it will also reformat the disposition
     """
-    # TODO: following code is duplicated, see above
-
     used_gateway = callrequest.aleg_gateway
     # Set Leg Type
     if leg == 'aleg':
@@ -139,26 +103,13 @@ def voipcall_save(callrequest, request_uuid, leg='aleg', hangup_cause='',
 
     # Get the first word only
     hangup_cause = hangup_cause.split()[0]
-
-    if hangup_cause == 'NORMAL_CLEARING' or hangup_cause == 'ALLOTTED_TIMEOUT':
-        disposition = 'ANSWER'
-    elif hangup_cause == 'USER_BUSY':
-        disposition = 'BUSY'
-    elif hangup_cause == 'NO_ANSWER':
-        disposition = 'NOANSWER'
-    elif hangup_cause == 'ORIGINATOR_CANCEL':
-        disposition = 'CANCEL'
-    elif hangup_cause == 'NORMAL_CIRCUIT_CONGESTION':
-        disposition = 'CONGESTION'
-    else:
-        disposition = 'FAILED'
+    disposition = get_disposition(hangup_cause)
 
     # Note: Removed for test performance
     # Note: Look at prefix PG module : https://github.com/dimitri/prefix
     #prefix_obj = get_prefix_obj(phonenumber)
 
-    # Save the VoIPCall
-    new_voipcall = VoIPCall(
+    return VoIPCall(
         user_id=callrequest.user_id,
         request_uuid=request_uuid,
         leg_type=leg_type,
@@ -175,4 +126,182 @@ def voipcall_save(callrequest, request_uuid, leg='aleg', hangup_cause='',
         hangup_cause=hangup_cause,
         hangup_cause_q850=hangup_cause_q850,
         amd_status=amd_status_id)
+
+
+def set_callevent_status(list_call_event_id, status):
+    """Flag the call_event with a status, call_event is created by listener.lua"""
+    list_call_event_id = [str(int(i)) for i in list_call_event_id if i]
+    if not list_call_event_id:
+        return
+    cursor = connection.cursor()
+    cursor.execute("UPDATE call_event SET status=%d WHERE id IN (%s)" % (status, ','.join(list_call_event_id)))
+
+
+class BufferVoIPCall:
+
+    """
+    BufferVoIPCall stores VoIPCall (CDR) into a buffer and allow
+    to save CDRs per bulk.
+    - save : store the CDRs in memory
+    - flush : trigger the bulk_create method to save the CDRs
+
+    The buffer is flushed when it reaches ``max_size`` rows or when the
+    oldest row has been waiting for ``max_delay`` milliseconds.
+
+    The call_event rows attached to the CDRs are marked as processed and the
+    CDR rollups are updated in the same transaction as the bulk_create, so a
+    call_event is only flagged once its CDR is durably stored and counted.
+
+    When the flush fails the CDRs are kept in the buffer and saved by the
+    next flush, after ``max_retry`` failed flushes they are saved one by
+    one, only the CDRs which still fail are dropped and their call_event
+    flagged failed.
+    """
+
+    def __init__(self, max_size=1, max_delay=0, max_retry=0):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_retry = max_retry
+        self.list_voipcall = []
+        self.list_call_event_id = []
+        self.lock = threading.RLock()
+        self.timer = None
+        self.failed_flush = 0
+
+    def save(self, obj_callrequest, request_uuid, leg='aleg', hangup_cause='',
+             hangup_cause_q850='', callerid='',
+             phonenumber='', starting_date='',
+             call_uuid='', duration=0, billsec=0, amd_status='person',
+             call_event_id=None):
+        """
+        Save voip call into buffer
+        """
+        voipcall = build_voipcall(
+            obj_callrequest, request_uuid, leg=leg, hangup_cause=hangup_cause,
+            hangup_cause_q850=hangup_cause_q850, callerid=callerid,
+            phonenumber=phonenumber, starting_date=starting_date,
+            call_uuid=call_uuid, duration=duration, billsec=billsec,
+            amd_status=amd_status)
+        with self.lock:
+            self.list_voipcall.append(voipcall)
+            # Kept aligned with list_voipcall to save the CDRs one by one
+            self.list_call_event_id.append(call_event_id)
+
+            if len(self.list_voipcall) >= self.max_size:
+                self.flush()
+            else:
+                self.start_timer()
+
+    def start_timer(self):
+        """Start the timer of the flush unless it's already running"""
+        with self.lock:
+            if not self.timer and self.max_delay > 0:
+                self.timer = threading.Timer(self.max_delay / 1000.0, self.flush_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """
+        function to create CDR / VoIP Call and mark their call_event as processed
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            list_voipcall = self.list_voipcall
+            list_call_event_id = self.list_call_event_id
+            self.list_voipcall = []
+            self.list_call_event_id = []
+            if not list_voipcall:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    VoIPCall.objects.bulk_create(list_voipcall)
+                    VoIPCallRollup.objects.add_voipcall(list_voipcall)
+                    set_callevent_status(list_call_event_id, CALLEVENT_STATUS.PROCESSED)
+            except DatabaseError:
+                self.failed_flush += 1
+                # Don't reuse a broken connection on the next flush
+                if not connection.in_atomic_block:
+                    connection.close_if_unusable_or_obsolete()
+                if self.failed_flush > self.max_retry:
+                    logger.error("Error flushing %d CDRs after %d attempts, saving them one by one" %
+                                 (len(list_voipcall), self.failed_flush))
+                    self.failed_flush = 0
+                    return self.flush_per_row(list_voipcall, list_call_event_id)
+                # Keep the CDRs in front of the buffer for the next flush
+                logger.error("Error flushing %d CDRs, attempt %d" % (len(list_voipcall), self.failed_flush))
+                self.list_voipcall = list_voipcall + self.list_voipcall
+                self.list_call_event_id = list_call_event_id + self.list_call_event_id
+                self.start_timer()
+                return 0
+            self.failed_flush = 0
+        logger.debug("Flushed CDRs : %d" % len(list_voipcall))
+        return len(list_voipcall)
+
+    # Keep the previous name of the method
+    commit = flush
+
+    def flush_per_row(self, list_voipcall, list_call_event_id):
+        """
+        Save the CDRs one by one so a bad row doesn't drop the whole buffer,
+        the CDRs which fail are dropped and their call_event flagged failed
+        """
+        count = 0
+        failed_call_event_ids = []
+        for (voipcall, call_event_id) in zip(list_voipcall, list_call_event_id):
+            try:
+                with transaction.atomic():
+                    VoIPCall.objects.bulk_create([voipcall])
+                    VoIPCallRollup.objects.add_voipcall([voipcall])
+                    set_callevent_status([call_event_id], CALLEVENT_STATUS.PROCESSED)
+                count += 1
+            except DatabaseError as e:
+                logger.error("Error saving CDR of call_event %s, dropped : %s" % (call_event_id, str(e)))
+                failed_call_event_ids.append(call_event_id)
+        try:
+            set_callevent_status(failed_call_event_ids, CALLEVENT_STATUS.FAILED)
+        except DatabaseError:
+            # The call_event stay in process and will be requeued
+            logger.error("Error flagging %d call_event failed" % len(failed_call_event_ids))
+        return count
+
+    def flush_timer(self):
+        """
+        Flush triggered by the timer, the timer thread has its own
+        DB connection which is closed once the flush is done
+        """
+        with self.lock:
+            self.timer = None
+        self.flush()
+        connection.close()
+
+
+# Write-behind buffer used by the workers to save the CDRs
+cdr_buffer = BufferVoIPCall(max_size=settings.CDR_BUFFER_SIZE, max_delay=settings.CDR_BUFFER_DELAY,
+                            max_retry=settings.CDR_BUFFER_MAX_RETRY)
+
+
+def flush_cdr_buffer(**kwargs):
+    """Flush the CDR buffer when the worker process shutdown"""
+    cdr_buffer.flush()
+
+worker_process_shutdown.connect(flush_cdr_buffer)
+
+
+def voipcall_save(callrequest, request_uuid, leg='aleg', hangup_cause='',
+                  hangup_cause_q850='', callerid='', phonenumber='', starting_date='',
+                  call_uuid='', duration=0, billsec=0, amd_status='person'):
+    """
+    This task will save the voipcall(CDR) to the DB,
+    it will also reformat the disposition
+    """
+    new_voipcall = build_voipcall(
+        callrequest, request_uuid, leg=leg, hangup_cause=hangup_cause,
+        hangup_cause_q850=hangup_cause_q850, callerid=callerid,
+        phonenumber=phonenumber, starting_date=starting_date,
+        call_uuid=call_uuid, duration=duration, billsec=billsec,
+        amd_status=amd_status)
     new_voipcall.save()
+    VoIPCallRollup.objects.add_voipcall([new_voipcall])
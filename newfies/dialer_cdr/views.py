@@ -16,29 +16,32 @@ from django.contrib.auth.decorators import login_required, permission_required
 from django.http import HttpResponse
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
-from django.db.models import Sum, Avg, Count
-from django.conf import settings
-from dialer_cdr.models import VoIPCall
+from dialer_cdr.models import VoIPCall, VoIPCallRollup
 from dialer_cdr.constants import CDR_REPORT_COLUMN_NAME
 from dialer_cdr.forms import VoipSearchForm
+from dialer_cdr.exporter import VoIPCallExporter
 from django_lets_go.common_functions import ceil_strdate, unset_session_var, getvar, get_pagination_vars
-from mod_utils.helper import Export_choice
-# from dialer_cdr.constants import Export_choice
+from mod_utils.exporter import export_response
+from mod_utils.report import ReportJob, PageList
 from datetime import datetime
 from django.utils.timezone import utc
-import tablib
 
 
-def get_voipcall_daily_data(voipcall_list):
-    """Get voipcall daily data"""
-    select_data = {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
+# Daily data displayed while the report is computed
+EMPTY_DAILY_DATA = {
+    'total_data': [],
+    'total_duration': 0,
+    'total_calls': 0,
+    'total_avg_duration': 0,
+    'max_duration': 0,
+    'call_count': 0,
+}
 
-    # Get Total Rrecords from VoIPCall Report table for Daily Call Report
-    total_data = voipcall_list.extra(select=select_data).values('starting_date')\
-        .annotate(Count('starting_date'))\
-        .annotate(Sum('duration'))\
-        .annotate(Avg('duration'))\
-        .order_by('-starting_date')
+
+def get_voipcall_daily_data(kwargs):
+    """Get voipcall daily data of the VoIPCall filter from the CDR rollups"""
+    # Get Total Records from the daily CDR rollups for Daily Call Report
+    total_data = VoIPCallRollup.objects.daily_data(kwargs)
 
     # Following code will count total voip calls, duration
     if total_data:
@@ -62,6 +65,13 @@ def get_voipcall_daily_data(voipcall_list):
     return data
 
 
+def voipcall_report_data(kwargs):
+    """Daily data and number of calls of the VoIP call report, computed by a ReportJob"""
+    data = get_voipcall_daily_data(kwargs)
+    data['call_count'] = VoIPCall.objects.filter(**kwargs).count()
+    return data
+
+
 @permission_required('dialer_cdr.view_call_detail_report', login_url='/')
 @login_required
 def voipcall_report(request):
@@ -76,6 +86,9 @@ def voipcall_report(request):
 
         * Get VoIP call list according to search parameters for loggedin user
 
+        * The daily data and the number of calls are computed in the
+          background by a ReportJob, shared by the pages of the report
+
     **Important variable**:
 
         * ``request.session['voipcall_record_kwargs']`` - stores voipcall kwargs
@@ -167,19 +180,17 @@ def voipcall_report(request):
         kwargs['user_id'] = request.user.id
 
     voipcall_list = VoIPCall.objects.filter(**kwargs)
-    all_voipcall_list = voipcall_list.values_list('id', flat=True)
 
     # Session variable is used to get record set with searched option
     # into export file
     request.session['voipcall_record_kwargs'] = kwargs
 
-    if request.GET.get('page') or request.GET.get('sort_by'):
-        daily_data = request.session['voipcall_daily_data']
+    report_job = ReportJob.start('dialer_cdr.views.voipcall_report_data', request.user.id, kwargs)
+    if report_job.is_done():
+        daily_data = report_job.data
     else:
-        if not voipcall_list:
-            request.session['voipcall_daily_data'] = ''
-        daily_data = get_voipcall_daily_data(voipcall_list)
-        request.session['voipcall_daily_data'] = daily_data
+        daily_data = EMPTY_DAILY_DATA
+    all_voipcall_list = PageList(voipcall_list.values_list('id', flat=True), daily_data['call_count'])
 
     voipcall_list = voipcall_list.order_by(pag_vars['sort_order'])[pag_vars['start_page']:pag_vars['end_page']]
 
@@ -197,6 +208,7 @@ def voipcall_report(request):
         'start_date': start_date,
         'end_date': end_date,
         'action': action,
+        'report_job': report_job,
     }
     request.session['msg'] = ''
     request.session['error_msg'] = ''
@@ -213,55 +225,11 @@ def export_voipcall_report(request):
 
     **Exported fields**: [user, callid, callerid, phone_number, starting_date,
                           duration, disposition, used_gateway]
+
+    CSV and JSON are streamed, XLS is written in the background
     """
     format_type = request.GET['format']
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(content_type='text/%s' % format_type)
-
-    # force download.
-    response['Content-Disposition'] = 'attachment;filename=export.%s' % format_type
-
-    # super(VoIPCall_ReportAdmin, self).queryset(request)
-    if request.session.get('voipcall_record_kwargs'):
-        kwargs = request.session['voipcall_record_kwargs']
-        qs = VoIPCall.objects.select_related('user__username').filter(**kwargs)
-
-        amd_status = ''
-        if settings.AMD:
-            amd_status = 'amd_status'
-
-        headers = ('user', 'callid', 'callerid', 'phone_number', 'starting_date', 'duration', 'billsec',
-                   'disposition', 'hangup_cause', 'hangup_cause_q850', 'used_gateway', amd_status)
-
-        list_val = []
-        for i in qs:
-            gateway_used = i.used_gateway.name if i.used_gateway else ''
-            amd_status = i.amd_status if settings.AMD else ''
-
-            starting_date = i.starting_date
-            if format_type == Export_choice.JSON or format_type == Export_choice.XLS:
-                starting_date = str(i.starting_date)
-
-            list_val.append((i.user.username,
-                             i.callid,
-                             i.callerid,
-                             i.phone_number,
-                             starting_date,
-                             i.duration,
-                             i.billsec,
-                             i.disposition,
-                             i.hangup_cause,
-                             i.hangup_cause_q850,
-                             gateway_used,
-                             amd_status))
-
-        data = tablib.Dataset(*list_val, headers=headers)
-
-        if format_type == Export_choice.XLS:
-            response.write(data.xls)
-        elif format_type == Export_choice.CSV:
-            response.write(data.csv)
-        elif format_type == Export_choice.JSON:
-            response.write(data.json)
-
-    return response
+    if not request.session.get('voipcall_record_kwargs'):
+        return HttpResponse(content_type='text/%s' % format_type)
+    kwargs = request.session['voipcall_record_kwargs']
+    return export_response(request, VoIPCallExporter(request.user, kwargs), format_type)
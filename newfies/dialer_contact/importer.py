@@ -0,0 +1,81 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.utils.translation import ugettext as _
+from dialer_contact.models import Contact
+from dialer_contact.constants import CONTACT_STATUS
+from mod_utils.importer import CSVImporter
+import json
+
+LIST_CONTACT_STATUS = [status for (status, label) in list(CONTACT_STATUS)]
+
+
+class ContactImporter(CSVImporter):
+
+    """
+    Import the contacts of a phonebook, the columns of the CSV file are
+
+        col_no - field name
+         0     - contact
+         1     - last_name
+         2     - first_name
+         3     - email
+         4     - description
+         5     - status
+         6     - address
+         7     - city
+         8     - state
+         9     - country
+        10     - unit_number
+        11     - additional_vars
+    """
+    model = Contact
+    delimiter = '|'
+
+    def __init__(self, job, phonebook_id):
+        super(ContactImporter, self).__init__(job)
+        self.phonebook_id = phonebook_id
+
+    def parse_row(self, row):
+        try:
+            status = int(row[5])
+        except ValueError:
+            raise ValueError(_("invalid value for import! please check the import samples or phonebook is not valid"))
+        if status not in LIST_CONTACT_STATUS:
+            raise ValueError(_("invalid value for import! please check the import samples or phonebook is not valid"))
+
+        if len(row[9]) > 2:
+            raise ValueError(_("invalid value for country code, it needs to be a valid ISO 3166-1 alpha-2 codes"))
+
+        additional_vars = ''
+        if len(row) > 11 and row[11]:
+            try:
+                additional_vars = json.loads(row[11])
+            except ValueError:
+                additional_vars = ''
+
+        return Contact(
+            phonebook_id=self.phonebook_id,
+            contact=row[0],
+            last_name=row[1],
+            first_name=row[2],
+            email=row[3],
+            description=row[4],
+            status=status,
+            address=row[6],
+            city=row[7],
+            state=row[8],
+            country=row[9],  # Note: country needs to be a country code (CA, ES)
+            unit_number=row[10],
+            additional_vars=additional_vars)
@@ -13,11 +13,18 @@
 #
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from celery.task import Task
+from celery.decorators import task
 from celery.utils.log import get_task_logger
-from dialer_campaign.models import Campaign, Subscriber
-from user_profile.models import UserProfile
-from django_lets_go.only_one_task import only_one
+from dialer_campaign.models import Campaign, CampaignPhonebook
+from dialer_campaign.constants import CAMPAIGN_STATUS
+from dialer_campaign.scheduler import CampaignLock
+from dialer_contact.models import Contact
+from dialer_contact.importer import ContactImporter
+from mod_utils.importer import ImportJob
+import os
 
 logger = get_task_logger(__name__)
 
@@ -26,93 +33,149 @@ LOCK_EXPIRE = 60 * 10 * 1  # Lock expires in 10 minutes
 
 class collect_subscriber(Task):
 
-    @only_one(ikey="check_collect_subscriber", timeout=LOCK_EXPIRE)
-    def run(self, campaign_id):
+    def run(self, campaign_id, **kwargs):
         """
-        This task will collect all the contact and create the Subscriber
-        if the phonebook_id is no in the list of imported_phonebook IDs.
+        This task imports the new contacts of the phonebooks of the campaign
+        into its subscribers, the campaigns are collected in parallel
 
         **Attributes**:
 
             * ``campaign_id`` - Campaign ID
         """
         logger.debug("Collect subscribers for the campaign = %s" % str(campaign_id))
-
-        # Retrieve the list of active contact
-        obj_campaign = Campaign.objects.get(id=campaign_id)
-        list_phonebook = obj_campaign.phonebook.all()
-
-        for item_phonebook in list_phonebook:
-            phonebook_id = item_phonebook.id
-
-            # check if phonebook_id is missing in imported_phonebook list
-            if not str(phonebook_id) in obj_campaign.imported_phonebook.split(','):
-                # Run import
-                logger.info("ImportPhonebook %d for campaign = %d" % (phonebook_id, campaign_id))
-
-                # Add the phonebook id to the imported list
-                if obj_campaign.imported_phonebook == '':
-                    sep = ''
-                else:
-                    sep = ','
-                obj_campaign.imported_phonebook = obj_campaign.imported_phonebook + \
-                    '%s%d' % (sep, phonebook_id)
-                obj_campaign.save()
-
-                # Faster method, ask the Database to do the job
-                importcontact_custom_sql(campaign_id, phonebook_id)
-
-        # Count contact imported
-        count_contact = Subscriber.objects.filter(campaign=campaign_id).count()
-        obj_campaign.totalcontact = count_contact
-        obj_campaign.save()
-
+        lock = CampaignLock(campaign_id, 'collect')
+        if not lock.acquire():
+            logger.info("Collect subscribers for the campaign = %s already running" % str(campaign_id))
+            return False
+        try:
+            more = import_campaign_subscriber(campaign_id)
+        finally:
+            lock.release()
+        if more:
+            # Large phonebook, the next chunks are imported right away while
+            # the campaign dials the subscribers already imported
+            self.apply_async(args=[campaign_id])
         return True
 
 
-def importcontact_custom_sql(campaign_id, phonebook_id):
-    # Call PL-SQL stored procedure
-    # Subscriber.importcontact_pl_sql(campaign_id, phonebook_id)
+def import_campaign_subscriber(campaign_id, max_contact=None):
+    """
+    Import the contacts added to the phonebooks of the campaign since the
+    last import, at most max_contact contacts are read. Return True if
+    contacts are left to import.
+
+    Each campaign/phonebook pair keeps the id of the last contact imported,
+    the contacts after it are imported by chunk of SUBSCRIBER_SPOOL_CHUNK.
+    Each chunk is committed, the subscribers can be dialed while the next
+    chunks are imported. The totalcontact of the campaign is incremented
+    with the subscribers created and bounds the import to the max_subr_cpg
+    of the dialer setting.
+    """
+    if max_contact is None:
+        max_contact = settings.SUBSCRIBER_SPOOL_MAX
+
+    obj_campaign = Campaign.objects.select_related('user__userprofile__dialersetting').get(id=campaign_id)
+    try:
+        max_subr_cpg = obj_campaign.user.userprofile.dialersetting.max_subr_cpg
+    except (ObjectDoesNotExist, AttributeError):
+        logger.error("Can't find user's dialersetting")
+        return False
+    totalcontact = obj_campaign.totalcontact or 0
+
+    dict_phonebook = dict((item.phonebook_id, item) for item in
+                          CampaignPhonebook.objects.filter(campaign_id=campaign_id))
+    list_imported = [item for item in obj_campaign.imported_phonebook.split(',') if item]
+    for phonebook_id in obj_campaign.phonebook.values_list('id', flat=True):
+        if phonebook_id not in dict_phonebook:
+            logger.info("ImportPhonebook %d for campaign = %d" % (phonebook_id, campaign_id))
+            (dict_phonebook[phonebook_id], created) = CampaignPhonebook.objects.get_or_create(
+                campaign_id=campaign_id, phonebook_id=phonebook_id,
+                defaults={'total_contact': Contact.objects.filter(phonebook_id=phonebook_id).count()})
+            if str(phonebook_id) not in list_imported:
+                list_imported.append(str(phonebook_id))
+                Campaign.objects.filter(id=campaign_id).update(imported_phonebook=','.join(list_imported))
+
+        item_phonebook = dict_phonebook[phonebook_id]
+        # The contacts committed late below the mark are rescanned once per run
+        rescan = True
+        while max_contact > 0:
+            limit = min(settings.SUBSCRIBER_SPOOL_CHUNK, max_contact)
+            if max_subr_cpg > 0:
+                # max_subr_cpg = max number of subscriber per campaign
+                limit = min(limit, max_subr_cpg - totalcontact)
+                if limit <= 0:
+                    logger.info("Campaign %d reached max_subr_cpg" % campaign_id)
+                    return False
+            (count_read, count_inserted) = item_phonebook.import_chunk(limit, rescan)
+            rescan = False
+            logger.debug("Campaign %d phonebook %d: %d%% imported" %
+                         (campaign_id, phonebook_id, item_phonebook.get_progress()))
+            max_contact -= count_read
+            totalcontact += count_inserted
+            if count_read < limit:
+                break
+        else:
+            # The contacts left are imported by the next run
+            return True
+    return False
 
-    # max_subr_cpg = max number of subscriber per campaign,
-    # That is going to be checked when a contact is going to be imported
-    # to the subscriber list
 
-    # TODO: to review first... accr max_subr_cpn/max_subr_cpg
-    campaign_obj = Campaign.objects.get(pk=campaign_id)
-    max_subr_cpg = UserProfile.objects.get(user=campaign_obj.user).dialersetting.max_subr_cpg
+def phonebook_sync_key(phonebook_id):
+    return 'phonebook_sync_%d' % int(phonebook_id)
 
-    if max_subr_cpg > 0:
-        # Check how many we are going to import and how many exist for that campaign already
-        imported_subscriber_count = Subscriber.objects.filter(campaign_id=campaign_id).count()
-        allowed_import = max_subr_cpg - imported_subscriber_count
-        if allowed_import > 0:
-            # handle negative value for to_import
-            limit_import = 'LIMIT %d' % allowed_import
-        else:
-            limit_import = 'LIMIT 0'
-    else:
-        limit_import = ''
-
-    from django.db import connection
-    cursor = connection.cursor()
-    if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
-        # Data insert operation - http://stackoverflow.com/questions/12451053/django-bulk-create-with-ignore-rows-that-cause-integrityerror
-        sqlimport = \
-            "LOCK TABLE dialer_subscriber IN EXCLUSIVE MODE;" \
-            "INSERT INTO dialer_subscriber "\
-            "(contact_id, campaign_id, duplicate_contact, status, created_date, updated_date) "\
-            "SELECT id, %d, contact, 1, NOW(), NOW() FROM dialer_contact "\
-            "WHERE phonebook_id=%d AND dialer_contact.status=1 AND NOT EXISTS (" \
-            "SELECT 1 FROM dialer_subscriber WHERE "\
-            "dialer_subscriber.campaign_id=%d "\
-            "AND dialer_contact.id = dialer_subscriber.contact_id ) %s;" % \
-            (campaign_id, phonebook_id, campaign_id, limit_import)
-    else:
-        # MYSQL Support removed
-        logger.error("Database not supported (%s)" % settings.DATABASES['default']['ENGINE'])
+
+def schedule_phonebook_sync(phonebook_id):
+    """
+    Schedule the import of the new contacts of the phonebook into the
+    subscribers of its running campaigns, the contacts created until the
+    sync starts are imported by the same sync
+    """
+    if not cache.add(phonebook_sync_key(phonebook_id), 1, settings.SUBSCRIBER_SYNC_DELAY + LOCK_EXPIRE):
+        # A sync of the phonebook is already scheduled
         return False
+    sync_phonebook_subscriber.apply_async(args=[phonebook_id], countdown=settings.SUBSCRIBER_SYNC_DELAY)
+    return True
 
-    cursor.execute(sqlimport)
 
+@task(ignore_result=True)
+def sync_phonebook_subscriber(phonebook_id):
+    """
+    Import the new contacts of the phonebook into the subscribers of the
+    started campaigns using it
+
+    **Attributes**:
+
+        * ``phonebook_id`` - Phonebook ID
+    """
+    # The contacts created from now on schedule a new sync
+    cache.delete(phonebook_sync_key(phonebook_id))
+    list_campaign_id = Campaign.objects.filter(phonebook=phonebook_id, status=CAMPAIGN_STATUS.START)\
+        .values_list('id', flat=True)
+    for campaign_id in list_campaign_id:
+        logger.debug("Sync phonebook %d for campaign = %d" % (phonebook_id, campaign_id))
+        collect_subscriber.delay(campaign_id)
+
+
+@task(ignore_result=True)
+def import_contact_file(job_id, path, phonebook_id):
+    """
+    Import the CSV file of contacts spooled by the contact import view,
+    the progress is saved on the import job polled by the view
+
+    **Attributes**:
+
+        * ``job_id`` - ImportJob ID
+        * ``path`` - Path of the spooled CSV file
+        * ``phonebook_id`` - Phonebook ID
+    """
+    job = ImportJob.get(job_id)
+    if job is None:
+        logger.error("Import job %s expired, file %s not imported" % (job_id, path))
+        os.remove(path)
+        return False
+    job = ContactImporter(job, phonebook_id).run(path)
+    logger.info("Import %s: %d contact(s) imported out of %d row(s)" % (job_id, job.imported, job.row_count))
+    if job.imported:
+        # The contacts inserted in bulk don't trigger post_save
+        schedule_phonebook_sync(phonebook_id)
     return True
@@ -15,6 +15,7 @@
 from django.contrib.auth.models import User
 from django.template import Template, Context
 from django.test import TestCase
+from django.core.cache import cache
 # from django.conf import settings
 from django.core.management import call_command
 from dialer_contact.models import Phonebook, Contact
@@ -22,7 +23,11 @@ from dialer_contact.forms import Contact_fileImport, PhonebookForm, ContactForm,
 from dialer_contact.views import phonebook_add, phonebook_change, phonebook_list,\
     phonebook_del, contact_list, contact_add, contact_change, contact_del, contact_import,\
     get_contact_count
-from dialer_contact.tasks import collect_subscriber
+from dialer_contact.tasks import collect_subscriber, import_campaign_subscriber, schedule_phonebook_sync, \
+    sync_phonebook_subscriber, phonebook_sync_key, import_contact_file
+from mod_utils.importer import ImportJob, spool_upload
+from django.core.files.uploadedfile import SimpleUploadedFile
+from dialer_campaign.models import Campaign, CampaignPhonebook, Subscriber
 from django_lets_go.utils import BaseAuthenticatedClient
 from datetime import datetime
 from django.utils.timezone import utc
@@ -305,6 +310,100 @@ class DialerContactCeleryTaskTestCase(TestCase):
 
         call_command("create_contact", "3|10")
 
+    def test_import_campaign_subscriber(self):
+        """The contacts are imported once, after the high-water mark"""
+        campaign = Campaign.objects.get(pk=1)
+        phonebook = campaign.phonebook.all()[0]
+        import_campaign_subscriber(campaign.id)
+        totalcontact = Campaign.objects.get(pk=1).totalcontact
+        count_subscriber = Subscriber.objects.filter(campaign=campaign).count()
+
+        # Nothing new to import
+        import_campaign_subscriber(campaign.id)
+        self.assertEqual(Subscriber.objects.filter(campaign=campaign).count(), count_subscriber)
+
+        contact = Contact.objects.create(contact='34650784355', phonebook=phonebook)
+        import_campaign_subscriber(campaign.id)
+        self.assertTrue(Subscriber.objects.filter(campaign=campaign, contact=contact).exists())
+        self.assertTrue(Campaign.objects.get(pk=1).totalcontact >= totalcontact)
+        self.assertEqual(CampaignPhonebook.objects.get(campaign=campaign, phonebook=phonebook).last_contact_id,
+                         contact.id)
+
+    def test_import_campaign_subscriber_rescan(self):
+        """The contacts committed below the high-water mark are imported by the next chunk"""
+        campaign = Campaign.objects.get(pk=1)
+        phonebook = campaign.phonebook.all()[0]
+        contact = Contact.objects.create(contact='34650784356', phonebook=phonebook)
+        import_campaign_subscriber(campaign.id)
+        item_phonebook = CampaignPhonebook.objects.get(campaign=campaign, phonebook=phonebook)
+        self.assertEqual(item_phonebook.last_contact_id, contact.id)
+
+        # The contacts created before the rescan delay are settled
+        self.assertTrue(item_phonebook.settled_contact_id < contact.id)
+
+        # The contact wasn't committed yet when its id was passed
+        Subscriber.objects.filter(campaign=campaign, contact=contact).delete()
+        import_campaign_subscriber(campaign.id)
+        self.assertTrue(Subscriber.objects.filter(campaign=campaign, contact=contact).exists())
+
+        # Once settled, a subscriber deleted on purpose isn't created again
+        Contact.objects.filter(id=contact.id).update(created_date=datetime(2012, 1, 1, tzinfo=utc))
+        import_campaign_subscriber(campaign.id)
+        item_phonebook = CampaignPhonebook.objects.get(campaign=campaign, phonebook=phonebook)
+        self.assertEqual(item_phonebook.settled_contact_id, contact.id)
+        Subscriber.objects.filter(campaign=campaign, contact=contact).delete()
+        import_campaign_subscriber(campaign.id)
+        self.assertFalse(Subscriber.objects.filter(campaign=campaign, contact=contact).exists())
+
+    def test_schedule_phonebook_sync(self):
+        """The contacts created while a sync is scheduled share the sync"""
+        cache.set(phonebook_sync_key(1), 1)
+        self.assertFalse(schedule_phonebook_sync(1))
+        sync_phonebook_subscriber(1)
+        self.assertEqual(cache.get(phonebook_sync_key(1)), None)
+
+    def test_sync_phonebook_subscriber(self):
+        """The contact created is added to the running campaign by the sync of its phonebook"""
+        campaign = Campaign.objects.get(pk=1)
+        phonebook = campaign.phonebook.all()[0]
+        cache.delete(phonebook_sync_key(phonebook.id))
+        contact = Contact.objects.create(contact='34650784357', phonebook=phonebook)
+        self.assertTrue(Subscriber.objects.filter(campaign=campaign, contact=contact).exists())
+
+    def test_import_campaign_subscriber_chunk(self):
+        """A phonebook larger than the contacts read per run is imported by chunk"""
+        campaign = Campaign.objects.get(pk=1)
+        phonebook = campaign.phonebook.all()[0]
+        count_contact = Contact.objects.filter(phonebook=phonebook).count()
+        self.assertTrue(import_campaign_subscriber(campaign.id, max_contact=1))
+        item_phonebook = CampaignPhonebook.objects.get(campaign=campaign, phonebook=phonebook)
+        self.assertEqual(item_phonebook.count_read, 1)
+        self.assertEqual(item_phonebook.total_contact, count_contact)
+        self.assertTrue(campaign.import_progress() > 0)
+        while import_campaign_subscriber(campaign.id, max_contact=1):
+            pass
+        self.assertEqual(campaign.import_progress(), 100)
+
+    def test_import_contact_file(self):
+        """The CSV file is imported in one pass, the invalid rows are counted"""
+        count_contact = Contact.objects.filter(phonebook_id=1).count()
+        csv_file = SimpleUploadedFile(
+            'contacts.csv',
+            '650784355|Belaid|Arezqui|areski@gmail.com|test|1|Address|Barcelona|State|ES|123|{"age": "32"}\n'
+            '650723032|Fourth|John|john@gmail.com|test|0|Address|Barcelona|State|ES|123|\n'
+            '650723033|Fourth|John|john@gmail.com|test|x|Address|Barcelona|State|ES|123|\n'
+            '650723034|Fourth|John|john@gmail.com|test|1|Address|Barcelona|State|Spain|123|\n')
+        job = ImportJob.create(1)
+        import_contact_file.delay(job.job_id, spool_upload(csv_file), 1)
+        job = ImportJob.get(job.job_id)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.row_count, 4)
+        self.assertEqual(job.imported, 2)
+        self.assertEqual(job.error_count, 2)
+        self.assertEqual(Contact.objects.filter(phonebook_id=1).count(), count_contact + 2)
+        contact = Contact.objects.get(phonebook_id=1, contact='650784355')
+        self.assertEqual(contact.additional_vars, {'age': '32'})
+
 
 class DialerContactModel(TestCase):
 
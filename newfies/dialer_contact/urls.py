@@ -26,6 +26,7 @@ urlpatterns = patterns('dialer_contact.views',
                        (r'^contact/$', 'contact_list'),
                        (r'^contact/add/$', 'contact_add'),
                        (r'^contact_import/$', 'contact_import'),
+                       (r'^contact_import/status/(.+)/$', 'contact_import_status'),
                        (r'^contact/del/(.+)/$', 'contact_del'),
                        (r'^contact/(.+)/$', 'contact_change'),
                        )
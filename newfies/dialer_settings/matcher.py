@@ -0,0 +1,131 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+import logging
+import re
+
+logger = logging.getLogger('newfies.filelog')
+
+# Alternatives made of digits only, eg. "^(34|33)" or "^34|^33"
+PREFIX_GROUP_RE = re.compile(r'^\^\((?:\?:)?([0-9]+(?:\|[0-9]+)*)\)$')
+PREFIX_ALTERNATIVE_RE = re.compile(r'^\^[0-9]+$')
+
+
+def parse_prefix_list(pattern):
+    """
+    Return the list of prefixes if the pattern only matches phone numbers
+    starting with a list of prefixes, None otherwise
+    """
+    match = PREFIX_GROUP_RE.match(pattern)
+    if match:
+        return match.group(1).split('|')
+    list_alternative = pattern.split('|')
+    if all(PREFIX_ALTERNATIVE_RE.match(alternative) for alternative in list_alternative):
+        return [alternative[1:] for alternative in list_alternative]
+    return None
+
+
+class PrefixTrie(object):
+
+    """Trie of prefixes, search matches the phone numbers starting with a prefix"""
+
+    def __init__(self, list_prefix):
+        self.root = {}
+        for prefix in list_prefix:
+            node = self.root
+            for digit in prefix:
+                node = node.setdefault(digit, {})
+            node[None] = True
+
+    def search(self, str_contact):
+        node = self.root
+        if None in node:
+            return True
+        for digit in str_contact:
+            node = node.get(digit)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+def compile_list(pattern, name):
+    """
+    Return the search function of a whitelist or a blacklist, None if the
+    list is empty or invalid. The list is a regular expression searched in
+    the phone number, a list of prefixes is matched with a trie.
+    """
+    if not pattern or pattern == '*':
+        return None
+    list_prefix = parse_prefix_list(pattern)
+    if list_prefix is not None:
+        return PrefixTrie(list_prefix).search
+    try:
+        return re.compile(pattern).search
+    except re.error:
+        logger.error('Error to identify the %s' % name)
+        return None
+
+
+class ContactAuthorization(object):
+
+    """
+    Check if phone numbers are authorized by the whitelist and the blacklist
+    of a dialer setting: a number matching the whitelist is authorized,
+    else a number matching the blacklist is not authorized
+
+    **Usage**:
+
+        authorization = ContactAuthorization(whitelist, blacklist)
+        authorization.authorize_batch(['34650123456', '33123456789'])
+    """
+
+    def __init__(self, whitelist, blacklist):
+        self.whitelist = compile_list(whitelist, 'whitelist')
+        self.blacklist = compile_list(blacklist, 'blacklist')
+
+    def is_authorized(self, str_contact):
+        if self.whitelist and self.whitelist(str_contact):
+            return True
+        if self.blacklist and self.blacklist(str_contact):
+            return False
+        return True
+
+    def authorize_batch(self, list_contact):
+        """Return the list of the authorizations of the phone numbers"""
+        if not self.blacklist:
+            return [True] * len(list_contact)
+        is_authorized = self.is_authorized
+        return [is_authorized(str_contact) for str_contact in list_contact]
+
+
+# Matchers are cached per worker process, by dialer setting
+_authorization_cache = {}
+
+
+def get_contact_authorization(dialersetting):
+    """
+    Return the ContactAuthorization of a dialer setting, it is built once
+    per version (updated_date) of the dialer setting
+    """
+    version = (dialersetting.whitelist, dialersetting.blacklist)
+    if dialersetting.id:
+        version = dialersetting.updated_date
+    cached = _authorization_cache.get(dialersetting.id)
+    if cached and cached[0] == version:
+        return cached[1]
+    authorization = ContactAuthorization(dialersetting.whitelist, dialersetting.blacklist)
+    _authorization_cache[dialersetting.id] = (version, authorization)
+    return authorization
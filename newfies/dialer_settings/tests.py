@@ -14,6 +14,7 @@
 
 from django.test import TestCase
 from dialer_settings.models import DialerSetting
+from dialer_settings.matcher import ContactAuthorization, get_contact_authorization, parse_prefix_list
 
 
 class DialerSettingModel(TestCase):
@@ -39,5 +40,30 @@ class DialerSettingModel(TestCase):
     def test_name(self):
         self.assertEqual(self.dialer_setting.name, "test_setting")
 
+    def test_contact_authorization(self):
+        self.assertEqual(parse_prefix_list('^(34|33)'), ['34', '33'])
+        self.assertEqual(parse_prefix_list('^34|^331'), ['34', '331'])
+        self.assertEqual(parse_prefix_list('34'), None)
+
+        # Prefix list matched with the trie
+        authorization = ContactAuthorization('^3465', '^(34|33)')
+        self.assertEqual(authorization.authorize_batch(['34650123456', '34123456', '33123456', '44123456']),
+                         [True, False, False, True])
+        # Regular expression
+        authorization = ContactAuthorization('', '99$')
+        self.assertEqual(authorization.authorize_batch(['123499', '123456']), [False, True])
+        # Invalid expression is ignored
+        self.assertTrue(ContactAuthorization('*', '(12').is_authorized('123'))
+
+        self.dialer_setting.blacklist = '^12'
+        self.dialer_setting.save()
+        authorization = get_contact_authorization(self.dialer_setting)
+        self.assertFalse(authorization.is_authorized('1234'))
+        self.assertTrue(get_contact_authorization(self.dialer_setting) is authorization)
+
+        self.dialer_setting.blacklist = '^56'
+        self.dialer_setting.save()
+        self.assertTrue(get_contact_authorization(self.dialer_setting).is_authorized('1234'))
+
     def teardown(self):
         self.dialer_setting.delete()
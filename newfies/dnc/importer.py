@@ -0,0 +1,37 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.utils.translation import ugettext as _
+from dnc.models import DNCContact
+from mod_utils.importer import CSVImporter
+
+
+class DNCContactImporter(CSVImporter):
+
+    """
+    Import the contacts of a DNC list, the CSV file has one phone number
+    per row
+    """
+    model = DNCContact
+
+    def __init__(self, job, dnc_id):
+        super(DNCContactImporter, self).__init__(job)
+        self.dnc_id = dnc_id
+
+    def parse_row(self, row):
+        try:
+            int(row[0])
+        except ValueError:
+            raise ValueError(_("Some of the imported data was invalid!"))
+        return DNCContact(dnc_id=self.dnc_id, phone_number=row[0])
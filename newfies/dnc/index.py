@@ -0,0 +1,191 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from dnc.models import DNCContact, dnc_deleted_key
+from array import array
+from bisect import bisect_left
+import heapq
+import logging
+import time
+import os
+
+logger = logging.getLogger('newfies.filelog')
+
+# Phone numbers are stored as 8 bytes integers in a sorted array
+if array('L').itemsize >= 8:
+    ARRAY_TYPECODE = 'L'
+    MAX_ENCODED_DIGITS = 18
+else:
+    ARRAY_TYPECODE = 'd'
+    MAX_ENCODED_DIGITS = 14
+
+
+def encode_phonenumber(phone_number):
+    """
+    Return the phone number encoded as an integer, None if the phone number
+    is not only made of digits or is too long. A leading 1 is added to keep
+    the leading zeros.
+    """
+    if not phone_number or not phone_number.isdigit() or len(phone_number) > MAX_ENCODED_DIGITS:
+        return None
+    return int('1' + phone_number)
+
+
+class DNCIndex(object):
+
+    """
+    In-memory index of the phone numbers of a DNC list
+
+    The numbers are kept in a sorted array of integers (8 bytes per number),
+    the numbers which cannot be encoded and the numbers added since the last
+    load are kept in a set. The index is refreshed incrementally with the
+    updated_date of the DNC contacts and reloaded when contacts have been
+    deleted or when the set of new numbers becomes too large.
+
+    **Attributes**:
+
+        * ``dnc_id`` - DNC list ID
+
+    **Usage**:
+
+        index = DNCIndex(dnc_id)
+        index.load()
+        dnc_numbers = index.filter(['3212321', '32123212'])
+    """
+
+    def __init__(self, dnc_id):
+        self.dnc_id = dnc_id
+        self.numbers = array(ARRAY_TYPECODE)
+        self.extra = set()
+        self.count = 0
+        self.max_id = 0
+        self.new_ids = set()
+        self.last_updated = None
+        self.last_refresh = 0
+        self.last_load = 0
+        self.last_deleted = None
+
+    def load(self):
+        """Load the whole DNC list, the contacts are read by chunk"""
+        # Read before the contacts, a deletion meanwhile reloads the list again
+        last_deleted = cache.get(dnc_deleted_key(self.dnc_id))
+        chunks = []
+        extra = set()
+        count = 0
+        last_id = 0
+        last_updated = None
+        while True:
+            rows = list(DNCContact.objects
+                        .filter(dnc_id=self.dnc_id, id__gt=last_id)
+                        .order_by('id')
+                        .values_list('id', 'phone_number', 'updated_date')[:settings.DNC_INDEX_CHUNK])
+            encoded = []
+            for (dnc_contact_id, phone_number, updated_date) in rows:
+                value = encode_phonenumber(phone_number)
+                if value is None:
+                    extra.add(phone_number)
+                else:
+                    encoded.append(value)
+                if last_updated is None or updated_date > last_updated:
+                    last_updated = updated_date
+            if encoded:
+                encoded.sort()
+                chunks.append(array(ARRAY_TYPECODE, encoded))
+            count += len(rows)
+            if rows:
+                last_id = rows[-1][0]
+            if len(rows) < settings.DNC_INDEX_CHUNK:
+                break
+
+        # Merge the sorted chunks without building a list of all the numbers
+        self.numbers = array(ARRAY_TYPECODE, heapq.merge(*chunks))
+        self.extra = extra
+        self.count = count
+        self.max_id = last_id
+        self.new_ids = set()
+        self.last_updated = last_updated
+        self.last_deleted = last_deleted
+        self.last_load = self.last_refresh = time.time()
+        logger.info("DNC index %d loaded: %d numbers, %d bytes" %
+                    (self.dnc_id, count, self.numbers.itemsize * len(self.numbers)))
+
+    def refresh(self):
+        """
+        Add the DNC contacts created or updated since the last refresh,
+        reload the list when contacts have been deleted
+
+        The contacts deleted through the ORM are flagged in the cache by
+        post_delete, the deletion of the last contacts is also caught by
+        their max id. The other deletions are caught by the next reload.
+        """
+        now = time.time()
+        if now - self.last_refresh < settings.DNC_INDEX_REFRESH:
+            return
+        if not self.last_load or now - self.last_load > settings.DNC_INDEX_RELOAD:
+            return self.load()
+        if cache.get(dnc_deleted_key(self.dnc_id)) != self.last_deleted:
+            return self.load()
+        self.last_refresh = now
+
+        list_contact = DNCContact.objects.filter(dnc_id=self.dnc_id)
+        if self.last_updated:
+            list_contact = list_contact.filter(updated_date__gte=self.last_updated)
+        for (dnc_contact_id, phone_number, updated_date) in \
+                list_contact.values_list('id', 'phone_number', 'updated_date'):
+            self.extra.add(phone_number)
+            if dnc_contact_id > self.max_id:
+                self.new_ids.add(dnc_contact_id)
+            if self.last_updated is None or updated_date > self.last_updated:
+                self.last_updated = updated_date
+
+        if len(self.new_ids) > settings.DNC_INDEX_CHUNK or \
+                (DNCContact.objects.filter(dnc_id=self.dnc_id).aggregate(Max('id'))['id__max'] or 0) < \
+                max(self.new_ids | set([self.max_id])):
+            self.load()
+
+    def __len__(self):
+        return len(self.numbers) + len(self.extra)
+
+    def __contains__(self, phone_number):
+        if phone_number in self.extra:
+            return True
+        value = encode_phonenumber(phone_number)
+        if value is None:
+            return False
+        pos = bisect_left(self.numbers, value)
+        return pos < len(self.numbers) and self.numbers[pos] == value
+
+    def filter(self, list_phone_number):
+        """Return the set of the phone numbers which are in the DNC list"""
+        return set(phone_number for phone_number in list_phone_number if phone_number in self)
+
+
+# Indexes are per worker process
+_dnc_indexes = {}
+_dnc_indexes_pid = None
+
+
+def get_dnc_index(dnc_id):
+    """Return the refreshed index of a DNC list, the index is loaded on first use"""
+    global _dnc_indexes, _dnc_indexes_pid
+    if _dnc_indexes_pid != os.getpid():
+        _dnc_indexes = {}
+        _dnc_indexes_pid = os.getpid()
+    if dnc_id not in _dnc_indexes:
+        _dnc_indexes[dnc_id] = DNCIndex(dnc_id)
+    _dnc_indexes[dnc_id].refresh()
+    return _dnc_indexes[dnc_id]
@@ -13,7 +13,10 @@
 #
 
 from django.db import models
+from django.db.models.signals import post_delete
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
+import time
 
 
 class DNC(models.Model):
@@ -85,5 +88,23 @@ class DNCContact(models.Model):
             ("view_dnc_contact", _('can see Do Not Call contact')),
         )
         db_table = "dnc_contact"
+        # Lookup of a phone number in a DNC list by the subscriber claim
+        index_together = [('dnc', 'phone_number')]
         verbose_name = _("Do Not Call contact")
         verbose_name_plural = _("Do Not Call contacts")
+
+
+def dnc_deleted_key(dnc_id):
+    return 'dnc_contact_deleted_%d' % int(dnc_id)
+
+
+def post_delete_dnc_contact(sender, **kwargs):
+    """A ``post_delete`` signal is sent by the DNCContact model instance
+    whenever it is deleted.
+
+    The time of the deletion is saved in the cache for the DNC list, the
+    DNC indexes of the workers reload the list when it changes
+    """
+    cache.set(dnc_deleted_key(kwargs['instance'].dnc_id), time.time(), None)
+
+post_delete.connect(post_delete_dnc_contact, sender=DNCContact)
@@ -0,0 +1,43 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from celery.decorators import task
+from celery.utils.log import get_task_logger
+from dnc.importer import DNCContactImporter
+from mod_utils.importer import ImportJob
+import os
+
+logger = get_task_logger(__name__)
+
+
+@task(ignore_result=True)
+def import_dnc_contact_file(job_id, path, dnc_id):
+    """
+    Import the CSV file of DNC contacts spooled by the DNC contact import
+    view, the progress is saved on the import job polled by the view
+
+    **Attributes**:
+
+        * ``job_id`` - ImportJob ID
+        * ``path`` - Path of the spooled CSV file
+        * ``dnc_id`` - DNC list ID
+    """
+    job = ImportJob.get(job_id)
+    if job is None:
+        logger.error("Import job %s expired, file %s not imported" % (job_id, path))
+        os.remove(path)
+        return False
+    job = DNCContactImporter(job, dnc_id).run(path)
+    logger.info("Import %s: %d DNC contact(s) imported out of %d row(s)" % (job_id, job.imported, job.row_count))
+    return True
@@ -15,13 +15,17 @@
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.db import connection
 from dnc.models import DNC, DNCContact
+from dnc.index import DNCIndex, encode_phonenumber
 from dnc.views import dnc_add, dnc_change, dnc_list, dnc_del,\
     dnc_contact_list, dnc_contact_add, dnc_contact_change, \
     dnc_contact_del, get_dnc_contact_count, dnc_contact_import
 from dnc.forms import DNCListForm, DNCContactForm, DNCContactSearchForm,\
     DNCContact_fileImport
 from django_lets_go.utils import BaseAuthenticatedClient
+from mod_utils.importer import ImportJob
+import json
 """
 import os
 
@@ -243,6 +247,24 @@ class DNCCustomerView(BaseAuthenticatedClient):
         response = dnc_contact_import(request)
         self.assertEqual(response.status_code, 200)
 
+    def test_dnc_contact_import_status(self):
+        """The DNC contacts are imported in the background"""
+        count_contact = DNCContact.objects.filter(dnc_id=1).count()
+        with open(settings.APPLICATION_DIR + '/dnc/fixtures/import_dnc_contact_10.txt', 'r') as dnc_file:
+            response = self.client.post('/module/dnc_contact_import/',
+                                        data={'dnc_list': '1',
+                                              'csv_file': dnc_file})
+        job = response.context['import_job']
+        response = self.client.get('/module/dnc_contact_import/status/%s/' % job.job_id)
+        self.assertEqual(response.status_code, 200)
+        job = json.loads(response.content)
+        self.assertEqual(job['status'], ImportJob.DONE)
+        self.assertEqual(job['imported'], 10)
+        self.assertEqual(DNCContact.objects.filter(dnc_id=1).count(), count_contact + 10)
+
+        response = self.client.get('/module/dnc_contact_import/status/unknown/')
+        self.assertEqual(response.status_code, 404)
+
     def test_get_dnc_contact_count(self):
         request = self.factory.get('/module/dnc_contact/', {'ids': '1'})
         request.user = self.user
@@ -299,6 +321,37 @@ class DNCModel(TestCase):
         self.assertEqual(self.dnc.name, "test_dnc")
         self.assertEqual(self.dnc_contact.phone_number, "123456")
 
+    def test_dnc_index(self):
+        DNCContact.objects.create(dnc=self.dnc, phone_number='0123456')
+        DNCContact.objects.create(dnc=self.dnc, phone_number='+34650123456')
+        index = DNCIndex(self.dnc.id)
+        index.load()
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.filter(['123456', '0123456', '00123456', '+34650123456', '650123456']),
+                         set(['123456', '0123456', '+34650123456']))
+        self.assertEqual(encode_phonenumber('0123'), 10123)
+
+        # Incremental refresh
+        DNCContact.objects.create(dnc=self.dnc, phone_number='987654')
+        index.last_refresh = 0
+        index.refresh()
+        self.assertTrue('987654' in index)
+        self.assertEqual(index.count, 3)
+
+        # Deleted contacts reload the index
+        DNCContact.objects.filter(phone_number='123456').delete()
+        index.last_refresh = 0
+        index.refresh()
+        self.assertFalse('123456' in index)
+        self.assertEqual(index.count, 3)
+
+        # The last contacts deleted outside the ORM are caught by their max id
+        connection.cursor().execute("DELETE FROM dnc_contact WHERE phone_number = '987654'")
+        index.last_refresh = 0
+        index.refresh()
+        self.assertFalse('987654' in index)
+        self.assertEqual(index.count, 2)
+
     def teardown(self):
         self.dnc.delete()
         self.dnc_contact.delete()
@@ -20,11 +20,12 @@ from dnc.models import DNC, DNCContact
 from dnc.forms import DNCListForm, DNCContactSearchForm, DNCContactForm,\
     DNCContact_fileImport, DNCContact_fileExport
 from dnc.constants import DNC_COLUMN_NAME, DNC_CONTACT_COLUMN_NAME
-from django_lets_go.common_functions import get_pagination_vars, striplist, source_desti_field_chk,\
+from django_lets_go.common_functions import get_pagination_vars, source_desti_field_chk,\
     getvar
+from dnc.tasks import import_dnc_contact_file
 from mod_utils.helper import Export_choice
+from mod_utils.importer import ImportJob, spool_upload, import_job_status
 import tablib
-import csv
 
 dnc_list_redirect_url = '/module/dnc_list/'
 dnc_contact_redirect_url = '/module/dnc_contact/'
@@ -361,91 +362,40 @@ def dnc_contact_import(request):
 
     **Logic Description**:
 
-        * Add new dnc contacts which will belong to the logged in user
-          via csv file & get the result (upload success and failure
-          statistics)
-
-    **Important variable**:
-
-        * total_rows - Total no. of records in the CSV file
-        * retail_record_count - No. of records imported from the CSV file
+        * The csv file is spooled to disk and the dnc contacts are imported
+          in the background by the ``import_dnc_contact_file`` task
+        * The page polls the progress of the import (upload success and
+          failure statistics) with ``dnc_contact_import_status``
     """
     form = DNCContact_fileImport(request.user, request.POST or None, request.FILES or None)
-    csv_data = ''
-    msg = ''
-    error_msg = ''
-    success_import_list = []
-    type_error_import_list = []
-    contact_cnt = 0
-    dup_contact_cnt = 0
-    bulk_record = []
+    import_job = None
 
     if form.is_valid():
-        # col_no - field name
-        #  0     - contact
-        # To count total rows of CSV file
         # Get DNC Obj
         dnc = get_object_or_404(DNC, pk=request.POST['dnc_list'], user=request.user)
-
-        records = csv.reader(request.FILES['csv_file'])
-        total_rows = len(list(records))
-        BULK_SIZE = 1000
-        csv_data = csv.reader(request.FILES['csv_file'])
-
-        # Read each Row
-        for row in csv_data:
-            row = striplist(row)
-            if not row or str(row[0]) == 0:
-                continue
-
-            # Check field type
-            try:
-                int(row[0])
-            except ValueError:
-                error_msg = _("Some of the imported data was invalid!")
-                type_error_import_list.append(row)
-                continue
-
-            bulk_record.append(
-                DNCContact(
-                    dnc_id=dnc.id,
-                    phone_number=row[0])
-            )
-            contact_cnt = contact_cnt + 1
-            if contact_cnt < 100:
-                # We want to display only 100 lines of the success import
-                success_import_list.append(row)
-
-            if contact_cnt % BULK_SIZE == 0:
-                # Bulk insert
-                DNCContact.objects.bulk_create(bulk_record)
-                bulk_record = []
-
-        if bulk_record:
-            # Remaining record
-            DNCContact.objects.bulk_create(bulk_record)
-            bulk_record = []
-
-    # check if there is contact imported
-    if contact_cnt > 0:
-        msg = _('%(contact_cnt)s DNC contact(s) have been uploaded successfully out of %(total_rows)s row(s)!') \
-            % {'contact_cnt': contact_cnt,
-               'total_rows': total_rows}
-
-    if dup_contact_cnt > 0:
-        error_msg = _('Duplicate DNC contact(s) %(dup_contact_cnt)s are not inserted!!') \
-            % {'dup_contact_cnt': dup_contact_cnt}
+        # The file is imported in the background, the page polls the job
+        path = spool_upload(request.FILES['csv_file'])
+        import_job = ImportJob.create(request.user.id)
+        import_dnc_contact_file.delay(import_job.job_id, path, dnc.id)
 
     data = {
         'form': form,
-        'msg': msg,
-        'error_msg': error_msg,
-        'success_import_list': success_import_list,
-        'type_error_import_list': type_error_import_list,
+        'import_job': import_job,
     }
     return render_to_response('dnc/dnc_contact/import_dnc_contact.html', data, context_instance=RequestContext(request))
 
 
+@login_required
+def dnc_contact_import_status(request, job_id):
+    """Progress of the DNC contact import of the logged in user in JSON
+
+    **Attributes**:
+
+        * ``job_id`` - ImportJob ID
+    """
+    return import_job_status(request, job_id)
+
+
 @login_required
 def dnc_contact_export(request):
     """Export CSV file of DNC contact"""
@@ -12,10 +12,31 @@
 # Arezqui Belaid <info@star2billing.com>
 #
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.utils.timezone import utc
 from frontend.forms import SEARCH_TYPE
+from dialer_cdr.constants import CALL_DISPOSITION, ROLLUP_PERIOD
+from dialer_cdr.models import truncate_date
 from dateutil.relativedelta import relativedelta
-from datetime import datetime
+from datetime import datetime, timedelta
+import time
+
+# Dispositions counted on the dashboard, the other calls are failed
+DASHBOARD_DISPOSITION = (
+    ('total_answered', (CALL_DISPOSITION.ANSWER, 'NORMAL_CLEARING')),
+    ('total_busy', (CALL_DISPOSITION.BUSY, 'USER_BUSY')),
+    ('total_not_answered', (CALL_DISPOSITION.NOANSWER, 'NO_ANSWER')),
+    ('total_cancel', (CALL_DISPOSITION.CANCEL, 'ORIGINATOR_CANCEL')),
+    ('total_congestion', (CALL_DISPOSITION.CONGESTION, 'NORMAL_CIRCUIT_CONGESTION')),
+)
+
+ROLLUP_PERIOD_STEP = {
+    ROLLUP_PERIOD.MINUTE: timedelta(minutes=1),
+    ROLLUP_PERIOD.HOUR: timedelta(hours=1),
+    ROLLUP_PERIOD.DAY: timedelta(days=1),
+}
 
 
 def calculate_date(search_type):
@@ -46,3 +67,104 @@ def calculate_date(search_type):
         start_date = end_date + relativedelta(hours=-1)
 
     return start_date.replace(tzinfo=utc)
+
+
+def get_search_period(search_type):
+    """
+    Return the start date, the end date and the period of the CDR rollups
+    of the dashboard search
+    """
+    search_type = int(search_type)
+    end_date = datetime.utcnow().replace(tzinfo=utc)
+    start_date = calculate_date(search_type)
+    if search_type == SEARCH_TYPE.C_Yesterday:
+        start_date = datetime(end_date.year, end_date.month, end_date.day, 0, 0, 0, 0)\
+            .replace(tzinfo=utc) - relativedelta(days=1)
+        end_date = datetime(end_date.year, end_date.month, end_date.day, 23, 59, 59, 999999)\
+            .replace(tzinfo=utc) - relativedelta(days=1)
+
+    if search_type >= SEARCH_TYPE.E_Last_12_hours:
+        period = ROLLUP_PERIOD.MINUTE
+    elif search_type >= SEARCH_TYPE.B_Last_7_days:
+        period = ROLLUP_PERIOD.HOUR
+    else:
+        period = ROLLUP_PERIOD.DAY  # Last 30 days option
+    return (start_date, end_date, period)
+
+
+def aggregate_dashboard_call(user_id, campaign_id, period, start_date, end_date):
+    """
+    Return the calls of the campaign per bucket in one query on the CDR
+    rollups, each row is (bucket, call_count, duration_sum, billsec_sum)
+    followed by the count of each disposition of DASHBOARD_DISPOSITION
+    """
+    if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql_psycopg2':
+        count_sql = "SUM(call_count) FILTER (WHERE disposition IN (%s))"
+    else:
+        count_sql = "SUM(CASE WHEN disposition IN (%s) THEN call_count ELSE 0 END)"
+    list_count = []
+    params = []
+    for (name, list_disposition) in DASHBOARD_DISPOSITION:
+        list_count.append(count_sql % ', '.join(['%s'] * len(list_disposition)))
+        params.extend(list_disposition)
+    params.extend([user_id, campaign_id, period, truncate_date(start_date, period), end_date])
+    sql = "SELECT bucket, SUM(call_count), SUM(duration_sum), SUM(billsec_sum), %s "\
+        "FROM dialer_cdr_rollup "\
+        "WHERE user_id = %%s AND campaign_id = %%s AND period = %%s AND bucket BETWEEN %%s AND %%s "\
+        "GROUP BY bucket ORDER BY bucket" % ', '.join(list_count)
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def build_timeline(list_row, period, start_date, end_date):
+    """
+    Return the timestamps in milliseconds of all the buckets from
+    start_date to end_date, with the calls and the duration of each
+    bucket, 0 for the buckets without call
+    """
+    step = ROLLUP_PERIOD_STEP[period]
+    first_bucket = truncate_date(start_date, period)
+    count = int((end_date - first_bucket).total_seconds() // step.total_seconds()) + 1
+    timeline = [first_bucket + step * i for i in range(count)]
+    # The backends without time zone support return naive UTC dates
+    dict_row = dict((row[0] if row[0].tzinfo else row[0].replace(tzinfo=utc), row) for row in list_row)
+    empty_row = (None, 0, 0)
+    xdata = [int(1000 * time.mktime(bucket.timetuple())) for bucket in timeline]
+    ydata = [int(dict_row.get(bucket, empty_row)[1] or 0) for bucket in timeline]
+    ydata2 = [int(dict_row.get(bucket, empty_row)[2] or 0) for bucket in timeline]
+    return (xdata, ydata, ydata2)
+
+
+def dashboard_cache_key(user_id, campaign_id, search_type):
+    return 'dashboard_%d_%d_%d' % (int(user_id), int(campaign_id), int(search_type))
+
+
+def get_dashboard_call(user_id, campaign_id, search_type):
+    """
+    Return the totals of the calls of the campaign and the timeline of the
+    calls and duration for the dashboard, cached DASHBOARD_CACHE_TIMEOUT
+    seconds per user, campaign and search type
+    """
+    key = dashboard_cache_key(user_id, campaign_id, search_type)
+    dashboard_call = cache.get(key)
+    if dashboard_call is not None:
+        return dashboard_call
+
+    (start_date, end_date, period) = get_search_period(search_type)
+    list_row = aggregate_dashboard_call(user_id, campaign_id, period, start_date, end_date)
+    dashboard_call = {
+        'total_call_count': sum(int(row[1] or 0) for row in list_row),
+        'total_duration_sum': sum(int(row[2] or 0) for row in list_row),
+        'total_billsec_sum': sum(int(row[3] or 0) for row in list_row),
+    }
+    total_disposition = 0
+    for (i, (name, list_disposition)) in enumerate(DASHBOARD_DISPOSITION):
+        dashboard_call[name] = sum(int(row[4 + i] or 0) for row in list_row)
+        total_disposition += dashboard_call[name]
+    # VOIP CALL FAILED
+    dashboard_call['total_failed'] = dashboard_call['total_call_count'] - total_disposition
+    (dashboard_call['xdata'], dashboard_call['ydata'], dashboard_call['ydata2']) = \
+        build_timeline(list_row, period, start_date, end_date)
+    cache.set(key, dashboard_call, settings.DASHBOARD_CACHE_TIMEOUT)
+    return dashboard_call
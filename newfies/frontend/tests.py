@@ -18,6 +18,8 @@ from frontend.forms import LoginForm, DashboardForm
 from frontend.views import customer_dashboard, index, \
     login_view, logout_view
 from frontend.constants import SEARCH_TYPE
+from frontend.function_def import get_dashboard_call, dashboard_cache_key
+from django.core.cache import cache
 from newfies_dialer.urls import custom_404_view, custom_500_view
 
 
@@ -168,6 +170,20 @@ class FrontendCustomerView(BaseAuthenticatedClient):
         self.assertEqual(response.status_code, 200)
         response = customer_dashboard(request, on_index='yes')
 
+    def test_dashboard_call(self):
+        """The calls of the dashboard are aggregated from the rollups and cached"""
+        call_command("create_callrequest_cdr", "1|10")
+        cache.delete(dashboard_cache_key(self.user.id, 1, SEARCH_TYPE.G_Last_hour))
+        dashboard_call = get_dashboard_call(self.user.id, 1, SEARCH_TYPE.G_Last_hour)
+        # One point per minute of the last hour
+        self.assertTrue(60 <= len(dashboard_call['xdata']) <= 61)
+        self.assertEqual(sum(dashboard_call['ydata']), dashboard_call['total_call_count'])
+        total_disposition = dashboard_call['total_answered'] + dashboard_call['total_busy'] + \
+            dashboard_call['total_not_answered'] + dashboard_call['total_cancel'] + \
+            dashboard_call['total_congestion'] + dashboard_call['total_failed']
+        self.assertEqual(total_disposition, dashboard_call['total_call_count'])
+        self.assertEqual(cache.get(dashboard_cache_key(self.user.id, 1, SEARCH_TYPE.G_Last_hour)), dashboard_call)
+
     def test_logout_view(self):
         """Test Function to check logout view"""
         response = self.client.post('/logout/', follow=True)
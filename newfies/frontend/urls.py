@@ -21,4 +21,7 @@ urlpatterns = patterns('frontend.views',
                        (r'^index/$', 'index'),
                        (r'^pleaselog/$', 'pleaselog'),
                        (r'^dashboard/$', 'customer_dashboard'),
+                       (r'^export/status/(.+)/$', 'export_status'),
+                       (r'^export/download/(.+)/$', 'export_download'),
+                       (r'^report/status/(.+)/$', 'report_status'),
                        )
@@ -17,24 +17,21 @@ from django.contrib.auth.decorators import login_required,\
     permission_required
 from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response
-from django.db.models import Sum, Avg, Count
 from django.conf import settings
 from django.template.context import RequestContext
 from django.utils.translation import ugettext as _
 from dialer_contact.models import Contact
 from dialer_contact.constants import CONTACT_STATUS
 from dialer_campaign.models import Campaign, Subscriber
-from dialer_campaign.function_def import date_range
-from dialer_cdr.models import VoIPCall
 from dialer_cdr.constants import CALL_DISPOSITION
 from frontend.forms import LoginForm, DashboardForm
-from frontend.function_def import calculate_date
+from frontend.function_def import get_dashboard_call
 from frontend.constants import COLOR_DISPOSITION, SEARCH_TYPE
+from mod_utils.exporter import export_job_status, export_job_download
+from mod_utils.report import report_job_status
 from django_lets_go.common_functions import percentage
 from datetime import datetime
 from django.utils.timezone import utc
-from dateutil.relativedelta import relativedelta
-import time
 import logging
 
 
@@ -147,244 +144,45 @@ def customer_dashboard(request, on_index=None):
     form = DashboardForm(request.user, request.POST or None)
     logging.debug('Got Campaign list')
 
-    total_record = dict()
-    total_duration_sum = 0
-    total_billsec_sum = 0
-    total_call_count = 0
-    total_answered = 0
-    total_not_answered = 0
-    total_busy = 0
-    total_cancel = 0
-    total_congestion = 0
-    total_failed = 0
     search_type = SEARCH_TYPE.D_Last_24_hours  # default Last 24 hours
     selected_campaign = ''
 
     if campaign_id_list:
         selected_campaign = campaign_id_list[0]  # default campaign id
 
+    dashboard_call = {
+        'total_duration_sum': 0,
+        'total_billsec_sum': 0,
+        'total_call_count': 0,
+        'total_answered': 0,
+        'total_not_answered': 0,
+        'total_busy': 0,
+        'total_cancel': 0,
+        'total_congestion': 0,
+        'total_failed': 0,
+        'xdata': [],
+        'ydata': [],
+        'ydata2': [],
+    }
     # selected_campaign should not be empty
     if selected_campaign:
         if form.is_valid():
             selected_campaign = request.POST['campaign']
             search_type = request.POST['search_type']
 
-        end_date = datetime.utcnow().replace(tzinfo=utc)
-        start_date = calculate_date(search_type)
-
-        # date_length is used to do group by starting_date
-        if int(search_type) >= SEARCH_TYPE.B_Last_7_days:  # all options except 30 days
-            date_length = 13
-            if int(search_type) == SEARCH_TYPE.C_Yesterday:  # yesterday
-                tday = datetime.utcnow().replace(tzinfo=utc)
-                start_date = datetime(tday.year, tday.month, tday.day, 0, 0, 0, 0)\
-                    .replace(tzinfo=utc) - relativedelta(days=1)
-                end_date = datetime(tday.year, tday.month, tday.day, 23, 59, 59, 999999)\
-                    .replace(tzinfo=utc) - relativedelta(days=1)
-            if int(search_type) >= SEARCH_TYPE.E_Last_12_hours:
-                date_length = 16
-        else:
-            date_length = 10  # Last 30 days option
+        # Calls per disposition and timeline of the calls in one query
+        # on the CDR rollups, cached a short time
+        dashboard_call = get_dashboard_call(request.user.id, selected_campaign, search_type)
 
-        select_data = {
-            "starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,%s)" % str(date_length)
-        }
+    logging.debug('After Aggregate VoIPCallRollup')
 
-        # This calls list is used by pie chart
-        calls = VoIPCall.objects\
-            .filter(callrequest__campaign=selected_campaign,
-                    duration__isnull=False,
-                    user=request.user,
-                    starting_date__range=(start_date, end_date))\
-            .extra(select=select_data)\
-            .values('starting_date', 'disposition')\
-            .annotate(Count('starting_date'))\
-            .order_by('starting_date')
-
-        logging.debug('Aggregate VoIPCall')
-
-        for i in calls:
-            total_call_count += i['starting_date__count']
-            if i['disposition'] == CALL_DISPOSITION.ANSWER or i['disposition'] == 'NORMAL_CLEARING':
-                total_answered += i['starting_date__count']
-            elif i['disposition'] == CALL_DISPOSITION.BUSY or i['disposition'] == 'USER_BUSY':
-                total_busy += i['starting_date__count']
-            elif i['disposition'] == CALL_DISPOSITION.NOANSWER or i['disposition'] == 'NO_ANSWER':
-                total_not_answered += i['starting_date__count']
-            elif i['disposition'] == CALL_DISPOSITION.CANCEL or i['disposition'] == 'ORIGINATOR_CANCEL':
-                total_cancel += i['starting_date__count']
-            elif i['disposition'] == CALL_DISPOSITION.CONGESTION or i['disposition'] == 'NORMAL_CIRCUIT_CONGESTION':
-                total_congestion += i['starting_date__count']
-            else:
-                # VOIP CALL FAILED
-                total_failed += i['starting_date__count']
-
-        # following calls list is without disposition & group by call date
-        calls = VoIPCall.objects\
-            .filter(callrequest__campaign=selected_campaign,
-                    duration__isnull=False,
-                    user=request.user,
-                    starting_date__range=(start_date, end_date))\
-            .extra(select=select_data)\
-            .values('starting_date')\
-            .annotate(Sum('duration'))\
-            .annotate(Sum('billsec'))\
-            .annotate(Avg('duration'))\
-            .annotate(Count('starting_date'))\
-            .order_by('starting_date')
-
-        logging.debug('Aggregate VoIPCall (2)')
-
-        mintime = start_date
-        maxtime = end_date
-        calls_dict = {}
-        calls_dict_with_min = {}
-
-        for call in calls:
-            total_duration_sum += call['duration__sum']
-            total_billsec_sum += call['billsec__sum']
-            if int(search_type) >= SEARCH_TYPE.B_Last_7_days:
-                ctime = datetime(int(call['starting_date'][0:4]),
-                                 int(call['starting_date'][5:7]),
-                                 int(call['starting_date'][8:10]),
-                                 int(call['starting_date'][11:13]),
-                                 0,
-                                 0,
-                                 0).replace(tzinfo=utc)
-                if int(search_type) >= SEARCH_TYPE.E_Last_12_hours:
-                    ctime = datetime(int(call['starting_date'][0:4]),
-                                     int(call['starting_date'][5:7]),
-                                     int(call['starting_date'][8:10]),
-                                     int(call['starting_date'][11:13]),
-                                     int(call['starting_date'][14:16]),
-                                     0,
-                                     0).replace(tzinfo=utc)
-            else:
-                ctime = datetime(int(call['starting_date'][0:4]),
-                                 int(call['starting_date'][5:7]),
-                                 int(call['starting_date'][8:10]),
-                                 0,
-                                 0,
-                                 0,
-                                 0).replace(tzinfo=utc)
-            if ctime > maxtime:
-                maxtime = ctime
-            elif ctime < mintime:
-                mintime = ctime
-
-            # all options except 30 days
-            if int(search_type) >= SEARCH_TYPE.B_Last_7_days:
-                calls_dict[int(ctime.strftime("%Y%m%d%H"))] =\
-                    {
-                        'call_count': call['starting_date__count'],
-                        'duration_sum': call['duration__sum'],
-                        'duration_avg': float(call['duration__avg']),
-                }
-
-                calls_dict_with_min[int(ctime.strftime("%Y%m%d%H%M"))] =\
-                    {
-                        'call_count': call['starting_date__count'],
-                        'duration_sum': call['duration__sum'],
-                        'duration_avg': float(call['duration__avg']),
-                }
-            else:
-                # Last 30 days option
-                calls_dict[int(ctime.strftime("%Y%m%d"))] =\
-                    {
-                        'call_count': call['starting_date__count'],
-                        'duration_sum': call['duration__sum'],
-                        'duration_avg': float(call['duration__avg']),
-                }
-
-        logging.debug('After Call Loops')
-
-        dateList = date_range(mintime, maxtime, q=search_type)
-
-        for date in dateList:
-            inttime = int(date.strftime("%Y%m%d"))
-
-            # last 7 days | yesterday | last 24 hrs
-            if int(search_type) == SEARCH_TYPE.B_Last_7_days \
-                or int(search_type) == SEARCH_TYPE.C_Yesterday \
-                    or int(search_type) == SEARCH_TYPE.D_Last_24_hours:
-
-                for option in range(0, 24):
-                    day_time = int(str(inttime) + str(option).zfill(2))
-
-                    graph_day = datetime(int(date.strftime("%Y")),
-                                         int(date.strftime("%m")),
-                                         int(date.strftime("%d")),
-                                         int(str(option).zfill(2))).replace(tzinfo=utc)
-
-                    dt = int(1000 * time.mktime(graph_day.timetuple()))
-                    total_record[dt] = {
-                        'call_count': 0,
-                        'duration_sum': 0,
-                        'duration_avg': 0.0,
-                    }
-
-                    if day_time in calls_dict.keys():
-                        total_record[dt]['call_count'] += calls_dict[day_time]['call_count']
-                        total_record[dt]['duration_sum'] += calls_dict[day_time]['duration_sum']
-                        total_record[dt]['duration_avg'] += float(calls_dict[day_time]['duration_avg'])
-
-            # last 12 hrs | last 6 hrs | last 1 hr
-            elif (int(search_type) == SEARCH_TYPE.E_Last_12_hours
-                  or int(search_type) == SEARCH_TYPE.F_Last_6_hours
-                  or int(search_type) == SEARCH_TYPE.G_Last_hour):
-
-                for hour in range(0, 24):
-                    for minute in range(0, 60):
-                        hr_time = int(str(inttime) + str(hour).zfill(2) + str(minute).zfill(2))
-
-                        graph_day = datetime(int(date.strftime("%Y")),
-                                             int(date.strftime("%m")),
-                                             int(date.strftime("%d")),
-                                             int(str(hour).zfill(2)),
-                                             int(str(minute).zfill(2))).replace(tzinfo=utc)
-
-                        dt = int(1000 * time.mktime(graph_day.timetuple()))
-                        total_record[dt] = {
-                            'call_count': 0,
-                            'duration_sum': 0,
-                            'duration_avg': 0.0,
-                        }
-
-                        if hr_time in calls_dict_with_min.keys():
-                            total_record[dt]['call_count'] += calls_dict_with_min[hr_time]['call_count']
-                            total_record[dt]['duration_sum'] += calls_dict_with_min[hr_time]['duration_sum']
-                            total_record[dt]['duration_avg'] += float(calls_dict_with_min[hr_time]['duration_avg'])
-            else:
-                # Default: Last 30 days option
-                graph_day = datetime(int(date.strftime("%Y")),
-                                     int(date.strftime("%m")),
-                                     int(date.strftime("%d"))).replace(tzinfo=utc)
-                dt = int(1000 * time.mktime(graph_day.timetuple()))
-                total_record[dt] = {
-                    'call_count': 0,
-                    'duration_sum': 0,
-                    'duration_avg': 0,
-                }
-                if inttime in calls_dict.keys():
-                    total_record[dt]['call_count'] += calls_dict[inttime]['call_count']
-                    total_record[dt]['duration_sum'] += calls_dict[inttime]['duration_sum']
-                    total_record[dt]['duration_avg'] += float(calls_dict[inttime]['duration_avg'])
-
-    logging.debug('After dateList Loops')
-
-    # sorting on date col
-    total_record = total_record.items()
-    total_record = sorted(total_record, key=lambda k: k[0])
+    total_call_count = dashboard_call['total_call_count']
 
     # lineplusbarwithfocuschart
     final_charttype = "linePlusBarChart"
-    xdata = []
-    ydata = []
-    ydata2 = []
-    for i in total_record:
-        xdata.append(i[0])
-        ydata.append(i[1]['call_count'])
-        ydata2.append(i[1]['duration_sum'])
+    xdata = dashboard_call['xdata']
+    ydata = dashboard_call['ydata']
+    ydata2 = dashboard_call['ydata2']
 
     tooltip_date = "%d %b %y %H:%M %p"
     kwargs1 = {}
@@ -420,12 +218,12 @@ def customer_dashboard(request, on_index=None):
 
         # Y-axis order depend upon CALL_DISPOSITION
         # 'ANSWER', 'BUSY', 'CANCEL', 'CONGESTION', 'FAILED', 'NOANSWER'
-        ydata = [percentage(total_answered, total_call_count),
-                 percentage(total_busy, total_call_count),
-                 percentage(total_cancel, total_call_count),
-                 percentage(total_congestion, total_call_count),
-                 percentage(total_failed, total_call_count),
-                 percentage(total_not_answered, total_call_count)]
+        ydata = [percentage(dashboard_call['total_answered'], total_call_count),
+                 percentage(dashboard_call['total_busy'], total_call_count),
+                 percentage(dashboard_call['total_cancel'], total_call_count),
+                 percentage(dashboard_call['total_congestion'], total_call_count),
+                 percentage(dashboard_call['total_failed'], total_call_count),
+                 percentage(dashboard_call['total_not_answered'], total_call_count)]
 
         color_list = [
             COLOR_DISPOSITION['ANSWER'],
@@ -444,15 +242,15 @@ def customer_dashboard(request, on_index=None):
         'form': form,
         'campaign_phonebook_active_contact_count': pb_active_contact_count,
         'reached_contact': reached_contact,
-        'total_duration_sum': total_duration_sum,
-        'total_billsec_sum': total_billsec_sum,
+        'total_duration_sum': dashboard_call['total_duration_sum'],
+        'total_billsec_sum': dashboard_call['total_billsec_sum'],
         'total_call_count': total_call_count,
-        'total_answered': total_answered,
-        'total_not_answered': total_not_answered,
-        'total_busy': total_busy,
-        'total_cancel': total_cancel,
-        'total_congestion': total_congestion,
-        'total_failed': total_failed,
+        'total_answered': dashboard_call['total_answered'],
+        'total_not_answered': dashboard_call['total_not_answered'],
+        'total_busy': dashboard_call['total_busy'],
+        'total_cancel': dashboard_call['total_cancel'],
+        'total_congestion': dashboard_call['total_congestion'],
+        'total_failed': dashboard_call['total_failed'],
         'answered_color': COLOR_DISPOSITION['ANSWER'],
         'busy_color': COLOR_DISPOSITION['BUSY'],
         'not_answered_color': COLOR_DISPOSITION['NOANSWER'],
@@ -484,3 +282,36 @@ def customer_dashboard(request, on_index=None):
     if on_index == 'yes':
         return data
     return render_to_response('frontend/dashboard.html', data, context_instance=RequestContext(request))
+
+
+@login_required
+def export_status(request, job_id):
+    """Progress of the XLS export of the logged in user in JSON
+
+    **Attributes**:
+
+        * ``job_id`` - ExportJob ID
+    """
+    return export_job_status(request, job_id)
+
+
+@login_required
+def export_download(request, job_id):
+    """Download the XLS file of the finished export of the logged in user
+
+    **Attributes**:
+
+        * ``job_id`` - ExportJob ID
+    """
+    return export_job_download(request, job_id)
+
+
+@login_required
+def report_status(request, job_id):
+    """Status of a report computed in the background for the logged in user in JSON
+
+    **Attributes**:
+
+        * ``job_id`` - ReportJob ID
+    """
+    return report_job_status(request, job_id)
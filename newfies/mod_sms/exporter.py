@@ -0,0 +1,37 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from mod_sms.models import SMSMessage
+from mod_utils.exporter import Exporter
+
+
+class SMSExporter(Exporter):
+
+    """
+    Export the SMS of the SMS report, the kwargs are the filters of the
+    report (``request.session['sms_record_kwargs']``)
+    """
+    headers = ('sender', 'recipient_number', 'send_date', 'uuid',
+               'status', 'status_message', 'gateway')
+    fields = ('sender__username', 'recipient_number', 'send_date', 'uuid',
+              'status', 'status_message', 'gateway__name')
+
+    def get_queryset(self):
+        return SMSMessage.objects.filter(**self.kwargs)
+
+    def format_row(self, row):
+        row = list(row)
+        row[3] = str(row[3])
+        row[6] = row[6] or ''
+        return row
@@ -17,7 +17,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.utils.timezone import now
 from django.core.urlresolvers import reverse
 from django.core.cache import cache
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.utils.encoding import force_unicode
 from dateutil.relativedelta import relativedelta
 from dialer_contact.models import Phonebook, Contact
@@ -27,6 +27,7 @@ from sms.models import Gateway
 from constants import SMS_CAMPAIGN_STATUS, SMS_SUBSCRIBER_STATUS
 from django_lets_go.intermediate_model_base_class import Model
 from django_lets_go.common_functions import get_unique_code
+from dialer_campaign.config import CampaignConfigCache
 from datetime import datetime
 from django.utils.timezone import utc
 
@@ -565,3 +566,10 @@ def post_save_add_contact(sender, **kwargs):
                 pass
 
 post_save.connect(post_save_add_contact, sender=Contact)
+
+
+# Started SMS campaigns, cached per worker
+sms_campaign_config = CampaignConfigCache(SMSCampaign, SMS_CAMPAIGN_STATUS.START, ('user', 'sms_gateway'))
+
+post_save.connect(sms_campaign_config.invalidate, sender=SMSCampaign)
+post_delete.connect(sms_campaign_config.invalidate, sender=SMSCampaign)
@@ -20,9 +20,11 @@ from celery.decorators import task
 from django_lets_go.only_one_task import only_one
 from celery.utils.log import get_task_logger
 from sms.tasks import SendMessage
-from mod_sms.models import SMSCampaign, SMSCampaignSubscriber, SMSMessage
+from mod_sms.models import SMSCampaign, SMSCampaignSubscriber, SMSMessage, sms_campaign_config
 from mod_sms.constants import SMS_SUBSCRIBER_STATUS, SMS_CAMPAIGN_STATUS
 from dialer_campaign.function_def import user_dialer_setting
+from dialer_contact.models import Contact
+from dialer_settings.matcher import get_contact_authorization
 from datetime import datetime, timedelta
 from django.utils.timezone import utc
 from math import ceil
@@ -64,14 +66,14 @@ def init_smsrequest(obj_subscriber, obj_sms_campaign):
         else:
             obj_subscriber.count_attempt += 1
 
-        text_message = obj_subscriber.contact.replace_tag(obj_subscriber.sms_campaign.text_message)
+        text_message = obj_subscriber.contact.replace_tag(obj_sms_campaign.text_message)
 
         # Create Message object
         msg_obj = SMSMessage.objects.create(
             content=text_message,
             recipient_number=obj_subscriber.contact.contact,
-            sender=obj_subscriber.sms_campaign.user,
-            sender_number=obj_subscriber.sms_campaign.callerid,
+            sender=obj_sms_campaign.user,
+            sender_number=obj_sms_campaign.callerid,
             status='Unsent',
             content_type=ContentType.objects.get(model='smscampaignsubscriber', app_label='mod_sms'),
             object_id=obj_subscriber.id,
@@ -136,22 +138,36 @@ class check_sms_campaign_pendingcall(Task):
             logger.info("[SMS_TASK] No Subscriber to proceed on this sms_campaign")
             return False
 
+        # Check the contacts against the whitelist & blacklist in one pass
+        dict_contact = Contact.objects.in_bulk([elem_camp_subscriber.contact_id
+                                                for elem_camp_subscriber in list_subscriber])
+        list_contact = [dict_contact[elem_camp_subscriber.contact_id].contact
+                        if elem_camp_subscriber.contact_id in dict_contact
+                        else elem_camp_subscriber.duplicate_contact
+                        for elem_camp_subscriber in list_subscriber]
+        dialersetting = user_dialer_setting(obj_sms_campaign.user)
+        if dialersetting:
+            list_authorized = get_contact_authorization(dialersetting).authorize_batch(list_contact)
+        else:
+            logger.error("[SMS_TASK] Can't find user's dialersetting")
+            list_authorized = [False] * len(list_contact)
+
         # find how to dispatch them in the current minutes
         time_to_wait = 6.0 / no_subscriber
         count = 0
 
-        for elem_camp_subscriber in list_subscriber:
+        for (elem_camp_subscriber, authorized) in zip(list_subscriber, list_authorized):
             """Loop on Subscriber and start the initcall task"""
-            count = count + 1
-            logger.info("[SMS_TASK] Add SMS Message for Subscriber (%s) & wait (%s) " %
-                        (str(elem_camp_subscriber.id), str(time_to_wait)))
-
             # Check if the contact is authorized
-            if not obj_sms_campaign.is_authorized_contact(elem_camp_subscriber.contact.contact):
+            if not authorized:
                 logger.error("[SMS_TASK] Error : Contact not authorized")
                 elem_camp_subscriber.status = SMS_SUBSCRIBER_STATUS.NOT_AUTHORIZED  # Update to Not Authorized
                 elem_camp_subscriber.save()
-                return True
+                continue
+
+            count = count + 1
+            logger.info("[SMS_TASK] Add SMS Message for Subscriber (%s) & wait (%s) " %
+                        (str(elem_camp_subscriber.id), str(time_to_wait)))
 
             # Todo Check if it's a good practice / implement a PID algorithm
             second_towait = ceil(count * time_to_wait)
@@ -217,7 +233,7 @@ class sms_campaign_running(PeriodicTask):
         # logger = self.get_logger(**kwargs)
         logger.warning("[SMS_TASK] TASK :: Check if there is sms_campaign_running")
 
-        for sms_campaign in SMSCampaign.objects.get_running_sms_campaign():
+        for sms_campaign in sms_campaign_config.get_running_campaign():
             logger.info("[SMS_TASK] => Found SMS Campaign name %s (id:%s)" % (sms_campaign.name,
                                                                               sms_campaign.id))
             keytask = 'check_sms_campaign_pendingcall-%d' % (sms_campaign.id)
@@ -279,7 +295,7 @@ class sms_campaign_spool_contact(PeriodicTask):
     def run(self, **kwargs):
         logger.info("[SMS_TASK] TASK :: sms_campaign_spool_contact")
 
-        for campaign in SMSCampaign.objects.get_running_sms_campaign():
+        for campaign in sms_campaign_config.get_running_campaign():
             logger.info("[SMS_TASK] => Spool Contact : SMSCampaign name %s (id:%s)" %
                         (campaign.name, str(campaign.id)))
             # Start collecting the contacts for this campaign
@@ -395,7 +411,7 @@ class resend_sms_update_smscampaignsubscriber(PeriodicTask):
     def run(self, **kwargs):
         logger.warning("[SMS_TASK] TASK :: RESEND sms")
 
-        for sms_campaign in SMSCampaign.objects.get_running_sms_campaign():
+        for sms_campaign in sms_campaign_config.get_running_campaign():
             logger.info("[SMS_TASK] => SMS Campaign name %s (id:%s)" % (sms_campaign.name, sms_campaign.id))
             sms_maxretry = get_sms_maxretry(sms_campaign)
             limit = 1000
@@ -423,15 +439,15 @@ class resend_sms_update_smscampaignsubscriber(PeriodicTask):
                         subscriber.save()
                     else:
 
-                        text_message = subscriber.contact.replace_tag(subscriber.sms_campaign.text_message)
+                        text_message = subscriber.contact.replace_tag(sms_campaign.text_message)
                         logger.info("[SMS_TASK] SendMessage text_message:%s" % text_message)
 
                         # Create Message object
                         msg_obj = SMSMessage.objects.create(
                             content=text_message,
                             recipient_number=subscriber.contact.contact,
-                            sender=subscriber.sms_campaign.user,
-                            sender_number=subscriber.sms_campaign.callerid,
+                            sender=sms_campaign.user,
+                            sender_number=sms_campaign.callerid,
                             status='Unsent',
                             content_type=ContentType.objects.get(model='smscampaignsubscriber', app_label='mod_sms'),
                             object_id=subscriber.id,
@@ -439,7 +455,7 @@ class resend_sms_update_smscampaignsubscriber(PeriodicTask):
                         )
 
                         # Send sms
-                        SendMessage.delay(msg_obj.id, subscriber.sms_campaign.sms_gateway_id)
+                        SendMessage.delay(msg_obj.id, sms_campaign.sms_gateway_id)
 
                         subscriber.message = msg_obj
                         subscriber.last_attempt = datetime.utcnow().replace(tzinfo=utc)
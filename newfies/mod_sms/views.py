@@ -14,7 +14,7 @@
 
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required, permission_required
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect
 from django.shortcuts import render_to_response, get_object_or_404
 from django.db.models import Count
 from django.core.urlresolvers import reverse
@@ -29,18 +29,18 @@ from frontend.constants import SEARCH_TYPE
 from frontend_notification.views import frontend_send_notification
 from django_lets_go.common_functions import get_pagination_vars, ceil_strdate,\
     percentage, getvar, unset_session_var
-from mod_utils.helper import Export_choice
-from mod_sms.models import SMSCampaign, SMSCampaignSubscriber, SMSMessage
+from mod_utils.exporter import export_response
+from mod_sms.models import SMSCampaign, SMSCampaignSubscriber, SMSMessage, sms_campaign_config
 from mod_sms.constants import SMS_CAMPAIGN_STATUS, SMS_CAMPAIGN_COLUMN_NAME,\
     SMS_REPORT_COLUMN_NAME, COLOR_SMS_DISPOSITION, SMS_NOTIFICATION_NAME,\
     SMS_SUBSCRIBER_STATUS, SMS_MESSAGE_STATUS
 from mod_sms.forms import SMSCampaignForm, SMSDashboardForm, SMSSearchForm,\
     SMSCampaignSearchForm, DuplicateSMSCampaignForm
 from mod_sms.function_def import check_sms_dialer_setting, get_sms_notification_status
+from mod_sms.exporter import SMSExporter
 from datetime import datetime
 from django.utils.timezone import utc
 from dateutil.relativedelta import relativedelta
-import tablib
 import time
 
 
@@ -229,6 +229,7 @@ def sms_campaign_del(request, object_id):
         if sms_campaign_list:
             if stop_sms_campaign:
                 sms_campaign_list.update(status=SMS_CAMPAIGN_STATUS.END)
+                sms_campaign_config.invalidate()
                 request.session["msg"] = _('%(count)s sms campaign(s) are stopped.') % {'count': sms_campaign_list.count()}
             else:
                 request.session["msg"] = _('%(count)s sms campaign(s) are deleted.') % {'count': sms_campaign_list.count()}
@@ -810,46 +811,13 @@ def export_sms_report(request):
 
     **Important variable**:
 
-        * ``request.session['sms_record_kwargs']`` - stores sms query set
+        * ``request.session['sms_record_kwargs']`` - stores sms kwargs
 
     **Exported fields**: ['sender', 'recipient_number', 'send_date', 'uuid',
                'status', 'status_message', 'gateway']
+
+    CSV and JSON are streamed, XLS is written in the background
     """
     format_type = request.GET['format']
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(content_type='text/%s' % format_type)
-
-    # force download.
-    response['Content-Disposition'] = 'attachment;filename=sms_export.%s' % format_type
-    kwargs = {}
     kwargs = request.session['sms_record_kwargs']
-    qs = SMSMessage.objects.filter(**kwargs)
-
-    headers = ('sender', 'recipient_number', 'send_date', 'uuid',
-               'status', 'status_message', 'gateway')
-    list_val = []
-    for i in qs:
-        send_date = i.send_date
-        if format_type == Export_choice.JSON or format_type == Export_choice.XLS:
-            send_date = str(i.send_date)
-        gateway = i.gateway.name if i.gateway else ''
-        list_val.append([
-            i.sender.username,
-            i.recipient_number,
-            send_date,
-            str(i.uuid),
-            i.status,
-            i.status_message,
-            gateway,
-        ])
-
-    data = tablib.Dataset(*list_val, headers=headers)
-
-    if format_type == Export_choice.XLS:
-        response.write(data.xls)
-    elif format_type == Export_choice.CSV:
-        response.write(data.csv)
-    elif format_type == Export_choice.JSON:
-        response.write(data.json)
-
-    return response
+    return export_response(request, SMSExporter(request.user, kwargs), format_type, filename='sms_export')
@@ -0,0 +1,303 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.servers.basehttp import FileWrapper
+from django.db import connections, transaction
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.shortcuts import render_to_response
+from django.template.context import RequestContext
+from mod_utils.helper import Export_choice
+from collections import OrderedDict
+from datetime import date
+from uuid import uuid1
+import logging
+import tablib
+import time
+import json
+import csv
+import os
+
+logger = logging.getLogger('newfies.filelog')
+
+# Maximum number of rows of a sheet in the XLS format
+XLS_MAX_ROW = 65535
+
+
+class Echo(object):
+
+    """File-like object which returns the written value, to stream csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset):
+    """
+    Iterate on the rows of a values_list queryset in constant memory
+
+    On PostgreSQL the rows are read through a named (server-side) cursor
+    which fetches EXPORT_CHUNK_SIZE rows at a time, queryset.iterator()
+    is used on the other backends.
+    """
+    if settings.DATABASES[queryset.db]['ENGINE'] != 'django.db.backends.postgresql_psycopg2':
+        for row in queryset.iterator():
+            yield row
+        return
+    try:
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    except EmptyResultSet:
+        return
+    # A named cursor only lives in a transaction
+    with transaction.atomic(using=queryset.db):
+        cursor = connections[queryset.db].connection.cursor(name='export_%s' % uuid1().hex)
+        cursor.itersize = settings.EXPORT_CHUNK_SIZE
+        try:
+            cursor.execute(sql, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def format_value(value):
+    """Dates are exported as str() like the previous tablib exports"""
+    if isinstance(value, date):
+        return str(value)
+    return value
+
+
+def encode_value(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class Exporter(object):
+
+    """
+    Export the rows of a queryset, the rows are streamed in CSV or JSON
+    and written to a file in the background in XLS
+
+    Subclasses define the ``headers``, the ``fields`` read with values_list
+    and ``get_queryset``, ``format_row`` converts a row of values_list to
+    the exported row.
+
+    The exporter is built again by the celery worker from its class path,
+    the user and the kwargs, which need to be picklable.
+
+    **Usage**:
+
+        return export_response(request, VoIPCallExporter(request.user, kwargs), format_type)
+    """
+    headers = ()
+    fields = ()
+
+    def __init__(self, user, kwargs):
+        self.user = user
+        self.kwargs = kwargs
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get_headers(self):
+        return list(self.headers)
+
+    def format_row(self, row):
+        return row
+
+    def rows(self):
+        for row in iter_rows(self.get_queryset().values_list(*self.fields)):
+            yield [format_value(value) for value in self.format_row(row)]
+
+
+def csv_stream(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([encode_value(value) for value in headers])
+    for row in rows:
+        yield writer.writerow([encode_value(value) for value in row])
+
+
+def json_stream(headers, rows):
+    """
+    Stream a JSON list of objects like tablib, one object per line so
+    the export can also be read as JSON lines once the brackets removed
+    """
+    yield '['
+    separator = '\n'
+    for row in rows:
+        yield separator + json.dumps(OrderedDict(zip(headers, row)), cls=DjangoJSONEncoder)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+def export_job_key(job_id):
+    return 'export_job_%s' % job_id
+
+
+class ExportJob(object):
+
+    """
+    XLS export running in the background, the job is kept in the cache
+    during EXPORT_JOB_TIMEOUT seconds and polled by the export page
+
+    **Attributes**:
+
+        * ``job_id`` - ID of the job
+        * ``user_id`` - User who requested the export
+        * ``filename`` - Name of the file downloaded
+        * ``status`` - pending, running, done or failed
+        * ``row_count`` - Number of rows written
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, user_id, filename, **kwargs):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.filename = filename
+        self.status = kwargs.get('status', self.PENDING)
+        self.row_count = kwargs.get('row_count', 0)
+        self.error_msg = kwargs.get('error_msg', '')
+
+    @classmethod
+    def create(cls, user_id, filename):
+        job = cls(str(uuid1()), user_id, filename)
+        job.save()
+        return job
+
+    @classmethod
+    def get(cls, job_id):
+        """Return the job or None if it doesn't exist or expired"""
+        data = cache.get(export_job_key(job_id))
+        if data is None:
+            return None
+        return cls(**data)
+
+    @property
+    def path(self):
+        return os.path.join(settings.EXPORT_DIR, '%s.xls' % self.job_id)
+
+    def as_dict(self):
+        return {
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'filename': self.filename,
+            'status': self.status,
+            'row_count': self.row_count,
+            'error_msg': self.error_msg,
+        }
+
+    def save(self):
+        cache.set(export_job_key(self.job_id), self.as_dict(), settings.EXPORT_JOB_TIMEOUT)
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+def purge_export_dir():
+    """Remove the exported files older than EXPORT_JOB_TIMEOUT"""
+    expired = time.time() - settings.EXPORT_JOB_TIMEOUT
+    for filename in os.listdir(settings.EXPORT_DIR):
+        path = os.path.join(settings.EXPORT_DIR, filename)
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+        except OSError:
+            # Removed meanwhile by another worker
+            pass
+
+
+def write_xls(job, exporter):
+    """Write the rows of the exporter to the XLS file of the job"""
+    job.status = ExportJob.RUNNING
+    job.save()
+    try:
+        if not os.path.isdir(settings.EXPORT_DIR):
+            os.makedirs(settings.EXPORT_DIR)
+        purge_export_dir()
+        data = tablib.Dataset(headers=exporter.get_headers())
+        for row in exporter.rows():
+            if job.row_count >= XLS_MAX_ROW:
+                job.error_msg = 'the XLS format is limited to %d rows, export in CSV to get all the rows' \
+                    % XLS_MAX_ROW
+                break
+            data.append(row)
+            job.row_count += 1
+        with open(job.path, 'wb') as xls_file:
+            xls_file.write(data.xls)
+        job.status = ExportJob.DONE
+    except Exception as e:
+        logger.error("Export %s failed after %d rows: %s" % (job.job_id, job.row_count, str(e)))
+        job.status = ExportJob.FAILED
+        job.error_msg = unicode(e)
+    finally:
+        job.save()
+    return job
+
+
+def export_response(request, exporter, format_type, filename='export'):
+    """
+    Return the export of the rows in the format requested, CSV and JSON
+    are streamed, XLS is written by a celery task and the page returned
+    displays the download link once the file is ready
+    """
+    filename = '%s.%s' % (filename, format_type)
+    if format_type == Export_choice.CSV:
+        response = StreamingHttpResponse(csv_stream(exporter.get_headers(), exporter.rows()),
+                                         content_type='text/csv')
+    elif format_type == Export_choice.JSON:
+        response = StreamingHttpResponse(json_stream(exporter.get_headers(), exporter.rows()),
+                                         content_type='application/json')
+    elif format_type == Export_choice.XLS:
+        from mod_utils.tasks import export_xls_file
+        job = ExportJob.create(request.user.id, filename)
+        exporter_path = '%s.%s' % (exporter.__class__.__module__, exporter.__class__.__name__)
+        export_xls_file.delay(job.job_id, exporter_path, exporter.kwargs)
+        return render_to_response('frontend/export_job.html', {'export_job': job},
+                                  context_instance=RequestContext(request))
+    else:
+        return HttpResponse(content_type='text/%s' % format_type)
+    # force download.
+    response['Content-Disposition'] = 'attachment;filename=%s' % filename
+    return response
+
+
+def get_user_export_job(request, job_id):
+    job = ExportJob.get(job_id)
+    if job is None or job.user_id != request.user.id:
+        raise Http404
+    return job
+
+
+def export_job_status(request, job_id):
+    """Return the progress of the export job of the user in JSON"""
+    job = get_user_export_job(request, job_id)
+    return HttpResponse(json.dumps(job.as_dict()), content_type='application/json')
+
+
+def export_job_download(request, job_id):
+    """Return the file of the finished export job of the user"""
+    job = get_user_export_job(request, job_id)
+    if job.status != ExportJob.DONE or not os.path.isfile(job.path):
+        raise Http404
+    response = StreamingHttpResponse(FileWrapper(open(job.path, 'rb')), content_type='application/vnd.ms-excel')
+    response['Content-Disposition'] = 'attachment;filename=%s' % job.filename
+    response['Content-Length'] = os.path.getsize(job.path)
+    return response
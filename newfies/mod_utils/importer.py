@@ -0,0 +1,245 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import AutoField
+from django.http import HttpResponse, Http404
+from django_lets_go.common_functions import striplist
+from StringIO import StringIO
+from uuid import uuid1
+import logging
+import tempfile
+import json
+import csv
+import os
+
+logger = logging.getLogger('newfies.filelog')
+
+# Number of rows of the import displayed to the user
+IMPORT_DISPLAY_ROW = 100
+
+# Marker of the NULL values in the COPY data
+COPY_NULL = '\\N'
+
+
+def spool_upload(uploaded_file):
+    """
+    Write the uploaded file to IMPORT_SPOOL_DIR chunk by chunk and return
+    its path, the file is never loaded in memory
+    """
+    if not os.path.isdir(settings.IMPORT_SPOOL_DIR):
+        try:
+            os.makedirs(settings.IMPORT_SPOOL_DIR)
+        except OSError:
+            # Created meanwhile by another request
+            pass
+    fd, path = tempfile.mkstemp(suffix='.csv', dir=settings.IMPORT_SPOOL_DIR)
+    with os.fdopen(fd, 'wb') as spool_file:
+        for chunk in uploaded_file.chunks():
+            spool_file.write(chunk)
+    return path
+
+
+def import_job_key(job_id):
+    return 'import_job_%s' % job_id
+
+
+class ImportJob(object):
+
+    """
+    Progress of a CSV import running in the background, the job is kept in
+    the cache during IMPORT_JOB_TIMEOUT seconds and polled by the import page
+
+    **Attributes**:
+
+        * ``job_id`` - ID of the job
+        * ``user_id`` - User who uploaded the file
+        * ``status`` - pending, running, done or failed
+        * ``row_count`` - Number of rows read
+        * ``imported`` - Number of rows inserted
+        * ``error_count`` - Number of invalid rows
+        * ``progress`` - Percentage of the file read
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, user_id, **kwargs):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.status = kwargs.get('status', self.PENDING)
+        self.row_count = kwargs.get('row_count', 0)
+        self.imported = kwargs.get('imported', 0)
+        self.error_count = kwargs.get('error_count', 0)
+        self.progress = kwargs.get('progress', 0)
+        self.error_msg = kwargs.get('error_msg', '')
+        self.success_list = kwargs.get('success_list', [])
+        self.error_list = kwargs.get('error_list', [])
+
+    @classmethod
+    def create(cls, user_id):
+        job = cls(str(uuid1()), user_id)
+        job.save()
+        return job
+
+    @classmethod
+    def get(cls, job_id):
+        """Return the job or None if it doesn't exist or expired"""
+        data = cache.get(import_job_key(job_id))
+        if data is None:
+            return None
+        return cls(**data)
+
+    def as_dict(self):
+        return {
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'row_count': self.row_count,
+            'imported': self.imported,
+            'error_count': self.error_count,
+            'progress': self.progress,
+            'error_msg': self.error_msg,
+            'success_list': self.success_list,
+            'error_list': self.error_list,
+        }
+
+    def save(self):
+        cache.set(import_job_key(self.job_id), self.as_dict(), settings.IMPORT_JOB_TIMEOUT)
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def add_success(self, row):
+        if len(self.success_list) < IMPORT_DISPLAY_ROW:
+            self.success_list.append(row)
+
+    def add_error(self, row, error_msg):
+        self.error_count += 1
+        self.error_msg = error_msg
+        if len(self.error_list) < IMPORT_DISPLAY_ROW:
+            self.error_list.append(row)
+
+
+def copy_insert(model, list_obj):
+    """
+    Insert the objects like bulk_create, with COPY on PostgreSQL which is
+    several times faster than a multi-row INSERT
+    """
+    if settings.DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql_psycopg2':
+        model.objects.bulk_create(list_obj)
+        return
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_concrete_fields if not isinstance(f, AutoField)]
+    copy_data = StringIO()
+    writer = csv.writer(copy_data)
+    for obj in list_obj:
+        values = []
+        for f in fields:
+            value = f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+            if value is None:
+                value = COPY_NULL
+            elif isinstance(value, unicode):
+                value = value.encode('utf-8')
+            values.append(value)
+        writer.writerow(values)
+    copy_data.seek(0)
+    sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '%s')" % (
+        qn(model._meta.db_table), ', '.join(qn(f.column) for f in fields), COPY_NULL)
+    with transaction.atomic():
+        cursor = connection.cursor()
+        cursor.copy_expert(sql, copy_data)
+
+
+class CSVImporter(object):
+
+    """
+    Import a spooled CSV file in one pass, the rows are validated and
+    inserted by chunk of IMPORT_CHUNK_SIZE, the progress is saved on the job
+    after each chunk
+
+    Subclasses define the ``model`` and ``parse_row`` which returns the
+    object to insert or raises ValueError with the message displayed
+    to the user.
+
+    **Usage**:
+
+        job = ImportJob.create(request.user.id)
+        ContactImporter(job, phonebook_id).run(spool_upload(request.FILES['csv_file']))
+    """
+    model = None
+    delimiter = ','
+    quotechar = '"'
+
+    def __init__(self, job):
+        self.job = job
+
+    def parse_row(self, row):
+        raise NotImplementedError
+
+    def insert(self, list_obj):
+        copy_insert(self.model, list_obj)
+        self.job.imported += len(list_obj)
+
+    def run(self, path):
+        job = self.job
+        job.status = ImportJob.RUNNING
+        job.save()
+        bulk_record = []
+        try:
+            file_size = os.path.getsize(path) or 1
+            with open(path, 'rb') as csv_file:
+                for row in csv.reader(csv_file, delimiter=self.delimiter, quotechar=self.quotechar):
+                    row = striplist(row)
+                    if not row or not row[0]:
+                        continue
+                    job.row_count += 1
+                    try:
+                        obj = self.parse_row(row)
+                    except (ValueError, IndexError) as e:
+                        job.add_error(row, unicode(e))
+                        continue
+                    bulk_record.append(obj)
+                    job.add_success(row)
+
+                    if len(bulk_record) >= settings.IMPORT_CHUNK_SIZE:
+                        self.insert(bulk_record)
+                        bulk_record = []
+                        # The position is ahead of the csv reader by its read buffer
+                        job.progress = min(99, csv_file.tell() * 100 / file_size)
+                        job.save()
+
+            if bulk_record:
+                self.insert(bulk_record)
+            job.status = ImportJob.DONE
+            job.progress = 100
+        except Exception as e:
+            logger.error("Import %s failed after %d rows: %s" % (job.job_id, job.row_count, str(e)))
+            job.status = ImportJob.FAILED
+            job.error_msg = unicode(e)
+        finally:
+            job.save()
+            os.remove(path)
+        return job
+
+
+def import_job_status(request, job_id):
+    """Return the progress of the import job of the user in JSON"""
+    job = ImportJob.get(job_id)
+    if job is None or job.user_id != request.user.id:
+        raise Http404
+    return HttpResponse(json.dumps(job.as_dict()), content_type='application/json')
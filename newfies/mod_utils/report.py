@@ -0,0 +1,147 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, Http404
+import hashlib
+import json
+
+
+def report_job_id(report_path, user_id, kwargs):
+    """
+    ID of the report computed by report_path for the user with the kwargs,
+    the model instances of the kwargs are identified by their pk
+    """
+    params = sorted((key, getattr(value, 'pk', value)) for (key, value) in kwargs.items())
+    return hashlib.md5(repr((report_path, user_id, params))).hexdigest()
+
+
+def report_job_key(job_id):
+    return 'report_job_%s' % job_id
+
+
+class ReportJob(object):
+
+    """
+    Report computed by a celery task, the result is kept in the cache
+    during REPORT_CACHE_TIMEOUT seconds and shared by the pages of the
+    report, instead of being computed again or stored in the session
+
+    The report is a function taking the kwargs of the report and returning
+    a picklable result, built by the worker from its path.
+
+    **Attributes**:
+
+        * ``job_id`` - ID of the report, see report_job_id
+        * ``user_id`` - User of the report
+        * ``status`` - pending, running, done or failed
+        * ``data`` - Result of the report once done
+
+    **Usage**:
+
+        report_job = ReportJob.start('dialer_cdr.views.voipcall_report_data', request.user.id, kwargs)
+        if report_job.is_done():
+            daily_data = report_job.data
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id, user_id, **kwargs):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.status = kwargs.get('status', self.PENDING)
+        self.data = kwargs.get('data')
+        self.error_msg = kwargs.get('error_msg', '')
+
+    @classmethod
+    def start(cls, report_path, user_id, kwargs):
+        """
+        Return the job of the report, the report is computed in the
+        background unless it's already computed or running
+        """
+        from mod_utils.tasks import compute_report
+        job_id = report_job_id(report_path, user_id, kwargs)
+        job = cls.get(job_id)
+        if job is not None:
+            if job.status != cls.FAILED:
+                return job
+            # Compute the failed report again
+            cache.delete(report_job_key(job_id))
+        job = cls(job_id, user_id)
+        # Only one request starts the computation of the report
+        if cache.add(report_job_key(job_id), job.as_dict(), settings.REPORT_CACHE_TIMEOUT):
+            compute_report.delay(job_id, report_path, kwargs)
+        # The report is already computed with CELERY_ALWAYS_EAGER
+        return cls.get(job_id) or job
+
+    @classmethod
+    def get(cls, job_id):
+        """Return the job or None if it doesn't exist or expired"""
+        data = cache.get(report_job_key(job_id))
+        if data is None:
+            return None
+        return cls(**data)
+
+    def as_dict(self):
+        return {
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'data': self.data,
+            'error_msg': self.error_msg,
+        }
+
+    def save(self):
+        cache.set(report_job_key(self.job_id), self.as_dict(), settings.REPORT_CACHE_TIMEOUT)
+
+    def is_done(self):
+        return self.status == self.DONE
+
+
+class PageList(object):
+
+    """
+    Paginate a queryset with the count computed by a report job, the pages
+    are slices of the queryset and the count query isn't run again on each
+    page
+    """
+
+    def __init__(self, queryset, count):
+        self.queryset = queryset
+        self._count = count
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return self.queryset[index]
+
+
+def report_job_status(request, job_id):
+    """Return the status of the report job of the user in JSON, without its data"""
+    job = ReportJob.get(job_id)
+    if job is None or job.user_id != request.user.id:
+        raise Http404
+    status = {
+        'job_id': job.job_id,
+        'status': job.status,
+        'error_msg': job.error_msg,
+    }
+    return HttpResponse(json.dumps(status), content_type='application/json')
@@ -0,0 +1,74 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from django.contrib.auth.models import User
+from django.utils.module_loading import import_string
+from celery.decorators import task
+from celery.utils.log import get_task_logger
+from mod_utils.exporter import ExportJob, write_xls
+from mod_utils.report import ReportJob
+
+logger = get_task_logger(__name__)
+
+
+@task(ignore_result=True)
+def export_xls_file(job_id, exporter_path, kwargs):
+    """
+    Write the XLS export requested by a report view, the file is
+    downloaded from the export page once the job is done
+
+    **Attributes**:
+
+        * ``job_id`` - ExportJob ID
+        * ``exporter_path`` - Class path of the Exporter
+        * ``kwargs`` - Filters of the report
+    """
+    job = ExportJob.get(job_id)
+    if job is None:
+        logger.error("Export job %s expired" % job_id)
+        return False
+    user = User.objects.get(pk=job.user_id)
+    exporter = import_string(exporter_path)(user, kwargs)
+    job = write_xls(job, exporter)
+    logger.info("Export %s: %d row(s) written" % (job_id, job.row_count))
+    return True
+
+
+@task(ignore_result=True)
+def compute_report(job_id, report_path, kwargs):
+    """
+    Compute the report requested by a report view, the result is kept on
+    the report job until it expires
+
+    **Attributes**:
+
+        * ``job_id`` - ReportJob ID
+        * ``report_path`` - Path of the function computing the report
+        * ``kwargs`` - Filters of the report
+    """
+    job = ReportJob.get(job_id)
+    if job is None:
+        logger.error("Report job %s expired" % job_id)
+        return False
+    job.status = ReportJob.RUNNING
+    job.save()
+    try:
+        job.data = import_string(report_path)(kwargs)
+        job.status = ReportJob.DONE
+    except Exception as e:
+        logger.error("Report %s (%s) failed: %s" % (job_id, report_path, str(e)))
+        job.status = ReportJob.FAILED
+        job.error_msg = unicode(e)
+    job.save()
+    return True
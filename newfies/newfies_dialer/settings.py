@@ -493,6 +493,103 @@ HEARTBEAT_MIN = 1  # accepted value from 1 to 10
 # Delay outbound call of X seconds
 DELAY_OUTBOUND = 0
 
+# The ticks of the campaigns run in parallel, a campaign is locked during
+# its tick, the lock expires after X seconds if the worker dies
+CAMPAIGN_LOCK_EXPIRE = 300
+
+# The started campaigns and their configuration are cached per worker,
+# reloaded when a campaign is saved or after X seconds
+CAMPAIGN_CONFIG_TIMEOUT = 300
+
+# The new contacts of the phonebooks are imported into the subscribers of
+# the campaigns by chunk of SUBSCRIBER_SPOOL_CHUNK contacts, at most
+# SUBSCRIBER_SPOOL_MAX contacts are read per campaign and per minute
+SUBSCRIBER_SPOOL_CHUNK = 10000
+SUBSCRIBER_SPOOL_MAX = 100000
+# The contacts created less than X seconds ago below the high-water mark are
+# scanned again, to import the contacts of the transactions committed late.
+# X must be at least twice the duration of the longest transaction inserting
+# contacts (an import chunk of IMPORT_CHUNK_SIZE rows)
+SUBSCRIBER_SPOOL_RESCAN_DELAY = 600
+
+# The contacts created are added to the running campaigns by a sync of their
+# phonebook delayed of X seconds, the contacts created meanwhile are batched
+SUBSCRIBER_SYNC_DELAY = 10
+
+# The CSV files of contacts and DNC contacts uploaded are spooled to
+# IMPORT_SPOOL_DIR, which must be shared by the web servers and the celery
+# workers, then imported in the background by chunk of IMPORT_CHUNK_SIZE rows.
+# The progress of an import is kept IMPORT_JOB_TIMEOUT seconds
+IMPORT_SPOOL_DIR = os.path.join(APPLICATION_DIR, 'import_spool')
+IMPORT_CHUNK_SIZE = 5000
+IMPORT_JOB_TIMEOUT = 86400
+
+# The CSV and JSON exports are streamed from the database by chunk of
+# EXPORT_CHUNK_SIZE rows. The XLS exports are written in the background to
+# EXPORT_DIR, which must be shared by the web servers and the celery workers,
+# and can be downloaded during EXPORT_JOB_TIMEOUT seconds
+EXPORT_DIR = os.path.join(APPLICATION_DIR, 'export_spool')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_JOB_TIMEOUT = 86400
+
+# The CDR and survey reports are computed in the background and kept
+# REPORT_CACHE_TIMEOUT seconds per user and search, the pages and the
+# searches repeated meanwhile are served from the computed report
+REPORT_CACHE_TIMEOUT = 300
+
+# The calls of the customer dashboard are cached X seconds per user,
+# campaign and search type
+DASHBOARD_CACHE_TIMEOUT = 60
+
+# Pace the calls of the campaigns with a token bucket, the speed is reduced
+# down to PACING_MIN_FACTOR when the calls spooled are not originated in time
+# or when there are more live channels than expected from the answer rate
+# and the duration of the calls of the last PACING_STATS_WINDOW seconds
+CAMPAIGN_PACING = True
+PACING_KP = 0.5
+PACING_KI = 0.2
+PACING_MIN_FACTOR = 0.1
+PACING_STATS_WINDOW = 300
+PACING_CHANNEL_MARGIN = 1.5
+# The calls still pending PACING_BACKLOG_TICKS ticks after they were due are
+# stale, they are left out of the backlog so they don't throttle the campaign
+PACING_BACKLOG_TICKS = 10
+
+# DNC lists are indexed in memory per worker, the new DNC contacts are
+# added every DNC_INDEX_REFRESH seconds and the lists are fully reloaded
+# every DNC_INDEX_RELOAD seconds, or when contacts have been deleted.
+# The index is only used when DNC_EXCLUDE_ON_CLAIM is False
+DNC_INDEX_REFRESH = 30
+DNC_INDEX_RELOAD = 3600
+DNC_INDEX_CHUNK = 100000
+
+# Exclude the DNC contacts with an anti-join when claiming the subscribers.
+# The two approaches are mutually exclusive: set to True to exclude them in
+# the database, then the DNC index above is not used; set to False to check
+# each tick against the DNC index of the worker instead
+DNC_EXCLUDE_ON_CLAIM = True
+
+# Calls spooled during ORIGINATE_BATCH_DURATION seconds are originated by a
+# single task through one ESL connection, set to 0 to fire one task per call
+ORIGINATE_BATCH_DURATION = 10
+
+# Number of call_event processed per task, set to 0 to fire one task per call_event
+CALLEVENT_BATCH_SIZE = 200
+
+# call_event claimed but not processed X seconds after their claim are
+# requeued (worker crashed before saving their CDRs)
+CALLEVENT_REQUEUE_DELAY = 3600
+# call_event requeued X times are flagged failed instead of being requeued again
+CALLEVENT_MAX_REQUEUE = 3
+
+# CDRs are buffered per worker process and saved in bulk when the buffer
+# reaches CDR_BUFFER_SIZE rows or after CDR_BUFFER_DELAY milliseconds
+CDR_BUFFER_SIZE = 500
+CDR_BUFFER_DELAY = 1000
+# Failed flushes retried before the buffered CDRs are saved one by one, the
+# CDRs which still fail are dropped and their call_event flagged failed
+CDR_BUFFER_MAX_RETRY = 10
+
 # Audio Convertion
 # ================
 
@@ -514,6 +611,26 @@ ESL_HOSTNAME = '127.0.0.1'
 ESL_PORT = '8021'
 ESL_SECRET = 'ClueCon'
 ESL_SCRIPT = '&lua(/usr/share/newfies-lua/newfies.lua)'
+# Persistent ESL connections kept open per worker process and FreeSWITCH host
+ESL_POOL_SIZE = 2
+# Pool size for specific hosts, e.g. {'127.0.0.1': 4}
+ESL_POOL_SIZE_PER_HOST = {}
+
+# FREESWITCH NODES
+# ================
+# Calls are routed to the least loaded node (calls in flight / weight),
+# nodes reaching max_channels (0 for no limit) are skipped.
+# When empty, the calls are sent to ESL_HOSTNAME
+# FREESWITCH_NODES = [
+#     {'hostname': '10.0.0.1', 'port': '8021', 'secret': 'ClueCon', 'weight': 2, 'max_channels': 600},
+#     {'hostname': '10.0.0.2', 'port': '8021', 'secret': 'ClueCon', 'weight': 1, 'max_channels': 300},
+# ]
+FREESWITCH_NODES = []
+# Seconds a node is skipped after a connection failure
+FREESWITCH_NODE_DOWN_DELAY = 30
+# The calls in flight per node are rebuilt every X seconds from the
+# callrequests still calling, to recover the channels of the lost hangups
+FREESWITCH_NODE_RECONCILE = 300
 
 # TEXT-TO-SPEECH
 # ==============
@@ -0,0 +1,46 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from dialer_cdr.models import VoIPCall
+from survey.pivot import SurveyResultPivot
+from mod_utils.exporter import Exporter, format_value
+
+
+class SurveyCallExporter(Exporter):
+
+    """
+    Export the calls of the survey report with a column per question of
+    the survey, the kwargs are the filters of the report
+    (``request.session['session_surveycalls_kwargs']``)
+    """
+    headers = ('starting_date', 'phone_number', 'duration', 'disposition')
+    fields = ('starting_date', 'phone_number', 'duration', 'disposition')
+
+    def __init__(self, user, kwargs):
+        super(SurveyCallExporter, self).__init__(user, kwargs)
+        campaign_obj = kwargs['callrequest__campaign']
+        survey_id = None
+        if campaign_obj.content_type.model == 'survey':
+            survey_id = int(campaign_obj.object_id)
+        self.pivot = SurveyResultPivot(survey_id)
+
+    def get_queryset(self):
+        return VoIPCall.objects.filter(**self.kwargs)
+
+    def get_headers(self):
+        return list(self.headers) + [question.replace(',', ' ') for question in self.pivot.get_questions()]
+
+    def rows(self):
+        for row in self.pivot.iter_rows(self.get_queryset(), self.fields):
+            yield [format_value(value) for value in row]
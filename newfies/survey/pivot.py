@@ -0,0 +1,93 @@
+#
+# Newfies-Dialer License
+# http://www.newfies-dialer.org
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright (C) 2011-2015 Star2Billing S.L.
+#
+# The primary maintainer of this project is
+# Arezqui Belaid <info@star2billing.com>
+#
+
+from survey.models import Section, Result
+from mod_utils.exporter import iter_rows
+
+# Fields of the results joined on the calls, through the callrequest
+RESULT_FIELDS = ('callrequest__survey_callrequest__section',
+                 'callrequest__survey_callrequest__response',
+                 'callrequest__survey_callrequest__record_file')
+
+
+class SurveyResultPivot(object):
+
+    """
+    Pivot the survey results of the calls, one row per call with a column
+    per section of the survey
+
+    The sections are read once and the results of the calls are read in
+    one query ordered by call, so a report or an export runs the same
+    number of queries whatever the number of calls and sections.
+
+    **Usage**:
+
+        pivot = SurveyResultPivot(survey_id)
+        headers = ['phone_number'] + pivot.get_questions()
+        for row in pivot.iter_rows(VoIPCall.objects.filter(**kwargs), ('phone_number', )):
+            ...
+    """
+
+    def __init__(self, survey_id):
+        self.section_list = list(Section.objects.filter(survey_id=survey_id)
+                                 .order_by('order', 'id').values_list('id', 'question'))
+        self.section_index = dict((section_id, index)
+                                  for index, (section_id, question) in enumerate(self.section_list))
+
+    def get_questions(self):
+        return [question for (section_id, question) in self.section_list]
+
+    def set_answer(self, answer_list, section_id, response, record_file):
+        """The answer of a record section is its recorded file"""
+        index = self.section_index.get(section_id)
+        if index is not None:
+            answer_list[index] = record_file or response
+
+    def iter_rows(self, voipcall_list, fields):
+        """
+        Yield the fields of each call followed by its answers, the results
+        are LEFT JOINed on the calls in one query ordered by call and
+        grouped in a single pass
+        """
+        if not self.section_list:
+            for row in iter_rows(voipcall_list.values_list(*fields)):
+                yield list(row)
+            return
+
+        field_count = len(fields)
+        current_id = None
+        for row in iter_rows(voipcall_list.order_by('id').values_list('id', *(tuple(fields) + RESULT_FIELDS))):
+            if row[0] != current_id:
+                if current_id is not None:
+                    yield call_row + answer_list
+                current_id = row[0]
+                call_row = list(row[1:field_count + 1])
+                answer_list = [''] * len(self.section_list)
+            self.set_answer(answer_list, *row[field_count + 1:])
+        if current_id is not None:
+            yield call_row + answer_list
+
+    def get_answers(self, callrequest_ids):
+        """
+        Return the answers of each callrequest in one query, used for the
+        page of calls displayed by a report
+        """
+        answer_dict = dict((callrequest_id, [''] * len(self.section_list)) for callrequest_id in callrequest_ids)
+        if not self.section_list or not answer_dict:
+            return answer_dict
+        for (callrequest_id, section_id, response, record_file) in Result.objects\
+                .filter(callrequest_id__in=answer_dict.keys())\
+                .values_list('callrequest_id', 'section_id', 'response', 'record_file'):
+            self.set_answer(answer_dict[callrequest_id], section_id, response, record_file)
+        return answer_dict
@@ -20,6 +20,8 @@ from django.db.models.signals import post_save
 from survey.models import Survey, Survey_template, Section,\
     Section_template, Branching, Branching_template, Result, \
     ResultAggregate, post_save_add_script
+from survey.pivot import SurveyResultPivot
+from dialer_cdr.models import VoIPCall
 from survey.forms import SurveyForm, PlayMessageSectionForm,\
     MultipleChoiceSectionForm, RatingSectionForm,\
     CaptureDigitsSectionForm, RecordMessageSectionForm,\
@@ -670,6 +672,23 @@ class SurveyModel(TestCase):
 
         form = SurveyDetailReportForm(self.user)
 
+    def test_survey_result_pivot(self):
+        """The answers of the calls are pivoted with a column per section"""
+        pivot = SurveyResultPivot(self.section.survey_id)
+        question_list = pivot.get_questions()
+        self.assertEqual(len(question_list), Section.objects.filter(survey_id=self.section.survey_id).count())
+        index = pivot.section_index[self.section.id]
+
+        answer_dict = pivot.get_answers([1])
+        self.assertEqual(answer_dict[1][index], 'apple')
+
+        voipcall_list = VoIPCall.objects.filter(callrequest_id=1)
+        row_list = list(pivot.iter_rows(voipcall_list, ('phone_number', )))
+        self.assertEqual(len(row_list), voipcall_list.count())
+        for row in row_list:
+            self.assertEqual(len(row), 1 + len(question_list))
+            self.assertEqual(row[1 + index], 'apple')
+
     def teardown(self):
         self.survey_template.delete()
         self.survey.delete()
@@ -17,12 +17,11 @@ from django.contrib.auth.decorators import login_required,\
     permission_required
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render_to_response, get_object_or_404
-from django.db.models import Sum, Avg, Count
 from django.template.context import RequestContext
 from django.utils.translation import ugettext as _
 from django.db.models.signals import post_save
 from django.utils.timezone import utc
-from dialer_cdr.models import VoIPCall
+from dialer_cdr.models import VoIPCall, VoIPCallRollup
 from dialer_cdr.constants import CALL_DISPOSITION
 from survey.models import Survey_template, Survey, Section_template, Section,\
     Branching_template, Branching, Result, ResultAggregate
@@ -38,12 +37,14 @@ from survey.models import post_save_add_script
 from survey.function_def import getaudio_acapela
 from django_lets_go.common_functions import striplist, ceil_strdate, getvar, unset_session_var,\
     get_pagination_vars
-from mod_utils.helper import Export_choice
+from mod_utils.exporter import export_response
+from survey.exporter import SurveyCallExporter
+from survey.pivot import SurveyResultPivot
+from mod_utils.report import ReportJob, PageList
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import subprocess
 import hashlib
-import tablib
 import csv
 import os
 
@@ -733,23 +734,15 @@ def sealed_survey_view(request, object_id):
     return render_to_response('survey/sealed_survey_view.html', data, context_instance=RequestContext(request))
 
 
-def survey_cdr_daily_report(all_call_list):
-    """Get survey voip call daily report"""
+def survey_cdr_daily_report(kwargs):
+    """Get survey voip call daily report of the VoIPCall filter from the CDR rollups"""
     max_duration = 0
     total_duration = 0
     total_calls = 0
     total_avg_duration = 0
 
-    # Daily Survey VoIP call report
-    select_data = {"starting_date": "SUBSTR(CAST(starting_date as CHAR(30)),1,10)"}
-
-    # Get Total from VoIPCall table for Daily Call Report
-    total_data = all_call_list.extra(select=select_data)\
-        .values('starting_date')\
-        .annotate(Count('starting_date'))\
-        .annotate(Sum('duration'))\
-        .annotate(Avg('duration'))\
-        .order_by('-starting_date')
+    # Get Total from the daily CDR rollups for Daily Call Report
+    total_data = VoIPCallRollup.objects.daily_data(kwargs)
 
     # Following code will count total voip calls, duration
     if total_data:
@@ -769,6 +762,13 @@ def survey_cdr_daily_report(all_call_list):
     return survey_cdr_daily_data
 
 
+def survey_report_data(kwargs):
+    """Daily data and number of calls of the survey report, computed by a ReportJob"""
+    data = survey_cdr_daily_report(kwargs)
+    data['call_count'] = VoIPCall.objects.filter(**kwargs).count()
+    return data
+
+
 def get_survey_result(survey_result_kwargs):
     """Get survey result report from the selected Survey"""
     survey_result = ResultAggregate.objects.values('section__question', 'response', 'count')\
@@ -805,6 +805,10 @@ def survey_report(request):
     **Logic Description**:
 
         * List all survey_report which belong to the logged in user.
+        * The answers of the calls of the page are pivoted by
+          ``SurveyResultPivot``, one column per section of the survey.
+        * The daily report and the number of calls are computed in the
+          background by a ReportJob, shared by the pages of the report.
     """
     tday = datetime.today()
     from_date = tday.strftime("%Y-%m-%d")
@@ -821,6 +825,7 @@ def survey_report(request):
         'total_calls': '',
         'total_avg_duration': '',
         'max_duration': '',
+        'call_count': 0,
     }
 
     sort_col_field_list = ['starting_date', 'phone_number', 'duration', 'disposition', 'id']
@@ -836,7 +841,6 @@ def survey_report(request):
         post_var_with_page = 1
         # set session var value
         request.session['session_surveycalls_kwargs'] = {}
-        request.session['session_survey_cdr_daily_data'] = {}
         # set session var value
         field_list = ['from_date', 'to_date', 'survey_id']
         unset_session_var(request, field_list)
@@ -900,6 +904,8 @@ def survey_report(request):
         survey_result_kwargs['created_date__lte'] = end_date
 
     all_call_list = []
+    survey_question_list = []
+    report_job = None
     try:
         survey_result_kwargs['survey_id'] = survey_id
         survey_result = get_survey_result(survey_result_kwargs)
@@ -910,17 +916,23 @@ def survey_report(request):
         # List of Survey VoIP call report
         voipcall_list = VoIPCall.objects.filter(**kwargs)
         request.session['session_surveycalls_kwargs'] = kwargs
-        all_call_list = voipcall_list.values_list('id', flat=True)
 
-        # Get daily report from session while using pagination & sorting
+        # The daily report is computed in the background and shared by the pages
+        report_job = ReportJob.start('survey.views.survey_report_data', request.user.id, kwargs)
+        if report_job.is_done():
+            survey_cdr_daily_data = report_job.data
+        all_call_list = PageList(voipcall_list.values_list('id', flat=True), survey_cdr_daily_data['call_count'])
         if request.GET.get('page') or request.GET.get('sort_by'):
-            survey_cdr_daily_data = request.session['session_survey_cdr_daily_data']
             action = 'tabs-2'
-        else:
-            survey_cdr_daily_data = survey_cdr_daily_report(voipcall_list)
-            request.session['session_survey_cdr_daily_data'] = survey_cdr_daily_data
 
-        rows = voipcall_list.order_by(pag_vars['sort_order'])[pag_vars['start_page']:pag_vars['end_page']]
+        rows = list(voipcall_list.order_by(pag_vars['sort_order'])[pag_vars['start_page']:pag_vars['end_page']])
+
+        # Answers of the calls of the page, in one query
+        pivot = SurveyResultPivot(survey_id)
+        survey_question_list = pivot.get_questions()
+        answer_dict = pivot.get_answers([row.callrequest_id for row in rows if row.callrequest_id])
+        for row in rows:
+            row.survey_answer_list = answer_dict.get(row.callrequest_id, [''] * len(survey_question_list))
     except:
         rows = []
         if request.method == 'POST':
@@ -929,8 +941,9 @@ def survey_report(request):
     data = {
         'rows': rows,
         'all_call_list': all_call_list,
-        'call_count': all_call_list.count() if all_call_list else 0,
+        'call_count': survey_cdr_daily_data['call_count'],
         'SURVEY_CALL_RESULT_NAME': SURVEY_CALL_RESULT_NAME,
+        'survey_question_list': survey_question_list,
         'col_name_with_order': pag_vars['col_name_with_order'],
         'total_data': survey_cdr_daily_data['total_data'],
         'total_duration': survey_cdr_daily_data['total_duration'],
@@ -945,6 +958,7 @@ def survey_report(request):
         'start_date': start_date,
         'end_date': end_date,
         'campaign_obj': campaign_obj,
+        'report_job': report_job,
     }
     request.session['msg'] = ''
     request.session['err_msg'] = ''
@@ -957,75 +971,19 @@ def export_surveycall_report(request):
 
     **Important variable**:
 
-        * ``request.session['surveycall_record_qs']`` - stores survey voipcall
-            query set
+        * ``request.session['session_surveycalls_kwargs']`` - stores survey
+            voipcall kwargs
 
     **Exported fields**: ['starting_date', 'phone_number', 'duration',
                           'disposition', 'survey results']
+
+    CSV and JSON are streamed, XLS is written in the background
     """
     format_type = request.GET['format']
-    # get the response object, this can be used as a stream.
-    response = HttpResponse(content_type='text/%s' % format_type)
-    # force download.
-    response['Content-Disposition'] = 'attachment;filename=export.%s' % format_type
-    if request.session.get('session_surveycalls_kwargs'):
-        kwargs = request.session.get('session_surveycalls_kwargs')
-        campaign_obj = kwargs['callrequest__campaign']
-        qs = VoIPCall.objects.filter(**kwargs)
-        column_list_base = ['starting_date', 'phone_number', 'duration', 'disposition']
-        column_list = list(column_list_base)
-
-        survey_qst = False
-        if campaign_obj.content_type.model == 'survey':
-            survey_qst = Section.objects.filter(survey_id=int(campaign_obj.object_id))
-            for i in survey_qst:
-                column = unicode(i.question.replace(',', ' '))
-                column_list.append(column.encode('utf-8'))
-
-        result_row = []
-        for voipcall in qs:
-            result_row_list = []
-            # For each voip call retrieve the results of the survey nodes
-            results = Result.objects.filter(callrequest=voipcall.callrequest_id).order_by('section')
-
-            result_list = {}
-            # We will prepare a dictionary result_list to help exporting the result
-            for result in results:
-                column = unicode(result.section.question.replace(',', ' '))
-                if result.record_file and len(result.record_file) > 0:
-                    result_list[column.encode('utf-8')] = result.record_file
-                else:
-                    result_list[column.encode('utf-8')] = result.response
-
-            # We will build result_row_list which will be a value for each element from column_list
-            for ikey in column_list:
-                if ikey in column_list_base:
-                    # This is not a Section result
-                    if ikey == 'starting_date' \
-                       and format_type == Export_choice.JSON \
-                       or format_type == Export_choice.XLS:
-                        starting_date = str(voipcall.__dict__[ikey])
-                        result_row_list.append(starting_date)
-                    else:
-                        result_row_list.append(voipcall.__dict__[ikey])
-                else:
-                    # This is a Section result
-                    if ikey in result_list:
-                        result_row_list.append(result_list[ikey].encode('utf-8'))
-                    else:
-                        # Add empty result
-                        result_row_list.append("")
-
-            result_row.append(result_row_list)
-
-        data = tablib.Dataset(*result_row, headers=tuple(column_list))
-        if format_type == Export_choice.XLS:
-            response.write(data.xls)
-        elif format_type == Export_choice.CSV:
-            response.write(data.csv)
-        elif format_type == Export_choice.JSON:
-            response.write(data.json)
-    return response
+    if not request.session.get('session_surveycalls_kwargs'):
+        return HttpResponse(content_type='text/%s' % format_type)
+    kwargs = request.session.get('session_surveycalls_kwargs')
+    return export_response(request, SurveyCallExporter(request.user, kwargs), format_type)
 
 
 @login_required
@@ -13,6 +13,7 @@
 #
 
 from django.db import models
+from django.db.models.signals import post_save
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext_lazy as _
 from django_lets_go.language_field import LanguageField
@@ -213,3 +214,17 @@ class CalendarUserProfile(Profile_abstract):
 
 # Create calendar user profile object
 CalendarUser.profile = property(lambda u: CalendarUserProfile.objects.get_or_create(user=u)[0])
+
+
+def post_save_userprofile(sender, **kwargs):
+    """A ``post_save`` signal is sent by the UserProfile model instance
+    whenever it is saved.
+
+    The started campaigns cached by the workers are reloaded, they hold the
+    dialer setting of their user profile
+    """
+    # Avoid a circular import, survey.models imports dialer_campaign.models
+    from dialer_campaign.models import campaign_config
+    campaign_config.invalidate()
+
+post_save.connect(post_save_userprofile, sender=UserProfile)